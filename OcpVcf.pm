@@ -0,0 +1,45 @@
+# Shared VCF helpers for the OCP Perl reporters. Each script loads it from its
+# own directory with:
+#
+#     use File::Basename;
+#     use lib dirname($0);
+#     use OcpVcf;
+#
+# 10/17/2026
+################################################################################
+package OcpVcf;
+
+use warnings;
+use strict;
+
+use Exporter qw(import);
+our @EXPORT = qw(open_vcf close_vcf);
+our $VERSION = '1.0.101726';
+
+sub open_vcf {
+    # Transparently read bgzip / gzip compressed (.vcf.gz) VCF files too.
+    my $vcf = shift;
+    my $fh;
+    if ($vcf =~ /\.gz$/) {
+        open($fh, '-|', 'gzip', '-dc', $vcf)
+            or die "ERROR: Can not run 'gzip -dc $vcf': $!\n";
+    } else {
+        open($fh, '<', $vcf) or die "ERROR: Can not open '$vcf': $!\n";
+    }
+    return $fh;
+}
+
+sub close_vcf {
+    # Close a handle from open_vcf(). If we stopped reading a compressed VCF
+    # before the end (e.g. only wanted the header), gzip gets a SIGPIPE (or a
+    # write error) once we close our end, and that's not an error. Not under
+    # autodie, since its close() dies on any non-zero exit from the pipe.
+    my ($fh, $vcf) = @_;
+    my $done = eof($fh);
+    return 1 if close($fh);
+    die "ERROR: Can not close '$vcf': $!\n" if $!;
+    return 1 unless $done;
+    die "ERROR: gzip failed reading '$vcf' (exit status ", $? >> 8, ")\n";
+}
+
+1;
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Generate synthetic Oncomine (OCA / OCP) VCF files for benchmarking the tools
+# in this package.
+#
+# 10/17/2026
+################################################################################
+"""
+Generate a cohort of synthetic Ion Reporter VCF files that look like the ones
+from the Oncomine Comprehensive Assay. Each file has the `##mapd`,
+`##TotalMappedFusionPanelReads` and `##OncomineVariantAnnotationToolVersion`
+headers, and a configurable number of SNVs / Indels, `<CNV>` records, fusion
+pairs (`SVTYPE=Fusion`, two lines each) and `ExprControl` lines. A panel JSON
+mapping the RNA assays to pools (for `match_rna_qc.pl` and
+`get_metrics_from_vcf.py`) is written along with the VCFs. With `--bam_reads`,
+a small BGZF compressed DNA and RNA BAM with an Ion Torrent style header (for
+`match_delinker.py`) is made for each sample too. The data is random, but
+seeded, so the same options always give the same files.
+"""
+import os
+import sys
+import json
+import struct
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ocp_vcf
+
+version = '1.1.101726'
+
+genes = ('AKT1', 'ALK', 'BRAF', 'CCND1', 'CDK4', 'CTNNB1', 'EGFR', 'ERBB2',
+    'FGFR1', 'FGFR2', 'FGFR3', 'GNA11', 'GNAQ', 'HRAS', 'IDH1', 'IDH2', 'KIT',
+    'KRAS', 'MDM2', 'MET', 'MYC', 'MYCN', 'NRAS', 'PIK3CA', 'PTEN', 'RET',
+    'SMO', 'TP53')
+fusion_drivers = ('ALK', 'BRAF', 'FGFR2', 'FGFR3', 'NTRK1', 'NTRK2', 'RET',
+    'ROS1')
+fusion_partners = ('CCDC6', 'EML4', 'ETV6', 'KIF5B', 'NCOA4', 'SLC34A2',
+    'TACC3', 'TPM3')
+expr_controls = ('ABCF1', 'ACTB', 'GAPDH', 'GUSB', 'HMBS', 'ITGB7', 'LMNA',
+    'LRP1', 'MYC', 'TBP', 'TFRC', 'TUBB')
+functions = ('missense', 'nonsense', 'frameshiftDeletion',
+    'frameshiftInsertion', 'nonframeshiftDeletion', 'synonymous')
+bases = 'ACGT'
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument(
+        'outdir',
+        metavar='<output_dir>',
+        help='Directory to write the VCF files and panel JSON to.'
+    )
+    parser.add_argument(
+        '-n', '--num_samples',
+        metavar='<INT>',
+        type=int,
+        default=1,
+        help='Number of VCF files to make (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--snvs',
+        metavar='<INT>',
+        type=int,
+        default=200,
+        help='Number of SNV / Indel records per VCF (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--cnvs',
+        metavar='<INT>',
+        type=int,
+        default=50,
+        help='Number of <CNV> records per VCF (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--fusions',
+        metavar='<INT>',
+        type=int,
+        default=100,
+        help='Number of fusion pairs (two lines each) per VCF (DEFAULT: '
+            '%(default)s)'
+    )
+    parser.add_argument(
+        '--expr',
+        metavar='<INT>',
+        type=int,
+        default=len(expr_controls),
+        help='Number of ExprControl lines per VCF (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--bam_reads',
+        metavar='<INT>',
+        type=int,
+        default=0,
+        help='Number of reads in the DNA and RNA BAM made for each sample, or '
+            '0 for no BAMs (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--ovat',
+        metavar='<version>',
+        default='2.5.1',
+        help='OncomineVariantAnnotationToolVersion to put in the header '
+            '(DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--seed',
+        metavar='<INT>',
+        type=int,
+        default=1,
+        help='Random seed (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version = '%(prog)s - ' + version
+    )
+    return parser.parse_args()
+
+def sample_names(num_samples):
+    """
+    Return (MSN, file name) pairs, with file names laid out like the ones that
+    `collate_moi_reports.py` expects (<DNA sample>_<RNA sample>.vcf).
+    """
+    width = max(4, len(str(num_samples)))
+    names = []
+    for i in range(1, num_samples + 1):
+        msn = 'MSN' + str(i).zfill(width)
+        names.append((msn, '{0}_DNA_{0}_RNA.vcf'.format(msn)))
+    return names
+
+def expr_assays(num_expr):
+    return ['{}_{}'.format(expr_controls[i % len(expr_controls)],
+        i // len(expr_controls) + 1) for i in range(num_expr)]
+
+def fusion_assays(num_fusions):
+    assays = []
+    for i in range(num_fusions):
+        driver = fusion_drivers[i % len(fusion_drivers)]
+        partner = fusion_partners[(i // len(fusion_drivers))
+            % len(fusion_partners)]
+        assays.append((partner, driver, '{}-{}.{}{}.COSF{}'.format(partner,
+            driver, 'E%d' % (i % 20 + 1), 'R%d' % (i % 15 + 1), 1000 + i)))
+    return assays
+
+def write_panel(outdir, num_expr, num_fusions):
+    """
+    Write a panel JSON in the layout used by `match_rna_qc.pl`, with the RNA
+    assays spread across pool1, pool2, and both pools.
+    """
+    pools = ('pool1', 'pool2', 'pool1,2')
+    panel = {'ExprControl' : {}, 'GeneExpression' : {}, 'Fusion' : {}}
+    for i, assay in enumerate(expr_assays(num_expr)):
+        panel['ExprControl'][assay] = pools[i % 3]
+    for i, (partner, driver, assay) in enumerate(fusion_assays(num_fusions)):
+        panel['Fusion'][assay] = pools[i % 2]
+    panel_file = os.path.join(outdir, 'fusion_panel.json')
+    with open(panel_file, 'w') as fh:
+        json.dump(panel, fh, indent=4)
+    return panel_file
+
+def snv_line(rng):
+    chrom = 'chr%s' % rng.randint(1, 22)
+    pos = rng.randint(10000, 200000000)
+    gene = rng.choice(genes)
+    func = rng.choice(functions)
+    ref = rng.choice(bases)
+    if func.endswith('Deletion'):
+        ref += ''.join(rng.choice(bases) for _ in range(rng.choice((3, 6))))
+        alt = ref[0]
+    elif func.endswith('Insertion'):
+        alt = ref + ''.join(rng.choice(bases) for _ in range(rng.randint(1, 4)))
+    else:
+        alt = rng.choice([b for b in bases if b != ref])
+
+    fdp = rng.randint(100, 3000)
+    fao = rng.randint(1, fdp // 2)
+    hotspot = rng.random() < 0.1
+    varid = 'COSM%d' % rng.randint(100, 999999) if hotspot else '.'
+    exon = rng.randint(1, 30)
+    func_block = ("[{'origPos':'%s','origRef':'%s','normalizedRef':'%s',"
+        "'gene':'%s','normalizedPos':'%s','normalizedAlt':'%s',"
+        "'transcript':'NM_%06d.1','function':'%s','protein':'p.X%dY',"
+        "'location':'exonic','coding':'c.%d%s>%s','exon':'%s'%s}]" % (pos, ref,
+        ref, gene, pos, alt, rng.randint(1, 999999), func, rng.randint(1, 900),
+        rng.randint(1, 3000), ref, alt, exon,
+        ",'oncomineGeneClass':'Gain-of-Function','oncomineVariantClass':"
+        "'Hotspot'" if hotspot else ''))
+    info = 'AF=%.4f;FDP=%d;FRO=%d;FAO=%d;FUNC=%s' % (fao / float(fdp), fdp,
+        fdp - fao, fao, func_block)
+    return '\t'.join((chrom, str(pos), varid, ref, alt, '100', 'PASS', info,
+        'GT', '0/1'))
+
+def cnv_line(rng):
+    gene = rng.choice(genes)
+    chrom = 'chr%s' % rng.randint(1, 22)
+    start = rng.randint(10000, 200000000)
+    length = rng.randint(1000, 100000)
+    cn = round(rng.uniform(0.5, 12), 2)
+    hs = 'HS;' if rng.random() < 0.5 else ''
+    info = ("%sFUNC=[{'oncomineGeneClass':'Gain-of-Function',"
+        "'oncomineVariantClass':'Amplification','gene':'%s'}];END=%d;LEN=%d;"
+        "NUMTILES=%d;RAW_CN=%.2f;REF_CN=2;CI=0.05:%.4f,0.95:%.4f;SD=0.1" % (hs,
+        gene, start + length, length, rng.randint(3, 40), cn, cn * 0.8,
+        cn * 1.2))
+    return '\t'.join((chrom, str(start), gene, 'G', '<CNV>', '100', 'PASS',
+        info, 'GT:GQ:CN', './.:0:%s' % cn))
+
+def fusion_lines(rng, partner, driver, assay):
+    reads = rng.choice((0, 0, rng.randint(1, 100), rng.randint(100, 20000)))
+    pos1 = rng.randint(10000, 200000000)
+    pos2 = rng.randint(10000, 200000000)
+    return [
+        '\t'.join(('chr2', str(pos1), assay + '_1', 'G', 'G]chr2:%d]' % pos2,
+            '.', 'PASS', 'SVTYPE=Fusion;READ_COUNT=%d;GENE_NAME=%s' % (reads,
+            partner), 'GT', './.')),
+        '\t'.join(('chr2', str(pos2), assay + '_2', 'A', ']chr2:%d]A' % pos1,
+            '.', 'PASS', 'SVTYPE=Fusion;READ_COUNT=%d;GENE_NAME=%s' % (reads,
+            driver), 'GT', './.')),
+    ]
+
+def expr_line(rng, assay):
+    return '\t'.join(('chr1', '1', assay, 'N', '<ExprControl>', '.', 'PASS',
+        'SVTYPE=ExprControl;READ_COUNT=%d' % rng.randint(100, 50000), 'GT',
+        './.'))
+
+def write_vcf(path, sample, rng, snvs, cnvs, fusions, expr, ovat='2.5.1'):
+    header = [
+        '##fileformat=VCFv4.1',
+        '##fileDate=20190311',
+        '##fileUTCtime=2019-03-11T12:00:00',
+        '##mapd=%.3f' % rng.uniform(0.1, 0.6),
+        '##TotalMappedFusionPanelReads=%d' % rng.randint(100000, 5000000),
+        '##OncomineVariantAnnotationToolVersion=%s' % ovat,
+        '##sampleGender=%s' % rng.choice(('Female', 'Male')),
+        '##CellularityAsAFractionBetween0-1=0.9',
+        '##INFO=<ID=SVTYPE,Number=1,Type=String,Description="Type of '
+            'structural variant, including Fusion">',
+        '\t'.join(('#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER',
+            'INFO', 'FORMAT', sample)),
+    ]
+    with open(path, 'w') as fh:
+        fh.write('\n'.join(header) + '\n')
+        for _ in range(snvs):
+            fh.write(snv_line(rng) + '\n')
+        for _ in range(cnvs):
+            fh.write(cnv_line(rng) + '\n')
+        for partner, driver, assay in fusion_assays(fusions):
+            fh.write('\n'.join(fusion_lines(rng, partner, driver, assay)) + '\n')
+        for assay in expr_assays(expr):
+            fh.write(expr_line(rng, assay) + '\n')
+
+def bam_names(msn):
+    """DNA and RNA BAM file names for a sample, as `match_delinker.py` wants."""
+    return ['{}_{}.bam'.format(msn, na) for na in ('dna', 'rna')]
+
+def reg2bin(beg, end):
+    """UCSC bin for a read in the 0-based, half open interval [beg, end)."""
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+    return 0
+
+def write_bam(path, sample, rng, reads, read_len=100):
+    """
+    Write a BAM with a header like the ones from the Torrent Server (read
+    group with the sample name, run date, and command line), and `reads`
+    sorted reads on chr1.
+    """
+    refs = (('chr1', 248956422),)
+    text = '\n'.join((
+        '@HD\tVN:1.4\tSO:coordinate',
+        '@SQ\tSN:chr1\tLN:248956422',
+        '@RG\tID:{0}.IonXpress_001\tSM:{0}\tLB:{0}\tDT:2019-03-11T12:00:00'
+            '\tPL:IONTORRENT'.format(sample),
+        '@PG\tID:tmap\tVN:5.10\tCL:map4 -f hg19.fasta -r {}.basecaller.bam'
+            .format(sample),
+    )) + '\n'
+    codes = {'A' : 1, 'C' : 2, 'G' : 4, 'T' : 8}
+    with ocp_vcf.BgzfWriter(path) as out:
+        out.write(b'BAM\x01' + struct.pack('<i', len(text)) + text.encode())
+        out.write(struct.pack('<i', len(refs)))
+        for name, length in refs:
+            out.write(struct.pack('<i', len(name) + 1) + name.encode() +
+                b'\0' + struct.pack('<i', length))
+        pos = 10000
+        for i in range(reads):
+            pos += rng.randint(0, 200)
+            name = ('%s:R%07d' % (sample, i)).encode() + b'\0'
+            seq = ''.join(rng.choice(bases) for _ in range(read_len))
+            packed = bytes(codes[seq[j]] << 4 | codes[seq[j+1]]
+                for j in range(0, read_len, 2))
+            qual = bytes(rng.randint(10, 40) for _ in range(read_len))
+            rec = struct.pack('<iiBBHHHiiii', 0, pos, len(name), 60,
+                reg2bin(pos, pos + read_len), 1, 0, read_len, -1, -1, 0)
+            rec += name + struct.pack('<I', read_len << 4) + packed + qual
+            out.write(struct.pack('<i', len(rec)) + rec)
+
+def gen_cohort(outdir, num_samples, snvs=200, cnvs=50, fusions=100,
+        expr=len(expr_controls), ovat='2.5.1', seed=1, bam_reads=0):
+    """
+    Write `num_samples` VCFs and a panel JSON to `outdir`, along with a DNA and
+    RNA BAM for each sample (named by `bam_names()`) if `bam_reads` is set.
+    Returns a list of (MSN, VCF path) pairs.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    rng = random.Random(seed)
+    write_panel(outdir, expr, fusions)
+    vcfs = []
+    for msn, name in sample_names(num_samples):
+        path = os.path.join(outdir, name)
+        write_vcf(path, msn, rng, snvs, cnvs, fusions, expr, ovat)
+        if bam_reads:
+            for bam in bam_names(msn):
+                write_bam(os.path.join(outdir, bam), msn, rng, bam_reads)
+        vcfs.append((msn, path))
+    return vcfs
+
+if __name__ == '__main__':
+    args = get_args()
+    vcfs = gen_cohort(args.outdir, args.num_samples, args.snvs, args.cnvs,
+        args.fusions, args.expr, args.ovat, args.seed, args.bam_reads)
+    sys.stdout.write('Wrote %s VCF files to %s.\n' % (len(vcfs), args.outdir))
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time the main tools in this package on synthetic cohorts of different sizes
+# and keep a record of the results so that we can see regressions.
+#
+# 10/17/2026
+################################################################################
+"""
+Benchmark `get_metrics_from_vcf.py`, `collate_moi_reports.py`,
+`match_amoi_reporter.py`, and `match_delinker.py` on synthetic OCA cohorts made
+with `gen_oca_vcf.py`. Each tool is run as a separate process on each cohort
+size, and the wall time and the CPU time of the tool (and anything it starts)
+are appended to a CSV along with the git commit of the tree, so that runs from
+different versions can be compared with `--compare`. The MOI engine (Perl or
+native) and the shape of the VCFs are recorded with each result, and only runs
+with the same setup are compared. Tools that can't run in
+the current environment (e.g. missing dependencies) are recorded as failed and
+skipped for the rest of the run.
+"""
+import os
+import sys
+import csv
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from collections import defaultdict
+
+import gen_oca_vcf
+
+version = '1.1.101726'
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+default_results = os.path.join(bench_dir, 'results.csv')
+tools = ('get_metrics', 'collate', 'amoi', 'delinker')
+# Everything that has to match for two runs of a tool to be compared.
+config_fields = ('engine', 'procs', 'snvs', 'cnvs', 'fusions', 'expr',
+    'bam_reads')
+fields = ('date', 'commit', 'tool', 'samples') + config_fields + ('wall_time',
+    'cpu_time', 'status')
+# Tools that run the MOI rules, and so depend on the engine.
+moi_tools = ('collate', 'amoi')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument(
+        '-s', '--sizes',
+        metavar='<INT>',
+        type=int,
+        nargs='+',
+        default=[1, 10, 100, 1000, 10000],
+        help='Cohort sizes to run (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '-t', '--tools',
+        metavar='<tool>',
+        nargs='+',
+        choices=tools,
+        default=list(tools),
+        help='Tools to run. Valid choices are %(choices)s. (DEFAULT: all)'
+    )
+    parser.add_argument(
+        '-n', '--num_procs',
+        metavar='<INT>',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='Number of workers to give to tools that run in parallel '
+            '(DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--perl',
+        action='store_true',
+        help='Run the MOI rules with `match_moi_report.pl` rather than the '
+            'in-process `match_moi` module.'
+    )
+    parser.add_argument(
+        '--snvs',
+        metavar='<INT>',
+        type=int,
+        default=200,
+        help='Number of SNV / Indel records per VCF (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--cnvs',
+        metavar='<INT>',
+        type=int,
+        default=50,
+        help='Number of <CNV> records per VCF (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--fusions',
+        metavar='<INT>',
+        type=int,
+        default=100,
+        help='Number of fusion pairs per VCF (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--expr',
+        metavar='<INT>',
+        type=int,
+        default=len(gen_oca_vcf.expr_controls),
+        help='Number of ExprControl lines per VCF (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '--bam_reads',
+        metavar='<INT>',
+        type=int,
+        default=1000,
+        help='Number of reads in each of the DNA and RNA BAMs made for the '
+            'delinker (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        metavar='<results.csv>',
+        default=default_results,
+        help='CSV file to add the results to (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '-c', '--compare',
+        action='store_true',
+        help="Don't run anything; just compare the two most recent commits in "
+            "the results file."
+    )
+    parser.add_argument(
+        '-k', '--keep',
+        action='store_true',
+        help='Keep the generated cohorts and tool output rather than removing '
+            'them at the end.'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version = '%(prog)s - ' + version
+    )
+    return parser.parse_args()
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always',
+            '--dirty'], cwd=repo_dir, stderr=subprocess.DEVNULL).decode(
+            'ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def script(name):
+    return os.path.join(repo_dir, name)
+
+def run_tool(cmd, cwd):
+    """
+    Run a tool and return its wall time, user + system CPU time (including any
+    processes that it started), and whether it succeeded.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (repo_dir,
+        env.get('PYTHONPATH'))))
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    p = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE)
+    _, err = p.communicate()
+    wall = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime -
+        before.ru_stime)
+    if p.returncode != 0:
+        lines = err.decode('utf-8', 'replace').strip().split('\n')
+        sys.stderr.write('    failed: %s\n' % lines[-1])
+    return wall, cpu, p.returncode == 0
+
+def tool_cmd(tool, vcfs, panel, workdir, num_procs, perl):
+    """Return the command to run for a tool, and the dir to run it in."""
+    vcf_files = [v for _, v in vcfs]
+    if tool == 'get_metrics':
+        return [sys.executable, script('get_metrics_from_vcf.py'), '-j',
+            str(num_procs), '-p', panel, '-o', os.path.join(workdir,
+            'metrics.txt')] + vcf_files, workdir
+    elif tool == 'collate':
+        cmd = [sys.executable, script('collate_moi_reports.py'), '-n',
+            str(num_procs), '-o', os.path.join(workdir, 'collated.csv')]
+        if not perl:
+            cmd.append('-N')
+        return cmd + vcf_files, workdir
+    elif tool == 'amoi':
+        cmd = [sys.executable, script('match_amoi_reporter.py'), '-n',
+            str(num_procs), '-i', os.path.join(workdir, 'amoi_index.json'),
+            '-o', os.path.join(workdir, 'amoi.csv')]
+        if not perl:
+            cmd.append('-N')
+        return cmd + vcf_files, workdir
+    elif tool == 'delinker':
+        # The delinker wants a sample dir per MSN, and moves things around, so
+        # it gets a copy of the cohort of its own.
+        delink_dir = os.path.join(workdir, 'delink')
+        os.mkdir(delink_dir)
+        dirs = []
+        for i, (msn, vcf) in enumerate(vcfs, 1):
+            sample_dir = 'PSN%d_%s' % (i, msn)
+            os.mkdir(os.path.join(delink_dir, sample_dir))
+            shutil.copy(vcf, os.path.join(delink_dir, sample_dir, msn + '.vcf'))
+            for bam in gen_oca_vcf.bam_names(msn):
+                bam_file = os.path.join(os.path.dirname(vcf), bam)
+                if os.path.isfile(bam_file):
+                    shutil.copy(bam_file, os.path.join(delink_dir, sample_dir,
+                        bam))
+            dirs.append(sample_dir)
+        with open(os.path.join(delink_dir, 'msn_list.txt'), 'w') as fh:
+            fh.write('\n'.join(msn for msn, _ in vcfs) + '\n')
+        return [sys.executable, script('match_delinker.py'), '-n',
+            str(num_procs), '-r', os.path.join(delink_dir, 'registry.csv'),
+            'msn_list.txt'] + dirs, delink_dir
+
+def write_results(results, outfile):
+    # Results files from before the setup columns were added get rewritten with
+    # the new header, and blanks for the setup of the old runs.
+    rewrite = not os.path.exists(outfile)
+    old_rows = []
+    if not rewrite:
+        with open(outfile) as fh:
+            reader = csv.DictReader(fh)
+            if tuple(reader.fieldnames or ()) != fields:
+                old_rows = list(reader)
+                rewrite = True
+    with open(outfile, 'w' if rewrite else 'a') as fh:
+        writer = csv.DictWriter(fh, fieldnames=fields, restval='',
+            extrasaction='ignore', lineterminator='\n')
+        if rewrite:
+            writer.writeheader()
+        for row in old_rows + results:
+            writer.writerow(row)
+
+def compare(outfile):
+    """
+    Print the change in wall time for each tool and cohort size between the
+    two most recent commits in the results file. Runs are only compared to
+    runs with the same engine, number of workers, and VCF shape.
+    """
+    with open(outfile) as fh:
+        rows = [r for r in csv.DictReader(fh) if r['status'] == 'ok']
+    commits = []
+    for r in rows:
+        if r['commit'] in commits:
+            commits.remove(r['commit'])
+        commits.append(r['commit'])
+    if len(commits) < 2:
+        sys.stderr.write('Need results from at least two commits to compare.\n')
+        sys.exit(1)
+    old, new = commits[-2:]
+
+    # Use the latest run of each tool / size / setup for each commit.
+    times = defaultdict(dict)
+    for r in rows:
+        setup = tuple(r.get(f) or '' for f in config_fields)
+        times[r['commit']][(r['tool'], int(r['samples'])) + setup] = float(
+            r['wall_time'])
+
+    common = sorted(set(times[old]) & set(times[new]))
+    if not common:
+        sys.stderr.write('No runs with the same setup in %s and %s to '
+            'compare.\n' % (old, new))
+        sys.exit(1)
+    sys.stdout.write('{:<14}{:>9}  {:<28}{:>12}{:>12}{:>9}\n'.format('Tool',
+        'Samples', 'Setup', old[:11], new[:11], 'Change'))
+    for key in common:
+        before, after = times[old][key], times[new][key]
+        change = (after - before) / before * 100 if before else 0
+        engine, procs, snvs, cnvs, fusions, expr, bam_reads = key[2:]
+        setup = '{} n={} {}/{}/{}/{}'.format(engine or '?', procs, snvs, cnvs,
+            fusions, expr)
+        if key[0] == 'delinker':
+            setup += ' bam={}'.format(bam_reads)
+        sys.stdout.write('{:<14}{:>9}  {:<28}{:>12.2f}{:>12.2f}{:>+8.1f}%\n'
+            .format(key[0], key[1], setup, before, after, change))
+
+def main(args):
+    commit = git_commit()
+    date = time.strftime('%Y-%m-%d %H:%M:%S')
+    tmpdir = tempfile.mkdtemp(prefix='ocp_bench_')
+    failed_tools = set()
+    results = []
+
+    try:
+        for size in sorted(args.sizes):
+            sys.stdout.write('Generating a cohort of %s VCF(s)...\n' % size)
+            sys.stdout.flush()
+            cohort_dir = os.path.join(tmpdir, 'cohort_%s' % size)
+            vcfs = gen_oca_vcf.gen_cohort(cohort_dir, size, args.snvs,
+                args.cnvs, args.fusions, args.expr,
+                bam_reads=args.bam_reads if 'delinker' in args.tools else 0)
+            panel = os.path.join(cohort_dir, 'fusion_panel.json')
+
+            for tool in args.tools:
+                if tool in failed_tools:
+                    continue
+                workdir = os.path.join(tmpdir, '%s_%s' % (tool, size))
+                os.mkdir(workdir)
+                cmd, cwd = tool_cmd(tool, vcfs, panel, workdir, args.num_procs,
+                    args.perl)
+                sys.stdout.write('  %-12s %6s sample(s): ' % (tool, size))
+                sys.stdout.flush()
+                wall, cpu, ok = run_tool(cmd, cwd)
+                sys.stdout.write('%.2fs wall, %.2fs cpu%s\n' % (wall, cpu,
+                    '' if ok else ' (FAILED)'))
+                if not ok:
+                    failed_tools.add(tool)
+                results.append({
+                    'date'      : date,
+                    'commit'    : commit,
+                    'tool'      : tool,
+                    'samples'   : size,
+                    'engine'    : ('perl' if args.perl else 'native') if
+                        tool in moi_tools else '-',
+                    'procs'     : args.num_procs,
+                    'snvs'      : args.snvs,
+                    'cnvs'      : args.cnvs,
+                    'fusions'   : args.fusions,
+                    'expr'      : args.expr,
+                    'bam_reads' : args.bam_reads if tool == 'delinker' else 0,
+                    'wall_time' : '%.3f' % wall,
+                    'cpu_time'  : '%.3f' % cpu,
+                    'status'    : 'ok' if ok else 'failed',
+                })
+    finally:
+        if results:
+            write_results(results, args.output)
+            sys.stdout.write('Results added to %s.\n' % args.output)
+        if args.keep:
+            sys.stdout.write('Benchmark data kept in %s.\n' % tmpdir)
+        else:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.compare:
+        compare(args.output)
+    else:
+        main(args)
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# SQLite store for collated MOIs and QC metrics, so that cohort level questions
+# can be answered without re-parsing every report.
+#
+# 10/17/2026
+################################################################################
+"""
+Indexed SQLite store of the MOI rows from `collate_moi_reports.py` and the QC
+metrics from `get_metrics_from_vcf.py` (both with `--db <cohort.db>`), along
+with the parameters of each run that wrote to it. Each VCF is one sample;
+re-running a VCF replaces its MOI rows and / or QC metrics. Query it with:
+
+    cohort_db.py query <cohort.db> --gene EGFR --exon 19 --function deletion
+    cohort_db.py qc <cohort.db> --mapd_over 0.5 --since 2026-07-01
+    cohort_db.py info <cohort.db>
+"""
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+
+from pprint import pprint as pp # noqa
+
+version = '1.1.101726'
+
+# Commit every this many samples rather than after each one.
+default_batch_size = 500
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      INTEGER PRIMARY KEY,
+    tool        TEXT NOT NULL,
+    version     TEXT,
+    date        TEXT NOT NULL,
+    params      TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    sample_id   INTEGER PRIMARY KEY,
+    vcf         TEXT NOT NULL UNIQUE,
+    path        TEXT,
+    dna_sample  TEXT,
+    rna_sample  TEXT,
+    sample      TEXT,
+    moi_run_id  INTEGER REFERENCES runs (run_id),
+    qc_run_id   INTEGER REFERENCES runs (run_id),
+    date        TEXT,
+    ovat        TEXT,
+    mapd        REAL,
+    rna_reads   INTEGER,
+    expr_sum    INTEGER,
+    pool1       INTEGER,
+    pool2       INTEGER,
+    qc_flags    TEXT
+);
+CREATE TABLE IF NOT EXISTS mois (
+    sample_id   INTEGER NOT NULL REFERENCES samples (sample_id)
+                    ON DELETE CASCADE,
+    type        TEXT NOT NULL,
+    gene        TEXT,
+    position    TEXT,
+    ref         TEXT,
+    alt         TEXT,
+    vaf         REAL,
+    coverage    INTEGER,
+    ref_cov     INTEGER,
+    alt_cov     INTEGER,
+    varid       TEXT,
+    transcript  TEXT,
+    cds         TEXT,
+    aa          TEXT,
+    exon        TEXT,
+    function    TEXT,
+    oncomine_class TEXT,
+    rule        TEXT,
+    tiles       INTEGER,
+    ci05        REAL,
+    copy_number REAL,
+    ci95        REAL,
+    fusion      TEXT,
+    partner     TEXT,
+    read_count  INTEGER
+);
+CREATE INDEX IF NOT EXISTS mois_sample ON mois (sample_id);
+CREATE INDEX IF NOT EXISTS mois_gene ON mois (gene, exon);
+CREATE INDEX IF NOT EXISTS mois_varid ON mois (varid);
+CREATE INDEX IF NOT EXISTS mois_type ON mois (type, gene);
+CREATE INDEX IF NOT EXISTS samples_dna ON samples (dna_sample);
+CREATE INDEX IF NOT EXISTS samples_sample ON samples (sample);
+CREATE INDEX IF NOT EXISTS samples_date ON samples (date);
+CREATE INDEX IF NOT EXISTS samples_mapd ON samples (mapd);
+'''
+
+moi_cols = ('type', 'gene', 'position', 'ref', 'alt', 'vaf', 'coverage',
+    'ref_cov', 'alt_cov', 'varid', 'transcript', 'cds', 'aa', 'exon',
+    'function', 'oncomine_class', 'rule', 'tiles', 'ci05', 'copy_number',
+    'ci95', 'fusion', 'partner', 'read_count')
+
+# `get_metrics_from_vcf` keys for each of the QC columns.
+qc_cols = (('Date', 'date', str), ('OVAT', 'ovat', str),
+    ('MAPD', 'mapd', float), ('RNA_Reads', 'rna_reads', int),
+    ('Expr_Sum', 'expr_sum', int), ('Pool1', 'pool1', int),
+    ('Pool2', 'pool2', int))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description = __doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version = '%(prog)s - ' + version
+    )
+    subparsers = parser.add_subparsers(dest='cmd', metavar='<command>')
+    subparsers.required = True
+
+    query = subparsers.add_parser('query', help='Find samples with MOIs '
+        'matching a gene, exon, variant, etc.')
+    query.add_argument('db', metavar='<cohort.db>', help='Cohort database.')
+    query.add_argument('-g', '--gene', help='Gene (or driver gene for fusions).')
+    query.add_argument('-e', '--exon', help='Exon number (e.g. 19 or Exon19).')
+    query.add_argument('-t', '--type', choices=('SNV', 'CNV', 'Fusion'),
+        help='Only MOIs of this type.')
+    query.add_argument('-f', '--function', help='Variant function, matching '
+        'any part of the name (e.g. "deletion" for frameshiftDeletion and '
+        'nonframeshiftDeletion).')
+    query.add_argument('-i', '--varid', help='Variant ID (e.g. COSM6224).')
+    query.add_argument('-s', '--sample', help='Sample name or VCF file name.')
+
+    qc = subparsers.add_parser('qc', help='Find samples by QC metrics.')
+    qc.add_argument('db', metavar='<cohort.db>', help='Cohort database.')
+    qc.add_argument('--mapd_over', metavar='FLOAT', type=float,
+        help='MAPD above this.')
+    qc.add_argument('--rna_reads_under', metavar='INT', type=int,
+        help='Total mapped RNA reads below this.')
+    qc.add_argument('--pool_reads_under', metavar='INT', type=int,
+        help='Pool1 or Pool2 expression reads below this.')
+    qc.add_argument('--since', metavar='YYYY-MM-DD',
+        help='Samples run on or after this date.')
+    qc.add_argument('--until', metavar='YYYY-MM-DD',
+        help='Samples run on or before this date.')
+    qc.add_argument('-s', '--sample', help='Sample name or VCF file name.')
+
+    info = subparsers.add_parser('info', help='Show the sample and MOI '
+        'counts, and the runs that wrote to the database.')
+    info.add_argument('db', metavar='<cohort.db>', help='Cohort database.')
+
+    for p in (query, qc):
+        p.add_argument('-o', '--output', metavar='<output file>',
+            help='Output CSV to file rather than STDOUT.')
+    return parser.parse_args()
+
+def to_num(val, func):
+    '''Turn a report value into a number, or None for a '-' / empty value.'''
+    val = val.strip('*')
+    if val in ('', '-', '.', 'NA', 'None'):
+        return None
+    try:
+        return func(float(val)) if func is int else func(val)
+    except ValueError:
+        return None
+
+def moi_values(rec):
+    '''
+    Values for the `mois` columns from a `moi_record` record. CNVs keep their
+    chromosome in `position`, like in the collated report.
+    '''
+    vals = [getattr(rec, col, None) for col in moi_cols]
+    vals[0] = rec.type
+    if rec.type == 'CNV':
+        vals[moi_cols.index('position')] = rec.chrom
+    return vals
+
+def qc_record(data):
+    '''
+    Map `get_metrics_from_vcf.read_vcf()` metrics onto the QC columns, with the
+    flagged ('*val*') metrics listed in `qc_flags`.
+    '''
+    rec = {}
+    flags = []
+    for key, col, func in qc_cols:
+        val = data.get(key)
+        if val is None:
+            rec[col] = None
+            continue
+        val = str(val)
+        if val.startswith('*'):
+            flags.append(key)
+        rec[col] = val if func is str else to_num(val, func)
+    rec['qc_flags'] = ','.join(flags) or None
+    return rec
+
+
+class CohortDB(object):
+    '''
+    Write MOI rows and QC metrics for each sample. Writes are grouped into
+    transactions of `batch_size` samples; call `close()` to commit the last
+    one.
+    '''
+    def __init__(self, db_file, batch_size=default_batch_size):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_file, timeout=60)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        try:
+            self.conn.execute('PRAGMA journal_mode = WAL')
+        except sqlite3.OperationalError:
+            # Not available on some network filesystems; fine without it.
+            pass
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.executescript(schema)
+        self._pending = 0
+
+    def add_run(self, tool, tool_version, params):
+        cur = self.conn.execute('INSERT INTO runs (tool, version, date, params) '
+            'VALUES (?, ?, ?, ?)', (tool, tool_version,
+            datetime.datetime.now().isoformat(' ', 'seconds'),
+            json.dumps(params)))
+        self.conn.commit()
+        return cur.lastrowid
+
+    def sample_id(self, vcf, **cols):
+        '''Insert or update the sample row for a VCF and return its id.'''
+        cols['path'] = os.path.abspath(vcf)
+        names = sorted(cols)
+        self.conn.execute('INSERT INTO samples (vcf, {}) VALUES (?, {}) ON '
+            'CONFLICT (vcf) DO UPDATE SET {}'.format(', '.join(names),
+            ', '.join('?' * len(names)), ', '.join('{0} = excluded.{0}'.format(n)
+            for n in names)), [os.path.basename(vcf)] + [cols[n] for n in names])
+        return self.conn.execute('SELECT sample_id FROM samples WHERE vcf = ?',
+            (os.path.basename(vcf),)).fetchone()[0]
+
+    def put_mois(self, vcf, dna_sample, rna_sample, records, run_id):
+        '''Replace the MOI rows for a VCF with a list of `moi_record` records.'''
+        sid = self.sample_id(vcf, dna_sample=dna_sample, rna_sample=rna_sample,
+            moi_run_id=run_id)
+        self.conn.execute('DELETE FROM mois WHERE sample_id = ?', (sid,))
+        self.conn.executemany('INSERT INTO mois (sample_id, {}) VALUES (?, {})'
+            .format(', '.join(moi_cols), ', '.join('?' * len(moi_cols))),
+            ([sid] + moi_values(rec) for rec in records))
+        self._done()
+
+    def put_qc(self, vcf, sample, data, run_id):
+        '''Replace the QC metrics for a VCF.'''
+        self.sample_id(vcf, sample=sample, qc_run_id=run_id, **qc_record(data))
+        self._done()
+
+    def remove(self, vcf):
+        self.conn.execute('DELETE FROM samples WHERE vcf = ?',
+            (os.path.basename(vcf),))
+        self._done()
+
+    def _done(self):
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def sample_clause(sample):
+    return ('(s.vcf = ? OR s.sample = ? OR s.dna_sample = ? OR '
+        's.rna_sample = ?)', [sample] * 4)
+
+def query_mois(conn, gene=None, exon=None, moi_type=None, function=None,
+        varid=None, sample=None):
+    where = []
+    args = []
+    if gene:
+        where.append('m.gene = ?')
+        args.append(gene)
+    if exon:
+        where.append('m.exon = ?')
+        args.append(exon if exon.lower().startswith('exon') else
+            'Exon' + exon)
+    if moi_type:
+        where.append('m.type = ?')
+        args.append(moi_type)
+    if function:
+        where.append('m.function LIKE ?')
+        args.append('%' + function + '%')
+    if varid:
+        where.append('m.varid = ?')
+        args.append(varid)
+    if sample:
+        clause, vals = sample_clause(sample)
+        where.append(clause)
+        args += vals
+
+    cols = ['s.vcf', 's.dna_sample', 's.rna_sample', 's.date'] + [
+        'm.' + c for c in moi_cols]
+    sql = 'SELECT {} FROM mois m JOIN samples s USING (sample_id)'.format(
+        ', '.join(cols))
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY s.vcf'
+    return [c.split('.')[1] for c in cols], conn.execute(sql, args)
+
+def query_qc(conn, mapd_over=None, rna_reads_under=None, pool_reads_under=None,
+        since=None, until=None, sample=None):
+    where = []
+    args = []
+    if mapd_over is not None:
+        where.append('s.mapd > ?')
+        args.append(mapd_over)
+    if rna_reads_under is not None:
+        where.append('s.rna_reads < ?')
+        args.append(rna_reads_under)
+    if pool_reads_under is not None:
+        where.append('(s.pool1 < ? OR s.pool2 < ?)')
+        args += [pool_reads_under] * 2
+    if since:
+        where.append('s.date >= ?')
+        args.append(since)
+    if until:
+        where.append('s.date <= ?')
+        args.append(until)
+    if sample:
+        clause, vals = sample_clause(sample)
+        where.append(clause)
+        args += vals
+
+    cols = ['vcf', 'sample', 'date', 'ovat', 'mapd', 'rna_reads', 'expr_sum',
+        'pool1', 'pool2', 'qc_flags']
+    sql = 'SELECT {} FROM samples s WHERE s.qc_run_id IS NOT NULL'.format(
+        ', '.join('s.' + c for c in cols))
+    if where:
+        sql += ' AND ' + ' AND '.join(where)
+    sql += ' ORDER BY s.date, s.vcf'
+    return cols, conn.execute(sql, args)
+
+def print_info(conn, outfile):
+    samples, mois = conn.execute('SELECT (SELECT count(*) FROM samples), '
+        '(SELECT count(*) FROM mois)').fetchone()
+    outfile.write('Samples: {}\nMOIs: {}\n'.format(samples, mois))
+    for moi_type, count in conn.execute('SELECT type, count(*) FROM mois '
+            'GROUP BY type ORDER BY type'):
+        outfile.write('    {:<8}{}\n'.format(moi_type, count))
+    outfile.write('\nRuns:\n')
+    for row in conn.execute('SELECT run_id, date, tool, version, params FROM '
+            'runs ORDER BY run_id'):
+        outfile.write('    {:<6}{:<22}{:<24}{:<14}{}\n'.format(*row))
+
+def main(args):
+    if not os.path.isfile(args.db):
+        sys.stderr.write("ERROR: Database '{}' does not exist!\n".format(
+            args.db))
+        sys.exit(1)
+    conn = sqlite3.connect(args.db)
+
+    if args.cmd == 'info':
+        print_info(conn, sys.stdout)
+        return
+
+    start = time.time()
+    if args.cmd == 'query':
+        cols, rows = query_mois(conn, args.gene, args.exon, args.type,
+            args.function, args.varid, args.sample)
+    else:
+        cols, rows = query_qc(conn, args.mapd_over, args.rna_reads_under,
+            args.pool_reads_under, args.since, args.until, args.sample)
+
+    outfile = open(args.output, 'w') if args.output else sys.stdout
+    writer = csv.writer(outfile, lineterminator='\n')
+    writer.writerow(cols)
+    count = 0
+    for row in rows:
+        writer.writerow(['-' if x is None else x for x in row])
+        count += 1
+    sys.stderr.write('{} row(s) in {:.1f} ms.\n'.format(count,
+        (time.time() - start) * 1000))
+
+if __name__ == '__main__':
+    main(get_args())
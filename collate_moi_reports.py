@@ -9,10 +9,25 @@
 Collect MOI reports for a set of VCF files and output a raw CSV formatted output 
 that can be easily imported into Microsoft Excel for reporting. This script
 relies on `match_moi_report.pl` in order to generate the MOI reports for each.
+
+With `--watch`, keep watching a directory of VCFs and update the output (and
+optionally a `get_metrics_from_vcf.py` QC table) as new VCFs arrive, only
+running the new or changed ones through the MOI pipeline.
+
+With `--shard i/N`, only collate the i-th of N subsets of the VCFs into a
+partial file, so that a big run can be split over several nodes or processes.
+The partial files are combined into the final report with:
+
+    collate_moi_reports.py merge -o <output> <shard_files>
 """
 import sys
+import io
+import csv
 import os
 import re
+import zlib
+import time
+import heapq
 import subprocess
 import argparse
 import multiprocessing
@@ -23,8 +38,35 @@ from collections import defaultdict
 from pprint import pprint as pp # noqa
 from multiprocessing.pool import ThreadPool # noqa
 
-version = '4.2.061019'
+import match_moi
+import moi_cache
+import moi_record
+import ocp_profile
+import moi_server
+import cohort_db
+import moi_columnar
+import ocp_watch
+import get_metrics_from_vcf
+
+version = '4.10.101726'
 debug = False
+quiet = True
+
+var_types = ['snv_data', 'cnv_data', 'fusion_data', 'null']
+header = ['Sample', 'Type', 'Gene', 'Position', 'Ref', 'Alt', 'Transcript',
+    'CDS', 'AA', 'VARID', 'VAF/CN', 'Coverage/Counts', 'RefCov', 'AltCov',
+    'Function', 'Location']
+
+# MOI record field for each of the columns after `Type`, by MOI type. The SNV 
+# `Function` and `Location` columns both get the vcfExtractor location (exon).
+collate_fields = {
+    'SNV' : ('gene', 'position', 'ref', 'alt', 'transcript', 'cds', 'aa', 
+        'varid', 'vaf', 'coverage', 'ref_cov', 'alt_cov', 'exon', 'exon'),
+    'CNV' : ('gene', 'chrom', None, None, None, None, None, None, 
+        'copy_number', None, None, None, None, None),
+    'Fusion' : ('gene', None, None, 'fusion', None, None, None, 'varid', None,
+        'read_count', None, None, None, None),
+}
 
 
 def get_args():
@@ -39,7 +81,7 @@ def get_args():
     parser.add_argument(
         'vcf_files',
         metavar="<vcf_files>",
-        nargs="+",
+        nargs="*",
         help="List of VCF files to process."
     )
     parser.add_argument(
@@ -88,6 +130,88 @@ def get_args():
         help='Data comes from blood specimens, and therefore we only have DNA '
             'data.'
     )
+    parser.add_argument(
+        '-N', '--native',
+        action='store_true',
+        help='Run the MOI rules in-process with the `match_moi` module rather '
+            'than running `match_moi_report.pl` on each VCF.'
+    )
+    moi_server.add_args(parser)
+    parser.add_argument(
+        '-c', '--cache',
+        metavar='<cache_dir>',
+        help='Cache the MOI results for each VCF in this directory, and reuse '
+            'them on later runs for VCFs that have not changed. The cache is '
+            'keyed on the VCF contents, the thresholds, and the blacklist '
+            'version.'
+    )
+    parser.add_argument(
+        '--cache_size',
+        metavar='INT',
+        type=int,
+        default=moi_cache.default_cache_size,
+        help='Maximum size of the MOI results cache in MB. Least recently used '
+            'entries are removed past this. {}'.format(
+            colored('DEFAULT: %(default)s MB', 'green'))
+    )
+    parser.add_argument(
+        '-w', '--watch',
+        metavar='<vcf_dir>',
+        help='Watch this directory (and the ones under it) for new or changed '
+            'VCFs and keep the output file up to date with them rather than '
+            'processing a list of VCFs once. Results for each VCF are kept in '
+            '`<output>.watch/` so that only new VCFs need to be processed, even '
+            'across restarts.'
+    )
+    parser.add_argument(
+        '--qc',
+        metavar='<qc_file>',
+        help='In watch mode, also keep a `get_metrics_from_vcf.py` table of '
+            'the QC metrics for each VCF in this file.'
+    )
+    parser.add_argument(
+        '--panel',
+        metavar='<panel.json>',
+        default=get_metrics_from_vcf.default_panel,
+        help='Panel JSON for the RNA pool reads in the QC table (DEFAULT: '
+            '%(default)s)'
+    )
+    parser.add_argument(
+        '--poll',
+        metavar='SECS',
+        type=float,
+        help='In watch mode, look for new VCFs every SECS seconds rather than '
+            'using inotify. Useful for network filesystems, where inotify does '
+            'not see changes made from other hosts.'
+    )
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help='In watch mode, bring the output up to date and exit rather than '
+            'waiting for more VCFs (e.g. when run from cron).'
+    )
+    parser.add_argument(
+        '--db',
+        metavar='<cohort.db>',
+        help='Also store the MOIs for each VCF in this SQLite cohort database '
+            '(see `cohort_db.py`), replacing any from earlier runs. In watch '
+            'mode the QC metrics from `--qc` are stored too.'
+    )
+    parser.add_argument(
+        '--columnar',
+        metavar='<file.parquet|file.arrow>',
+        help='Also write the MOIs to a Parquet or Arrow IPC file (by '
+            'extension) with typed columns, for loading into pandas, etc. '
+            'Needs the `pyarrow` package.'
+    )
+    parser.add_argument(
+        '-s', '--shard',
+        metavar='<i/N>',
+        help='Only collate the VCFs in shard i of N into a partial output '
+            'file, to be combined with the other shards by `%(prog)s merge`. '
+            'VCFs are split into shards on a hash of the file name, so each '
+            'node can be given the full list of VCFs.'
+    )
     parser.add_argument(
         '-n', '--num_procs',
         metavar="INT <num_procs>",
@@ -107,6 +231,7 @@ def get_args():
         default=True, 
         help='Do not suppress warning and extra output'
     )
+    ocp_profile.add_args(parser)
     parser.add_argument(
         '-v', '--version', 
         action='version',
@@ -121,19 +246,109 @@ def get_args():
                 "value when using the --cu and --cl option.\n")
             sys.exit(1)
 
+    if args.shard:
+        args.shard = parse_shard(args.shard)
+        if args.watch:
+            sys.stderr.write("ERROR: You can not use the --shard option with "
+                "--watch.\n")
+            sys.exit(1)
+
+    if args.columnar:
+        if not moi_columnar.get_format(args.columnar):
+            sys.stderr.write("ERROR: Columnar output file must end in one of: "
+                "{}.\n".format(', '.join(sorted(moi_columnar.formats))))
+            sys.exit(1)
+        if not moi_columnar.have_pyarrow():
+            sys.stderr.write("ERROR: The --columnar option needs the `pyarrow` "
+                "package. Install it with `pip install pyarrow`.\n")
+            sys.exit(1)
+        if args.watch:
+            sys.stderr.write("ERROR: You can not use the --columnar option "
+                "with --watch.\n")
+            sys.exit(1)
+
+    if args.watch:
+        if args.vcf_files:
+            sys.stderr.write("ERROR: You can not use a list of VCF files with "
+                "the --watch option.\n")
+            sys.exit(1)
+        if not args.output:
+            sys.stderr.write("ERROR: You must use an --output file with the "
+                "--watch option.\n")
+            sys.exit(1)
+        if not os.path.isdir(args.watch):
+            sys.stderr.write("ERROR: Watch directory '{}' does not "
+                "exist!\n".format(args.watch))
+            sys.exit(1)
+    elif not args.vcf_files:
+        sys.stderr.write("ERROR: You must input at least one VCF file or a "
+            "directory to --watch.\n")
+        sys.exit(1)
+    elif args.qc or args.poll or args.once:
+        sys.stderr.write("ERROR: The --qc, --poll, and --once options are only "
+            "used with --watch.\n")
+        sys.exit(1)
+
     global quiet
     quiet = args.quiet
     return args
 
+def get_merge_args():
+    parser = argparse.ArgumentParser(
+        prog='collate_moi_reports.py merge',
+        description='Merge the partial files from a `--shard` run of '
+            'collate_moi_reports.py into the final report.'
+    )
+    parser.add_argument(
+        'shard_files',
+        metavar='<shard_files>',
+        nargs='+',
+        help='Partial output files from each shard.'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        metavar='<output file>',
+        help='Output to file rather than STDOUT.'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version = '%(prog)s - ' + version
+    )
+    return parser.parse_args(sys.argv[2:])
+
+def parse_shard(shard):
+    '''Turn an `i/N` shard string into a tuple, or bail out.'''
+    try:
+        i, n = [int(x) for x in shard.split('/')]
+    except ValueError:
+        i = n = 0
+    if not 0 < i <= n:
+        sys.stderr.write("ERROR: Shard must be in the form 'i/N', where i is "
+            "between 1 and N (e.g. '2/8')!\n")
+        sys.exit(1)
+    return i, n
+
+def in_shard(vcf, shard):
+    '''
+    Whether a VCF belongs in shard (i, N). Uses a hash of the file name only, 
+    so that every node puts a VCF in the same shard no matter what path it 
+    sees it under or which other VCFs are on its list.
+    '''
+    i, n = shard
+    name = os.path.basename(vcf).encode('utf-8')
+    return zlib.crc32(name) % n == i - 1
+
 def get_names(string):
     string = os.path.basename(string)
     try:
-        (dna_samp,rna_samp) = re.search('(.*?DNA)_(.*).vcf$',string).group(1,2)
+        (dna_samp,rna_samp) = re.search(r'(.*?DNA)_(.*)\.vcf(?:\.gz)?$',
+            string).group(1,2)
     except:
         if not quiet:
             sys.stderr.write("WARN: Can not get DNA or RNA sample name for '%s'! "
                 "Using full VCF filename instead\n" % string)
-        dna_samp = rna_samp = string.rstrip('.vcf')
+        dna_samp = rna_samp = re.sub(r'\.vcf(?:\.gz)?$', '', string)
     return dna_samp, rna_samp
 
 def parse_cnv_params(cu, cl, cn):
@@ -150,92 +365,64 @@ def parse_cnv_params(cu, cl, cn):
     params_list = [[k, str(v)] for k, v in params.items() if v]
     return sum(params_list, [])
 
-def populate_list(var_type, var_data):
-    wanted_fields = {
-        'snv'     : [0,9,1,2,3,10,11,12,8,4,5,6,7,13],
-        'cnv'     : [0,1,2,5],
-        'fusions' : [0,4,2,1,3]
-    }
-    return [var_data[x] for x in wanted_fields[var_type]]
-
-def pad_list(data_list, data_type):
+def collate_row(sample, rec):
     '''
-    Pad out the list with hyphens where there is no relevent data.  Maybe kludgy, 
-    but I don't know a better way
+    Lay a MOI record out in the output columns, with hyphens where the record 
+    has no relevant data.
     '''
-    tmp_list = ['-'] * 15
-    data_list.reverse()
-    if data_type == 'cnv':
-        for i in [0,1,2,9]:
-            tmp_list[i] = data_list.pop()
-    elif data_type == 'fusions':
-        # Get rid of 
-        for i in [0,1,8,4,10]:
-            tmp_list[i] = data_list.pop()
-    return tmp_list
-
-def get_location(pos, vcf):
-    """
-    For the cases where we need location information, like Protein Painter,
-    re-read the VCF in vcfExtractor, and get the location for the output.
-    """
-    cmd = ['vcfExtractor.pl', '-N', '-n', '-a', '-p', pos, vcf]
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-        encoding='utf8')
-    result, error = p.communicate()
-
-    if p.returncode != 0:
-        sys.stderr.write("ERROR: Can not process file: {}!\n".format(vcf))
-
-    lines = result.split('\n')
-    for l in lines:
-        if l.startswith('chr'):
-            return l.split()[12] # Field 12 is "Location" field in vcfExtractor
+    return ','.join([sample, rec.type] + [rec.text(f) if f else '-' 
+        for f in collate_fields[rec.type]])
 
 def parse_data(report_data, dna, rna, vcf):
+    '''
+    Make MOI records out of the report rows and file them by type and variant.
+    The full list of records is kept in `records` too, in report order.
+    '''
     data = defaultdict(dict)
-    raw_data = report_data.split('\n')
-
-    for line in raw_data:
-        fields = line.split(',')
-        if fields[0] == 'SNV':
-            varid = fields[9] +':'+ fields[1]
-            data['snv_data'][varid] = [dna] + populate_list('snv', fields)
-
-            # For protein painter kind of output, need the location
-            data['snv_data'][varid].append(get_location(fields[1], vcf))
-
-        elif fields[0] == 'CNV':
-            varid = fields[1] +':'+ fields[2]
-            cnv_data = populate_list('cnv', fields)
-            padded_list = pad_list(cnv_data,'cnv')
-            data['cnv_data'][varid] = [dna] + padded_list
-
-        elif fields[0] == 'Fusion':
-            varid = fields[1] +':'+ fields[2]
-            fusion_data = populate_list('fusions', fields)
-            padded_list = pad_list(fusion_data,'fusions')
-            data['fusion_data'][varid] = [rna] + padded_list
+    records = moi_record.from_rows(report_data)
+
+    for rec in records:
+        if rec.type == 'SNV':
+            varid = rec.gene +':'+ rec.position
+            data['snv_data'][varid] = rec
+        elif rec.type == 'CNV':
+            varid = rec.gene +':'+ rec.chrom
+            data['cnv_data'][varid] = rec
+        elif rec.type == 'Fusion':
+            varid = rec.fusion +':'+ rec.varid
+            data['fusion_data'][varid] = rec
 
     # Let's still output something even if no MOIs were detected
     if not data:
-        data['null']['no_result'] = [dna] + ['-']*11
-    return dict(data)
+        data['null']['no_result'] = None
+    data = dict(data)
+    data['names'] = (dna, rna)
+    data['records'] = records
+    return data
 
-def print_data(var_type,data,outfile):
+def print_data(var_type, data, outfile, dna, rna):
     # Split the key by a colon and sort based on chr and then pos using the 
     # natsort library
     if var_type == 'null':
-        outfile.write(','.join(data['no_result']) + "\n")
+        outfile.write(','.join([dna] + ['-']*11) + "\n")
     elif var_type == 'snv_data':
         for variant in natsorted(
                 data.keys(), key=lambda k: (k.split(':')[1], k.split(':')[2])):
-            outfile.write(','.join(data[variant]) + "\n")
+            outfile.write(collate_row(dna, data[variant]) + "\n")
     else:
+        sample = rna if var_type == 'fusion_data' else dna
         for variant in natsorted(data.keys(), key=lambda k: k.split(':')[1]):
-            outfile.write(','.join(data[variant]) + "\n")
+            outfile.write(collate_row(sample, data[variant]) + "\n")
     return
 
+def write_data(data, outfile):
+    dna, rna = data['names']
+    for var_type in var_types:
+        try:
+            print_data(var_type, data[var_type], outfile, dna, rna)
+        except KeyError:
+            continue
+
 def print_title(fh, cu, cl, cn, reads, pedmatch):
     '''Print out a header to remind me just what params I used this time!'''
     cnv_params = parse_cnv_params(cu, cl, cn)
@@ -255,12 +442,18 @@ def print_title(fh, cu, cl, cn, reads, pedmatch):
     fh.write('\n')
     return
 
-def gen_moi_report(vcf, params, proc_type):
+def run_moi_report(vcf, params, native=False, server=None):
     '''
     Use MATCH MOI Reporter to generate a variant table we can parse later. Gen 
-    CLI Opts to determine what params to run match_moi_report with
+    CLI Opts to determine what params to run match_moi_report with. If 
+    `native` is set, run the same rules in-process with `match_moi` instead,
+    or if we have a `server`, have a `moi_server.py` run them.
     '''
-    (dna, rna) = get_names(vcf)
+    if server:
+        return server.moi_report(vcf, params)[1]
+    elif native:
+        return match_moi.moi_report(vcf, **match_moi.parse_moi_args(params))
+
     moi_report_cmd = ['match_moi_report.pl'] + params + [vcf]
 
     p = subprocess.Popen(moi_report_cmd, stdout=subprocess.PIPE, 
@@ -270,62 +463,297 @@ def gen_moi_report(vcf, params, proc_type):
     if p.returncode != 0:
         sys.stderr.write("ERROR: Can not process file: {}!\n".format(vcf))
         raise Exception(error)
-    else:
-        # need a tuple to track threads and not crash dict entries if we're 
-        # doing multithreaded processing.
-        if proc_type == 'single':
-            return parse_data(result, dna, rna, vcf)
-        elif proc_type == 'threaded':
-            return vcf, parse_data(result, dna, rna, vcf)
+    return [row for row in csv.reader(result.splitlines()) if row]
+
+def gen_moi_report(vcf, params, proc_type, native=False, cache=None, 
+        server=None):
+    '''
+    Get the MOI report rows for a VCF, either from the cache (if we have one 
+    and have seen this VCF with these params before) or by running the report,
+    and parse them.
+    '''
+    (dna, rna) = get_names(vcf)
+
+    with ocp_profile.record('moi_report', vcf):
+        if cache:
+            # The server runs the same rules as `match_moi`.
+            engine = 'native' if (native or server) else 'perl'
+            key = cache.key(vcf, params, engine)
+            report_data = cache.get(key)
+            if report_data is None:
+                report_data = run_moi_report(vcf, params, native, server)
+                cache.put(key, report_data)
+        else:
+            report_data = run_moi_report(vcf, params, native, server)
+
+    data = parse_data(report_data, dna, rna, vcf)
+
+    # need a tuple to track threads and not crash dict entries if we're 
+    # doing multithreaded processing.
+    if proc_type == 'single':
+        return data
+    elif proc_type == 'threaded':
+        return vcf, data
 
 def arg_star(args):
     return gen_moi_report(*args)
 
-def proc_vcfs(vcf_files, params, num_procs):
+def proc_vcfs(vcf_files, params, num_procs, native=False, cache=None, 
+        server=None):
     '''
     Process the input VCF files using the thresholds set in `params`. Will
     either fork to a parallel process (if num_procs > 1) or process in a single
-    loop.
+    loop. Results are yielded in sorted VCF order as soon as a VCF (and all of 
+    the ones ahead of it) are done so that we can write them out as we go 
+    rather than holding the whole cohort in memory. The in-process (`native`)
+    parsing is CPU bound and gets a process pool; the `match_moi_report.pl` 
+    and MOI server workers only wait on a subprocess or the server, so threads 
+    are fine for those.
     '''
-    moi_data = defaultdict(dict)
+    vcf_files = sorted(set(vcf_files))
 
     if num_procs < 2:
         sys.stderr.write("Non-parallel processing files (total: %s VCF(s))\n" %
                 str(len(vcf_files)))
         for v in vcf_files:
-            moi_data[v] = gen_moi_report(v, params, 'single')
+            yield v, gen_moi_report(v, params, 'single', native, cache, server)
     else:
         sys.stderr.write("Parallel processing files using %s processes (total: "
             "%s VCF(s))\n" % (num_procs, str(len(vcf_files))))
-        task_list = [(v, params, 'threaded') for v in vcf_files]
+        task_list = [(v, params, 'threaded', native, cache, server) 
+            for v in vcf_files]
         
-        pool = ThreadPool(num_procs)
+        if native and not server:
+            pool = multiprocessing.Pool(num_procs)
+        else:
+            pool = ThreadPool(num_procs)
         try:
-            moi_data = {vcf : data for vcf, data in pool.imap_unordered(
-                arg_star, task_list)}
+            # `imap` hands results back in task order, and only holds on to 
+            # the ones that finish ahead of a slower VCF.
+            for vcf, data in pool.imap(arg_star, task_list):
+                yield vcf, data
         except Exception:
-            pool.close()
+            pool.terminate()
             pool.join()
             raise
         except KeyboardInterrupt:
-            pool.close()
+            pool.terminate()
             pool.join()
             sys.exit(9)
 
-        # TODO: Not sure if this is needed or not....seem to have a memory leak!
         pool.close()
         pool.join()
-    return moi_data
 
-def main(vcfs, cn, cu, cl, reads, pedmatch, blood, output, num_procs, quiet):
-    # Setup an output file if we want one
-    outfile = ''
-    if output:
-        print("Writing output to '%s'" % output)
-        outfile = open(output, 'w')
-    else:
-        outfile = sys.stdout
+def read_shard(shard_file):
+    '''
+    Open a shard file and read its header. Returns the (i, N) of the shard, 
+    the title and header lines, and the file handle positioned at the first 
+    row.
+    '''
+    fh = open(shard_file)
+    marker = re.match(r'#shard (\d+)/(\d+)$', fh.readline().rstrip('\n'))
+    if not marker:
+        sys.stderr.write("ERROR: '{}' is not a collate_moi_reports.py shard "
+            "file!\n".format(shard_file))
+        sys.exit(1)
+    title = []
+    for line in fh:
+        title.append(line)
+        if line.startswith('Sample,'):
+            break
+    return (int(marker.group(1)), int(marker.group(2))), ''.join(title), fh
+
+def shard_rows(fh):
+    for line in fh:
+        yield line.split('\t', 1)
+
+def merge_shards(shard_files, outfile):
+    '''
+    Do a k-way merge of the shard files on the VCF each row came from. Each 
+    shard is already in VCF order, so we only ever hold one row per shard in 
+    memory, and the result is the same as collating all of the VCFs in one 
+    go.
+    '''
+    shards = [read_shard(f) for f in shard_files]
 
+    seen = {}
+    for f, (shard, title, fh) in zip(shard_files, shards):
+        if shard in seen:
+            sys.stderr.write("ERROR: '{}' and '{}' are both shard {}/{}!\n".format(
+                seen[shard], f, *shard))
+            sys.exit(1)
+        seen[shard] = f
+    if len(set(s[1] for s in seen)) > 1:
+        sys.stderr.write("ERROR: Shard files come from runs with different "
+            "numbers of shards!\n")
+        sys.exit(1)
+    if len(set(title for shard, title, fh in shards)) > 1:
+        sys.stderr.write("ERROR: Shard files were made with different MOI "
+            "params!\n")
+        sys.exit(1)
+
+    num_shards = shards[0][0][1]
+    missing = sorted(set(range(1, num_shards+1)) - set(s[0] for s in seen))
+    if missing:
+        sys.stderr.write("WARN: Missing shard(s) {} of {}. Output will not "
+            "include the VCFs from those shards.\n".format(
+                ', '.join(str(x) for x in missing), num_shards))
+
+    outfile.write(shards[0][1])
+    for vcf, row in heapq.merge(*[shard_rows(fh) for s, t, fh in shards],
+            key=lambda r: r[0]):
+        outfile.write(row)
+    for s, t, fh in shards:
+        fh.close()
+
+def qc_table(results, dna_only):
+    '''
+    Format the QC metrics the same way `get_metrics_from_vcf.py` does. Samples
+    from the older assay don't have pool reads, so fill in any metrics that 
+    are missing rather than bailing out like `get_metrics_from_vcf.py` does
+    when the versions are mixed.
+    '''
+    elems = set()
+    for data in results.values():
+        elems.update(data)
+    filled = dict((sample, dict((e, data.get(e, '-')) for e in elems))
+        for sample, data in results.items())
+    fh = io.StringIO()
+    get_metrics_from_vcf.print_data(filled, fh, dna_only)
+    return fh.getvalue()
+
+def proc_new_vcfs(vcfs, params, num_procs, native, cache, server, qc, 
+        dna_only, panel_json, panel):
+    '''
+    Run a batch of new or changed VCFs through the MOI pipeline (and get the QC
+    metrics for them if we're keeping a QC table). Returns a dict of the data
+    to keep for each VCF, and a list of the VCFs that failed. If the batch 
+    fails, retry the VCFs one at a time so that one bad VCF does not hold up 
+    the rest.
+    '''
+    try:
+        results = {}
+        for vcf, data in proc_vcfs(vcfs, params, num_procs, native, cache, 
+                server):
+            fh = io.StringIO()
+            write_data(data, fh)
+            results[vcf] = {'moi' : fh.getvalue(), 
+                'records' : data['records']}
+        if qc:
+            if server:
+                metrics = get_metrics_from_vcf.proc_vcfs_server(vcfs, 
+                    dna_only, panel_json, num_procs, server)
+            else:
+                metrics = get_metrics_from_vcf.proc_vcfs(vcfs, dna_only, panel,
+                    num_procs)
+            for vcf, (sample, data) in zip(vcfs, metrics):
+                results[vcf]['qc'] = [sample, data]
+        return results, []
+    except Exception as e:
+        if len(vcfs) == 1:
+            sys.stderr.write("ERROR: Can not process '{}': {}\n".format(vcfs[0],
+                e))
+            return {}, vcfs
+
+    results = {}
+    failed = []
+    for vcf in vcfs:
+        res, err = proc_new_vcfs([vcf], params, 1, native, cache, server, qc,
+            dna_only, panel_json, panel)
+        results.update(res)
+        failed += err
+    return results, failed
+
+def watch_vcfs(vcf_dir, output, qc_file, title, params, num_procs, native, 
+        cache, server, dna_only, panel_json, poll, once, db=None, run_id=None,
+        qc_run_id=None):
+    '''
+    Keep `output` (and `qc_file`) up to date with the VCFs under `vcf_dir`. 
+    Only new or changed VCFs are run through the pipeline; the rows for the 
+    rest come from the watch state, so an update costs about the same no 
+    matter how big the cohort is.
+    '''
+    state_dir = output + '.watch'
+    state = ocp_watch.CohortState(state_dir, params + ['--qc', 
+        str(bool(qc_file)), '--panel', panel_json])
+    watcher = ocp_watch.VcfWatcher(vcf_dir, 
+        poll_interval=poll or ocp_watch.default_poll_interval,
+        use_inotify=not (poll or once))
+    sys.stderr.write("Watching '{}' for VCFs ({}); {} VCF(s) already "
+        "processed.\n".format(vcf_dir, watcher.mode, len(state.entries)))
+
+    panel = None
+    if qc_file and not dna_only and not server:
+        panel = get_metrics_from_vcf.load_panel(panel_json)
+
+    # VCFs that failed, and the (mtime, size) they failed at, so that we 
+    # don't keep retrying them until they change.
+    failed = {}
+    update = True
+    try:
+        while True:
+            with ocp_profile.stage('watch_check'):
+                known = state.known()
+                known.update(failed)
+                changed, removed = watcher.check(known)
+
+            for vcf in removed:
+                state.remove(vcf)
+                failed.pop(vcf, None)
+                if db:
+                    db.remove(vcf)
+
+            if changed:
+                vcfs = sorted(changed)
+                sys.stderr.write("Processing {} new or changed VCF(s).\n".format(
+                    len(vcfs)))
+                with ocp_profile.stage('process_vcfs'):
+                    results, errors = proc_new_vcfs(vcfs, params, num_procs, 
+                        native, cache, server, qc_file, dna_only, panel_json, 
+                        panel)
+                for vcf in sorted(results):
+                    records = results[vcf].pop('records')
+                    if db:
+                        dna, rna = get_names(vcf)
+                        db.put_mois(vcf, dna, rna, records, run_id)
+                        if qc_file:
+                            db.put_qc(vcf, results[vcf]['qc'][0],
+                                results[vcf]['qc'][1], qc_run_id)
+                    state.put(vcf, changed[vcf], results[vcf])
+                    failed.pop(vcf, None)
+                if db:
+                    db.commit()
+                for vcf in errors:
+                    failed[vcf] = changed[vcf]
+
+            if changed or removed or update:
+                with ocp_profile.stage('write_output'):
+                    entries = state.data()
+                    ocp_watch.atomic_write(output, title + ''.join(
+                        data['moi'] for vcf, data in entries))
+                    if qc_file and entries:
+                        ocp_watch.atomic_write(qc_file, qc_table(dict(
+                            data['qc'] for vcf, data in entries), dna_only))
+                sys.stderr.write("{}: {} VCF(s) in '{}'.\n".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S'), len(entries), output))
+                update = False
+
+            if once:
+                skipped = watcher.waiting()
+                if skipped:
+                    sys.stderr.write("WARN: Skipped {} VCF(s) that are still "
+                        "being written.\n".format(len(skipped)))
+                break
+            watcher.wait()
+    except KeyboardInterrupt:
+        sys.stderr.write("Stopped watching '{}'.\n".format(vcf_dir))
+    finally:
+        watcher.close()
+
+def main(vcfs, cn, cu, cl, reads, pedmatch, blood, output, num_procs, quiet,
+        native, cache_dir, cache_size, server_socket=None, watch_dir=None,
+        qc_file=None, panel_json=get_metrics_from_vcf.default_panel, poll=None,
+        once=False, shard=None, db_file=None, columnar_file=None):
     # Setup MOI Reporter args; start with CNV pipeline args
     moi_reporter_args = parse_cnv_params(cu, cl, cn)
 
@@ -339,31 +767,106 @@ def main(vcfs, cn, cu, cl, reads, pedmatch, blood, output, num_procs, quiet):
     if pedmatch:
         moi_reporter_args.append('-p')
 
-    moi_data = proc_vcfs(vcfs, moi_reporter_args, num_procs)
+    cache = None
+    if cache_dir:
+        cache = moi_cache.MoiCache(cache_dir, cache_size)
+
+    server = None
+    if server_socket:
+        server = moi_server.connect(server_socket)
+
+    db = run_id = qc_run_id = None
+    if db_file:
+        db = cohort_db.CohortDB(db_file)
+        run_id = db.add_run('collate_moi_reports', version, {
+            'params' : moi_reporter_args, 
+            'engine' : 'native' if (native or server) else 'perl'})
+        if watch_dir and qc_file:
+            qc_run_id = db.add_run('get_metrics_from_vcf', 
+                get_metrics_from_vcf.version, {'dna_only' : blood,
+                'panel' : None if blood else os.path.abspath(panel_json)})
+
+    if watch_dir:
+        title = io.StringIO()
+        print_title(title, cu, cl, cn, reads, pedmatch)
+        title.write(','.join(header) + "\n")
+        watch_vcfs(watch_dir, output, qc_file, title.getvalue(), 
+            moi_reporter_args, num_procs, native, cache, server, blood, 
+            panel_json, poll, once, db, run_id, qc_run_id)
+        if db:
+            db.close()
+        if cache:
+            cache.evict()
+        return
+
+    # Setup an output file if we want one
+    outfile = ''
+    if output:
+        print("Writing output to '%s'" % output)
+        outfile = open(output, 'w')
+    else:
+        outfile = sys.stdout
+
+    # For a shard, mark the file as one and only do our share of the VCFs.
+    if shard:
+        vcfs = [v for v in vcfs if in_shard(v, shard)]
+        outfile.write('#shard {}/{}\n'.format(*shard))
+
+    columnar = None
+    if columnar_file:
+        columnar = moi_columnar.MoiColumnWriter(columnar_file)
 
     # Print data
     print_title(outfile, cu, cl, cn, reads, pedmatch)
-    sys.exit()
-
-    header = ['Sample', 'Type', 'Gene', 'Position', 'Ref', 'Alt', 
-        'Transcript', 'CDS', 'AA', 'VARID', 'VAF/CN', 'Coverage/Counts',
-        'RefCov', 'AltCov', 'Function', 'Location']
     outfile.write(','.join(header) + "\n")
     
-    # Print out sample data by VCF
-    var_types = ['snv_data', 'cnv_data', 'fusion_data', 'null']
-    for sample in sorted(moi_data):
-        for var_type in var_types:
-            try:
-                print_data(var_type, moi_data[sample][var_type], outfile)
-            except KeyError:
-                continue
+    # Print out sample data by VCF as each one comes back. Rows in a shard 
+    # file get the VCF they came from up front so that we can merge on it.
+    with ocp_profile.stage('process_vcfs'):
+        for vcf, data in proc_vcfs(vcfs, moi_reporter_args, num_procs, native, 
+                cache, server):
+            with ocp_profile.record('write_output', vcf):
+                if shard:
+                    fh = io.StringIO()
+                    write_data(data, fh)
+                    outfile.write(''.join('{}\t{}\n'.format(vcf, row) 
+                        for row in fh.getvalue().splitlines()))
+                else:
+                    write_data(data, outfile)
+                outfile.flush()
+            dna, rna = data['names']
+            if db:
+                with ocp_profile.record('write_db', vcf):
+                    db.put_mois(vcf, dna, rna, data['records'], run_id)
+            if columnar:
+                with ocp_profile.record('write_columnar', vcf):
+                    columnar.add_sample(vcf, dna, rna, data['records'])
+
+    if db:
+        db.close()
+    if columnar:
+        with ocp_profile.stage('write_columnar'):
+            columnar.close()
+
+    if cache:
+        with ocp_profile.stage('cache_evict'):
+            cache.evict()
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['merge']:
+        margs = get_merge_args()
+        outfile = open(margs.output, 'w') if margs.output else sys.stdout
+        merge_shards(margs.shard_files, outfile)
+        sys.exit()
+
     args = get_args()
+    ocp_profile.start('collate_moi_reports', args)
     if debug:
         print('CLI args as passed:')
         pp(vars(args))
         print('')
     main(args.vcf_files, args.cn, args.cu, args.cl, args.reads, args.pedmatch, 
-            args.blood, args.output, args.num_procs, args.quiet)
+            args.blood, args.output, args.num_procs, args.quiet, args.native,
+            args.cache, args.cache_size, args.moi_server, args.watch, args.qc,
+            args.panel, args.poll, args.once, args.shard, args.db, 
+            args.columnar)
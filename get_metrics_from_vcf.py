@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 # 3/28/2016 - D Sims
 ################################################################################
@@ -8,15 +8,22 @@ including MAPD score, mapped RNA reads, and RNA pool reads.
 """
 import sys
 import os
-import re
-import subprocess
+import json
+import sqlite3
 import datetime
 import argparse
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from pprint import pprint as pp
-from distutils.version import LooseVersion
 
-version = '3.10.011119'
+import ocp_vcf
+import match_moi
+import ocp_profile
+import moi_server
+import cohort_db
+
+version = '3.14.101726'
 
 # Flag Thresholds; Make into args at some point.
 mapd_threshold = 0.5
@@ -24,6 +31,10 @@ rna_reads = 500000
 pool_reads = 100000
 expr_sum = 20000
 
+# Same panel JSON that `match_rna_qc.pl` uses to map assays to RNA pools.
+default_panel = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'fusion_panel.json')
+
 def get_args():
     parser = argparse.ArgumentParser(description = __doc__)
     parser.add_argument(
@@ -38,11 +49,33 @@ def get_args():
         help='Data comes from DNA only specimens and no RNA data to report. '
             'Essentially reporting MAPD only.'
     )
+    parser.add_argument(
+        '-p', '--panel',
+        metavar='<panel.json>',
+        default=default_panel,
+        help='Custom panel JSON file mapping RNA assays to pools (DEFAULT: '
+            '%(default)s)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        metavar='<INT>',
+        type=int,
+        default=1,
+        help='Number of VCF files to process in parallel (DEFAULT: %(default)s)'
+    )
+    moi_server.add_args(parser)
+    parser.add_argument(
+        '--db',
+        metavar='<cohort.db>',
+        help='Also store the metrics for each VCF in this SQLite cohort '
+            'database (see `cohort_db.py`), replacing any from earlier runs.'
+    )
     parser.add_argument(
         '-o', '--output', 
         metavar='<outfile>', 
         help='Custom output file (DEFAULT: %(default)s)'
     )
+    ocp_profile.add_args(parser)
     parser.add_argument(
         '-v', '--version',
         action='version',
@@ -51,91 +84,122 @@ def get_args():
     args = parser.parse_args()
     return args
 
-def read_vcf(vcf_file, max_mapd, min_rna_reads, min_pool_reads, min_expr_sum):
+def read_vcf(vcf_file, max_mapd, min_rna_reads, min_pool_reads, min_expr_sum,
+        panel=None, dna_only=False):
+    '''
+    Read the VCF once and return the sample name and the metrics for it. DNA 
+    only metrics all live in the header, so in that case we stop reading at the 
+    `#CHROM` line.
+    '''
     oca_v3_version = '2.3'
-    expr_sum = 0
     fetched_data = {}
 
-    try:
-        with open(vcf_file) as fh:
-            for line in fh:
-                if not line.startswith('#') and 'SVTYPE=ExprControl' not in line:
-                    continue
-                # Get the MAPD metric
-                elif line.startswith('##mapd='):
-                    mapd = get_value(line.rstrip())
-                    if float(mapd) > max_mapd:
-                        mapd = flag_val(mapd)
-                    fetched_data['MAPD'] = mapd
-
-                # Get the total mapped reads metric.
-                elif line.startswith('##TotalMappedFusionPanelReads='):
-                    rna_reads = get_value(line.rstrip())
-                    if int(rna_reads) < min_rna_reads:
-                        rna_reads = flag_val(rna_reads)
-                    fetched_data['RNA_Reads'] = rna_reads
-
-                # Add a date to the output.
-                elif line.startswith('##fileDate'):
-                    date = datetime.datetime.strptime(get_value(line.rstrip()),
-                        "%Y%M%d")
-                    formatted_date = date.strftime("%Y-%M-%d")
-                    fetched_data['Date'] = (formatted_date)
-
-                # Find the OVAT version to get the oncomine version
-                elif line.startswith('##OncomineVariantAnnotationToolVersion'):
-                    ovat_version = get_value(line.rstrip())
-
-                # elif re.search('SVTYPE=ExprControl',line):
-                elif 'SVTYPE=ExprControl' in line:
-                    read_count = re.search('READ_COUNT=(\d+).*',line).group(1)
-                    expr_sum += int(read_count)
-
-            # Get the pool level info if we are running at least OCAv3
-            if LooseVersion(ovat_version) > LooseVersion(oca_v3_version):
-                p1, p2 = get_rna_pool_info(vcf_file)
-                if int(p1) < min_pool_reads:
-                    p1 = flag_val(p1)
-                if int(p2) < min_pool_reads:
-                    p2 = flag_val(p2)
-                fetched_data['Pool1'] = p1
-                fetched_data['Pool2'] = p2
-
-            # if expr_sum < 20000:
-            if expr_sum < min_expr_sum:
-                expr_sum = flag_val(str(expr_sum))
-            fetched_data['Expr_Sum'] = expr_sum
-
-    except IOError as e:
-        sys.stderr.write('ERROR: Can not open file {}: {}!\n'.format(vcf_file,e))
-        sys.exit()
-    return fetched_data
+    # Only need the header, and the expression and fusion lines for the RNA 
+    # pool sums.
+    wanted = () if dna_only else ('expression', 'fusion')
+    vcf_data = ocp_vcf.read_vcf(vcf_file, wanted=wanted)
+
+    # Get the MAPD metric
+    mapd = vcf_data.mapd
+    if mapd is not None:
+        if float(mapd) > max_mapd:
+            mapd = flag_val(mapd)
+        fetched_data['MAPD'] = mapd
+
+    # Get the total mapped reads metric.
+    rna_reads = vcf_data.mapped_fusion_reads
+    if rna_reads is not None:
+        if int(rna_reads) < min_rna_reads:
+            rna_reads = flag_val(rna_reads)
+        fetched_data['RNA_Reads'] = rna_reads
+
+    # Add a date to the output.
+    if vcf_data.file_date is not None:
+        date = datetime.datetime.strptime(vcf_data.file_date, "%Y%M%d")
+        formatted_date = date.strftime("%Y-%M-%d")
+        fetched_data['Date'] = (formatted_date)
+
+    # Keep the OVAT version too, for the cohort database.
+    ovat_version = vcf_data.header.get('OncomineVariantAnnotationToolVersion',
+        '0')
+    fetched_data['OVAT'] = ovat_version
+
+    if dna_only:
+        return vcf_data.sample, fetched_data
+
+    # Get the pool level info if we are running at least OCAv3
+    if (match_moi.version_key(ovat_version) >
+            match_moi.version_key(oca_v3_version)):
+        if panel is None:
+            raise ValueError("Can not find the panel JSON file needed to get "
+                "the RNA pool reads for {}".format(vcf_file))
+        p1, p2 = get_rna_pool_info(vcf_data, panel)
+        if int(p1) < min_pool_reads:
+            p1 = flag_val(p1)
+        if int(p2) < min_pool_reads:
+            p2 = flag_val(p2)
+        fetched_data['Pool1'] = p1
+        fetched_data['Pool2'] = p2
+
+    expr_sum = vcf_data.expr_sum('ExprControl')
+    if expr_sum < min_expr_sum:
+        expr_sum = flag_val(str(expr_sum))
+    fetched_data['Expr_Sum'] = expr_sum
+    return vcf_data.sample, fetched_data
 
 def flag_val(val):
     return '*' + val + '*'
 
-def get_rna_pool_info(vcf):
+def load_panel(panel_json):
+    '''
+    Load the panel JSON that maps each RNA assay to its pool. Returns None if 
+    there is no panel file, since it's only needed for OCAv3 data.
+    '''
+    if not os.path.isfile(panel_json):
+        return None
+    with open(panel_json) as fh:
+        return json.load(fh)
+
+def get_pool_sum(records, assay_type, panel):
+    '''
+    Sum reads by pool the same way `match_rna_qc.pl` does; assays in both pools 
+    ('pool1,2') count half towards each.
+    '''
+    pools = panel.get(assay_type, {})
+    sum1 = sum2 = 0
+    for rec in records:
+        pool = pools.get(rec.assay_id)
+        if pool == 'pool1':
+            sum1 += rec.read_count
+        elif pool == 'pool2':
+            sum2 += rec.read_count
+        elif pool == 'pool1,2':
+            sum1 += rec.read_count/2.0
+            sum2 += rec.read_count/2.0
+    return sum1, sum2
+
+def get_rna_pool_info(vcf_data, panel):
     '''
-    Use the `match_rna_qc.pl` tool to get pool level reads for our output.
+    Get the pool level reads (expression control, gene expression, and fusion 
+    reads) for our output. Same as the `pool1_total` and `pool2_total` from 
+    `match_rna_qc.pl -a`.
     '''
-    p = subprocess.Popen(['match_rna_qc.pl', '-a', vcf], stdout=subprocess.PIPE, 
-        stderr=subprocess.PIPE)
-    (data,err) = p.communicate()
-    ret_res = data.split('\n')
-    results = dict(zip(ret_res[0].split(','),ret_res[1].split(',')))
-    p1_tot = str(round(float(results['pool1_total'])))
-    p2_tot = str(round(float(results['pool2_total'])))
-    return p1_tot.split('.')[0], p2_tot.split('.')[0]
+    ec1, ec2 = get_pool_sum(
+        [x for x in vcf_data.expression if x.svtype == 'ExprControl'], 
+        'ExprControl', panel)
+    ge1, ge2 = get_pool_sum(
+        [x for x in vcf_data.expression if x.svtype == 'GeneExpression'], 
+        'GeneExpression', panel)
+    fus1, fus2 = get_pool_sum(vcf_data.fusions, 'Fusion', panel)
+
+    # There are two lines for each fusion, so need to divide by 2.
+    p1_tot = ec1 + ge1 + fus1/2.0
+    p2_tot = ec2 + ge2 + fus2/2.0
+    return str(int(round(p1_tot))), str(int(round(p2_tot)))
 
 def get_value(line):
     return line.split('=')[1]
 
-def get_name_from_vcf(vcf):
-    with open(vcf) as fh:
-        for line in fh:
-            if line.startswith('#CHROM'):
-                return line.split('\t')[-1].rstrip('\n')
-
 def col_size(data):
     col_width = 0
     for i in data:
@@ -146,7 +210,7 @@ def col_size(data):
 def print_data(results,outfile,dna_only):
     # Figure out if we have two different versions of analysis, and if so bail out 
     # to make easier.
-    l = [len(v) for k,v in results.iteritems()]
+    l = [len(v) for k,v in results.items()]
     if len(set(l)) > 1:
         sys.stderr.write('Mixed version VCFs detected!  We can not process two '
             'different versions together! Please run separately and cat the data '
@@ -173,7 +237,7 @@ def print_data(results,outfile,dna_only):
         fstring = '{:<14}{:<10}\n'
     else:
         fstring = '{:<14}{:<10}{:<14}{:<14}\n' 
-        if l[0] == 6:
+        if 'Pool1' in list(results.values())[0]:
             fstring = fstring.replace('\n','{:<14}{:<14}\n')
             header_elems += ['Pool1','Pool2']
 
@@ -185,19 +249,87 @@ def print_data(results,outfile,dna_only):
         out_res = [results[sample][r] for r in header_elems]
         outfile.write(fstring.format(*out_res))
 
-def main(vcfs, dna_only, out_fh):
+def arg_star(args):
+    with ocp_profile.record('read_vcf', args[0]):
+        return read_vcf(*args)
+
+def proc_vcfs(vcfs, dna_only, panel, num_procs):
+    '''
+    Get the metrics for each VCF, either in a single loop or spread out over 
+    a pool of `num_procs` worker processes.
+    '''
+    task_list = [(v, mapd_threshold, rna_reads, pool_reads, expr_sum, panel, 
+        dna_only) for v in vcfs]
+
+    if num_procs < 2 or len(task_list) < 2:
+        return [arg_star(t) for t in task_list]
+
+    pool = multiprocessing.Pool(min(num_procs, len(task_list)))
+    try:
+        return pool.map(arg_star, task_list)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def proc_vcfs_server(vcfs, dna_only, panel_json, num_procs, server):
+    '''
+    Have a `moi_server.py` get the metrics for each VCF. The server has its own
+    workers, so we only need threads here to keep it busy.
+    '''
+    def get_metrics(vcf):
+        with ocp_profile.record('read_vcf', vcf):
+            return server.metrics(vcf, dna_only, panel_json)
+
+    pool = ThreadPool(max(1, min(num_procs, len(vcfs))))
+    try:
+        return pool.map(get_metrics, vcfs)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def store_metrics(db_file, vcfs, metrics, dna_only, panel_json):
+    '''Upsert the metrics for each VCF into a `cohort_db` database.'''
+    db = cohort_db.CohortDB(db_file)
+    run_id = db.add_run('get_metrics_from_vcf', version, {'dna_only' : dna_only,
+        'panel' : None if dna_only else os.path.abspath(panel_json),
+        'mapd_threshold' : mapd_threshold, 'rna_reads' : rna_reads, 
+        'pool_reads' : pool_reads, 'expr_sum' : expr_sum})
+    for vcf, (sample_name, data) in zip(vcfs, metrics):
+        db.put_qc(vcf, sample_name, data, run_id)
+    db.close()
+
+def main(vcfs, dna_only, out_fh, panel_json=default_panel, num_procs=1,
+        server_socket=None, db_file=None):
     results = {}
-    for vcf in vcfs:
-        sample_name = get_name_from_vcf(vcf)
-        results[sample_name] = read_vcf(vcf, mapd_threshold, rna_reads, 
-            pool_reads, expr_sum)
-    print_data(results, out_fh, dna_only)
+    try:
+        with ocp_profile.stage('read_vcfs'):
+            if server_socket:
+                server = moi_server.connect(server_socket)
+                metrics = proc_vcfs_server(vcfs, dna_only, panel_json,
+                    num_procs, server)
+            else:
+                with ocp_profile.stage('load_panel'):
+                    panel = None if dna_only else load_panel(panel_json)
+                metrics = proc_vcfs(vcfs, dna_only, panel, num_procs)
+            for sample_name, data in metrics:
+                results[sample_name] = data
+        if db_file:
+            with ocp_profile.stage('write_db'):
+                store_metrics(db_file, vcfs, metrics, dna_only, panel_json)
+    except (IOError, ValueError, sqlite3.Error, 
+            moi_server.MoiServerError) as e:
+        sys.stderr.write('ERROR: {}!\n'.format(e))
+        sys.exit(1)
+    with ocp_profile.stage('write_output'):
+        print_data(results, out_fh, dna_only)
 
 if __name__=='__main__':
     args = get_args()
+    ocp_profile.start('get_metrics_from_vcf', args)
     if args.output:
         sys.stdout.write('Writing results to %s.\n' % args.output)
         out_fh = open(args.output,'w')
     else:
         out_fh = sys.stdout
-    main(args.vcf, args.dna_only, out_fh)
+    main(args.vcf, args.dna_only, out_fh, args.panel, args.jobs, 
+        args.moi_server, args.db)
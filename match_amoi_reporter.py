@@ -9,28 +9,59 @@
 Starting with an Ion Reporter VCF that has been run as a part of the Oncomine
 Comprehensive Assay (OCA) system, run through the MATCH MOI Reporter script and 
 generate a list of variants that would be inclusionary for the NCI-MATCH Outside
-Labs (AKA Designated Labs) initiative.
+Labs (AKA Designated Labs) initiative. More than one VCF (or a manifest
+listing them) can be run at once, in which case the results for all samples are
+output together, with a sample column added to each section.
 """
+import os
 import sys
 import csv
+import json
 import argparse
+import tempfile
+import time
 import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from pprint import pprint as pp # noqa 
 
-from matchbox_api_utils import TreatmentArms
+import match_moi
+import moi_record
+import ocp_vcf
+import ocp_profile
+import moi_server
 
-version = '0.9.022619'
-match_arms = TreatmentArms(matchbox='adult', quiet=True)
-sys.stderr.write("Note: using version %s of Treatment Arms DB.\n" 
-    % match_arms.db_date)
+version = '0.14.101726'
+
+default_index = os.path.join(os.path.expanduser('~'), '.ocp_tools', 
+    'amoi_index.json')
+# Hours between checks of the Treatment Arms DB date behind the aMOI index.
+default_index_ttl = 24
+query_fields = ('type', 'gene', 'identifier', 'exon', 'function', 
+    'oncominevariantclass')
 
 def get_args():
     parser = argparse.ArgumentParser(description = __doc__)
     parser.add_argument(
         'vcf', 
-        metavar="<VCF File>",
-        help = 'Input VCF file to run.'
+        metavar="<VCF File(s)>",
+        nargs='*',
+        help = 'Input VCF file(s) to run.'
+    )
+    parser.add_argument(
+        '-m', '--manifest',
+        metavar='<manifest>',
+        help='File listing VCF files to run, one per line. Can be used in '
+            'addition to, or instead of, VCFs on the command line.'
+    )
+    parser.add_argument(
+        '-n', '--num_procs',
+        metavar='<INT>',
+        type=int,
+        default=1,
+        help='Number of VCFs to run through the MOI rules at once (DEFAULT: '
+            '%(default)s)'
     )
     parser.add_argument(
         '-s', '--status',
@@ -46,11 +77,40 @@ def get_args():
         help='Do not restrict output to arms that are open to the Designated '
             'Labs program.'
     )
+    parser.add_argument(
+        '-N', '--native',
+        action='store_true',
+        help='Run the MOI rules in-process with the `match_moi` module rather '
+            'than running `match_moi_report.pl`.'
+    )
+    moi_server.add_args(parser)
+    parser.add_argument(
+        '-i', '--index',
+        metavar='<index.json>',
+        default=default_index,
+        help='aMOI lookup index file to use (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '-r', '--rebuild_index',
+        action='store_true',
+        help='Load the Treatment Arms DB and start a fresh aMOI lookup index. '
+            'Use after the Treatment Arms DB has been updated.'
+    )
+    parser.add_argument(
+        '--index_ttl',
+        metavar='<hours>',
+        type=float,
+        default=default_index_ttl,
+        help='Hours before the aMOI index checks the date of the Treatment '
+            'Arms DB again, and starts over if there is a newer one. '
+            '(DEFAULT: %(default)s)'
+    )
     parser.add_argument(
         '-o', '--outfile', 
         metavar='<outfile>',
         help='Custom output file (DEFAULT: %(default)s)'
     )
+    ocp_profile.add_args(parser)
     parser.add_argument(
         '-v', '--version', 
         action='version', 
@@ -58,61 +118,224 @@ def get_args():
     )
     args = parser.parse_args()
 
+    if args.manifest:
+        try:
+            with open(args.manifest) as fh:
+                args.vcf += [l.strip() for l in fh 
+                    if l.strip() and not l.startswith('#')]
+        except IOError as e:
+            sys.stderr.write('ERROR: Can not read manifest %s: %s\n' 
+                % (args.manifest, e))
+            sys.exit(1)
+    if not args.vcf:
+        sys.stderr.write('ERROR: No VCF files to process!\n')
+        parser.print_usage(sys.stderr)
+        sys.exit(1)
+
     ol_string = "are" if args.dl_excluded else "are not"
     sys.stderr.write("Outputting arms with status %s that %s open to outside "
         "labs.\n" % (args.status, ol_string))
     return args
 
-def read_vcf(vcf, status, outside):
+class AmoiIndex(object):
+    """
+    Persistent aMOI lookup index so that we don't have to load the Treatment 
+    Arms DB and run `map_amoi` for every variant on every run. Each entry maps 
+    the variant query (type, gene, identifier, exon, function, and variant 
+    class) plus the arm status and outside labs filters to the list of arms.
+    The index is stamped with the `db_date` of the Treatment Arms DB it was 
+    built from and is thrown out as soon as a different DB is loaded. The DB
+    itself is only loaded when a lookup is not in the index, or when it has
+    been more than `ttl` hours since we last checked its date, so that a new
+    DB is picked up even if every lookup is a hit.
+    """
+    def __init__(self, index_file, rebuild=False, ttl=default_index_ttl):
+        self.index_file = index_file
+        self.ttl = ttl * 3600
+        self.db_date = None
+        self.checked = 0
+        self.entries = {}
+        self.updated = False
+        self._arms = None
+
+        if not rebuild and os.path.isfile(index_file):
+            try:
+                with open(index_file) as fh:
+                    data = json.load(fh)
+                self.db_date = data['db_date']
+                self.entries = data['entries']
+                self.checked = data.get('checked', 0)
+            except (IOError, ValueError, KeyError):
+                sys.stderr.write("WARN: Can not read the aMOI index %s. "
+                    "Starting a new one.\n" % index_file)
+        if rebuild or self.db_date is None:
+            self.load_arms()
+        else:
+            self.check_db()
+
+    def load_arms(self):
+        if self._arms is None:
+            from matchbox_api_utils import TreatmentArms
+            self._arms = TreatmentArms(matchbox='adult', quiet=True)
+            sys.stderr.write("Note: using version %s of Treatment Arms DB.\n" 
+                % self._arms.db_date)
+            if self._arms.db_date != self.db_date:
+                if self.db_date is not None:
+                    sys.stderr.write("Note: Treatment Arms DB has changed "
+                        "since %s. Starting a new aMOI index.\n" % self.db_date)
+                self.db_date = self._arms.db_date
+                self.entries = {}
+            self.checked = time.time()
+            self.updated = True
+        return self._arms
+
+    def check_db(self):
+        """
+        Reload the Treatment Arms DB to check its date if it's been more than
+        `ttl` since the last time.
+        """
+        if time.time() - self.checked > self.ttl:
+            self._arms = None
+            self.load_arms()
+
+    @staticmethod
+    def key(var_query, outside, status):
+        return '\t'.join(str(var_query[x]) for x in query_fields) + \
+            '\t{}\t{}'.format(outside, status)
+
+    def map_amoi(self, var_query, outside, status):
+        self.check_db()
+        key = self.key(var_query, outside, status)
+        try:
+            return self.entries[key]
+        except KeyError:
+            pass
+        arms = self.load_arms().map_amoi(var_query, outside=outside, 
+            status=status)
+        # The arms are all that we need, so store as a plain list.
+        self.entries[key] = list(arms) if arms else []
+        self.updated = True
+        return self.entries[key]
+
+    def save(self):
+        """Write the index back out atomically if anything was added."""
+        if not self.updated:
+            return
+        index_dir = os.path.dirname(os.path.abspath(self.index_file))
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        fd, tmp = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump({'db_date' : self.db_date, 'checked' : self.checked, 
+                'entries' : self.entries}, fh)
+        os.rename(tmp, self.index_file)
+        self.updated = False
+
+def read_vcf(vcf, native=False, server=None, status='OPEN', outside=True):
     """
-    Run the VCF file through match_moi_report.pl and generate a CSV of data.
+    Run the VCF file through match_moi_report.pl and return the sample name and 
+    the MOI rows. If `native` is set, run the MOI rules in-process with 
+    `match_moi` instead. The rows are None if the MOI report failed. If we have
+    a `server`, it runs the MOI rules and maps the aMOIs (with its own aMOI 
+    index) for us, and the rows come back with the arms already added.
     """
-    sys.stdout.write("Running `match_moi_report.pl` on VCF file...\n")
-    cmd = ['match_moi_report.pl', '--cn' , '7', '--reads', '1000', '--Raw', vcf]
+    if server:
+        try:
+            return server.amoi(vcf, status, outside)
+        except moi_server.MoiServerError as e:
+            sys.stderr.write('ERROR: MOI server could not process %s: %s\n' 
+                % (vcf, e))
+            return None, None
+
+    # A bad VCF only loses that one sample, like a failed match_moi_report.pl
+    # run does, rather than taking down the whole batch.
+    sample = None
+    moi_params = ['--cn' , '7', '--reads', '1000', '--Raw']
+    try:
+        sample = ocp_vcf.read_vcf(vcf, wanted=()).sample
+        if native:
+            var_data = match_moi.moi_report(vcf,
+                **match_moi.parse_moi_args(moi_params))
+            return sample, var_data
+    except Exception as e:
+        sys.stderr.write('ERROR: Could not run the MOI rules on %s: %s\n'
+            % (vcf, e))
+        return sample, None
+
+    sys.stderr.write("Running `match_moi_report.pl` on %s...\n" % vcf)
+    cmd = ['match_moi_report.pl'] + moi_params + [vcf]
     p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
         encoding="UTF-8")
     pout, perr = p.communicate()
     if p.returncode != 0:
         sys.stderr.write('ERROR: Encountered problem running '
-            '`match_moi_report.pl`. Returned error:\n')
+            '`match_moi_report.pl` on %s. Returned error:\n' % vcf)
         sys.stderr.write("%s" % perr)
         sys.stderr.flush()
+        return sample, None
     else:
         var_data = list(x for x in csv.reader(pout.split('\n'), delimiter=',')
                 if x)
         # Always get a blank line in the output, which we don't want. 
-        #  return build_variant_dict(list(var_data)[:-1], status, outside)
-        return build_variant_dict(var_data, status, outside)
+        return sample, var_data
+
+def arg_star(args):
+    with ocp_profile.record('moi_report', args[0]):
+        return read_vcf(*args)
+
+def proc_vcfs(vcfs, native, num_procs, server=None, status='OPEN', 
+        outside=True):
+    """
+    Run the MOI rules on each VCF, in parallel if `num_procs` > 1, and return a
+    list of (sample, rows) in input order. The `match_moi_report.pl` workers 
+    only wait on a subprocess (or the MOI server) so threads are fine for 
+    those; the in-process (`native`) rules are CPU bound and get a process pool.
+    """
+    task_list = [(v, native, server, status, outside) for v in vcfs]
+    if num_procs < 2 or len(task_list) < 2:
+        return [arg_star(t) for t in task_list]
 
-def build_variant_dict(variant_data, status, outside):
+    sys.stderr.write("Processing %s VCF files using %s workers.\n" 
+        % (len(task_list), num_procs))
+    num_procs = min(num_procs, len(task_list))
+    if native and not server:
+        pool = multiprocessing.Pool(num_procs)
+    else:
+        pool = ThreadPool(num_procs)
+    try:
+        return pool.map(arg_star, task_list)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def build_variant_dict(variant_data, status, outside, amoi_index):
     """
-    Read each variant line and build the required dictionary for parsing with 
-    matchbox_api_utils.
+    Build the required dictionary for parsing with matchbox_api_utils from each
+    `moi_record` record, and add the aMOI arms to the record.
     """
     for var in variant_data:
         # Set up a dict to pass into the amoi mapper function. Need all keys,
         # so set unecessary values to `None`.
-        var_query = dict((x, None) for x in ('type', 'gene', 'identifier',
-            'exon', 'function', 'oncominevariantclass'))
-        if var[0] == 'SNV':
+        var_query = dict((x, None) for x in query_fields)
+        if var.type == 'SNV':
             var_query['type']                 = 'snvs_indels'
-            var_query['gene']                 = var[9]
-            var_query['identifier']           = var[8]
-            var_query['exon']                 = var[13] 
-            var_query['function']             = var[14]
-            var_query['oncominevariantclass'] = var[15]
-        elif var[0] == 'CNV':
+            var_query['gene']                 = var.gene
+            var_query['identifier']           = var.varid
+            var_query['exon']                 = var.exon
+            var_query['function']             = var.function
+            var_query['oncominevariantclass'] = var.oncomine_class
+        elif var.type == 'CNV':
             var_query['type'] = 'cnvs'
-            var_query['gene'] = var[1]
-        elif var[0] == 'Fusion':
+            var_query['gene'] = var.gene
+        elif var.type == 'Fusion':
             var_query['type']       = 'fusions'
-            var_query['gene']       = var[4]
+            var_query['gene']       = var.gene
             # The ID matching string is complicated. The MB team has some
             # variability in there that we need to code around.
-            if var[2] not in ('-', '.'):
-                var_query['identifier'] = '{}.{}'.format(var[1], var[2])
+            if var.varid not in ('-', '.'):
+                var_query['identifier'] = '{}.{}'.format(var.fusion, var.varid)
             else:
-                var_query['identifier'] = var[1]
+                var_query['identifier'] = var.fusion
 
         if status == 'ALL':
             status = None
@@ -120,22 +343,32 @@ def build_variant_dict(variant_data, status, outside):
         # Add the aMOI mapping data from MATCHbox.
         # print('-'*50)
         # pp(var_query)
-        arms = match_arms.map_amoi(var_query, outside=outside, status=status)
+        arms = amoi_index.map_amoi(var_query, outside=outside, status=status)
         # pp(arms)
         # print('-'*50)
 
         if arms:
-            var.append(';'.join(arms))
+            var.arms = ';'.join(arms)
         else:
-            var.append('---')
+            var.arms = '---'
     return variant_data
 
-def print_data(data, outfile):
+def print_data(data, outfile, samples=None):
     """
     Print the results out as a CSV with non-conforming title strings and whatnot
     to make somewhat useable in both CSV and human readable format.  If we start
-    to use this programmatically, we can make it conventional CSV.
+    to use this programmatically, we can make it conventional CSV. If a list of
+    `samples` is passed, `data` is a matching list of record lists and a 
+    sample column is added to each section.
     """
+    if samples is None:
+        sample_col = []
+        data = [([], var) for var in data]
+    else:
+        sample_col = ['Sample']
+        data = [([s], var) for s, variants in zip(samples, data) 
+            for var in variants]
+
     if outfile:
         sys.stderr.write('Writing data to %s\n' % outfile)
         outfh = open(outfile, 'w')
@@ -143,46 +376,85 @@ def print_data(data, outfile):
         outfh = sys.stdout
     csv_writer = csv.writer(outfh, delimiter=',', lineterminator='\n')
 
-    snv_results = [var for var in data if var[0] == 'SNV']
-    cnv_results = [var for var in data if var[0] == 'CNV']
-    fusion_results = [var for var in data if var[0] == 'Fusion']
+    snv_results = [x for x in data if x[1].type == 'SNV']
+    cnv_results = [x for x in data if x[1].type == 'CNV']
+    fusion_results = [x for x in data if x[1].type == 'Fusion']
     
     outfh.write(':::  SNV Results :::\n')
-    csv_writer.writerow(['Chr:Position', 'REF', 'ALT', 'VAF', 'Cov', 'ID',
-        'Gene', 'Transcript', 'CDS', 'AA', 'Exon', 'Function', 'VariantClass',
-        'MATCH_Arms'])
+    csv_writer.writerow(sample_col + ['Chr:Position', 'REF', 'ALT', 'VAF', 
+        'Cov', 'ID', 'Gene', 'Transcript', 'CDS', 'AA', 'Exon', 'Function', 
+        'VariantClass', 'MATCH_Arms'])
     if snv_results:
-        fields = (1, 2, 3, 4, 5, 8, 9, 10, 11, 12, 13, 14, 16, 17)
-        for var in snv_results:
-            csv_writer.writerow([var[i] for i in fields])
+        fields = ('position', 'ref', 'alt', 'vaf', 'coverage', 'varid', 'gene',
+            'transcript', 'cds', 'aa', 'exon', 'function', 'rule', 'arms')
+        for sample, var in snv_results:
+            csv_writer.writerow(sample + [var.text(f) for f in fields])
     else:
         outfh.write('No SNVs found.\n')
     outfh.write('\n')
 
     outfh.write(':::  CNV Results :::\n')
-    csv_writer.writerow(['Chr', 'Gene', 'CN', 'MAPD', 'MATCH_Arms'])
+    csv_writer.writerow(sample_col + ['Chr', 'Gene', 'CN', 'MAPD', 
+        'MATCH_Arms'])
     if cnv_results:
-        fields = (2, 1, 5, 7, 8)
-        for var in cnv_results:
-            csv_writer.writerow([var[i] for i in fields])
+        fields = ('chrom', 'gene', 'copy_number', 'mapd', 'arms')
+        for sample, var in cnv_results:
+            csv_writer.writerow(sample + [var.text(f) for f in fields])
     else:
         outfh.write('No CNVs found.\n')
     outfh.write('\n')
 
     outfh.write(':::  Fusion Results :::\n')
-    csv_writer.writerow(['Fusion', 'ID', 'Drive_Gene', 'Reads', 'MATCH_Arms'])
+    csv_writer.writerow(sample_col + ['Fusion', 'ID', 'Drive_Gene', 'Reads', 
+        'MATCH_Arms'])
     if fusion_results:
-        fields = (1, 2, 4, 3, 6)
-        for var in fusion_results:
-            csv_writer.writerow([var[i] for i in fields])
+        fields = ('fusion', 'varid', 'gene', 'read_count', 'arms')
+        for sample, var in fusion_results:
+            csv_writer.writerow(sample + [var.text(f) for f in fields])
     else:
         outfh.write('No Fusions found.\n')
     outfh.write('\n')
 
-def main(vcf, outfile, arm_status, dl_excluded):
-    variant_data = read_vcf(vcf, arm_status, dl_excluded)
-    print_data(variant_data, outfile)
+def main(vcfs, outfile, arm_status, dl_excluded, native, index_file=default_index,
+        rebuild_index=False, num_procs=1, server_socket=None,
+        index_ttl=default_index_ttl):
+    # Only have to load the arms DB / index once for the whole batch; the aMOI
+    # mapping is all dict lookups, so it's done here rather than in workers.
+    # A MOI server keeps its own index loaded and does the mapping itself.
+    server = None
+    if server_socket:
+        server = moi_server.connect(server_socket)
+    else:
+        amoi_index = AmoiIndex(index_file, rebuild_index, index_ttl)
+    samples = []
+    variant_data = []
+    with ocp_profile.stage('moi_reports'):
+        results = proc_vcfs(vcfs, native, num_procs, server, arm_status, 
+            dl_excluded)
+    with ocp_profile.stage('map_amoi'):
+        for (sample, var_data), vcf in zip(results, vcfs):
+            if var_data is None:
+                continue
+            samples.append(sample)
+            records = moi_record.from_rows(var_data)
+            if server:
+                variant_data.append(records)
+                continue
+            with ocp_profile.record('map_amoi', vcf):
+                variant_data.append(build_variant_dict(records, arm_status, 
+                    dl_excluded, amoi_index))
+        if not server:
+            amoi_index.save()
+
+    with ocp_profile.stage('write_output'):
+        if len(vcfs) == 1:
+            print_data(variant_data[0] if variant_data else [], outfile)
+        else:
+            print_data(variant_data, outfile, samples)
 
 if __name__ == '__main__':
     args = get_args()
-    main(args.vcf, args.outfile, args.status, args.dl_excluded)
+    ocp_profile.start('match_amoi_reporter', args)
+    main(args.vcf, args.outfile, args.status, args.dl_excluded, args.native,
+        args.index, args.rebuild_index, args.num_procs, args.moi_server,
+        args.index_ttl)
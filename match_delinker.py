@@ -7,16 +7,25 @@
 import sys
 import re
 import os
+import errno
+import fcntl
+import struct
 import random
 import argparse
 import shutil
 import datetime
-import subprocess
-from collections import defaultdict
+import zlib
+import gzip
+import multiprocessing
 from pprint import pprint as pp
 
-version = '1.3.0_030817'
-cwd = os.getcwd()
+import ocp_vcf
+import ocp_profile
+
+version = '1.5.1_101726'
+status_file = 'delink_status.txt'
+work_dir = '.delink_work'
+default_registry = os.path.join(os.path.expanduser('~'), '.ocp_tools', 'delink_registry.csv')
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -24,10 +33,12 @@ def get_args():
         description=
         '''
         Program to delink MATCH Data.  Based on input in the form of an MSN list, plus a directory containing the 
-        corresponding BAM and VCF files (usually derived from 'get_mb_data.py'), delink an run data, and return a 
-        sample key file containing the original and new identifiers (for the temporary purpose of renaming tubes or 
-        whatever), and a new dataset with relevent identifiers removed from the file.  
-        ''',
+        corresponding BAM and VCF files (usually derived from 'get_mb_data.py'), delink an run data, and record the 
+        original and new identifiers in a persistent ID registry (also used to make sure new IDs are never reused, and 
+        that a sample delinked again gets the same ID), and a new dataset with relevent identifiers removed from the 
+        file.  Samples that are finished are 
+        recorded in '{}', and re-running the same command will pick up where an interrupted run left off.
+        '''.format(status_file),
         )
     parser.add_argument('sample_file', metavar='<msn_list.file>', 
             help='Flat file list of MSNs corresponding with the samples you wish to delink')
@@ -35,59 +46,123 @@ def get_args():
             help='Directories that contain the BAM and VCF files matching the sample list (e.g. PSN12345_MSN6789)')
     parser.add_argument('-p','--prefix', metavar='<string>', default='Sample',
             help='Prefix for new sample name that would preceed the randomized number string (DEFAULT: "%(default)s")')
+    parser.add_argument('-r','--registry', metavar='<registry.csv>', default=default_registry,
+            help='Registry of MSNs and the delinked IDs assigned to them (DEFAULT: %(default)s)')
+    parser.add_argument('-n','--num_procs', metavar='<INT>', type=int, default=1,
+            help='Number of samples to delink in parallel (DEFAULT: %(default)s)')
+    ocp_profile.add_args(parser)
     parser.add_argument('-v', '--version', action='version', version = '%(prog)s - ' + version) 
     args = parser.parse_args()
     return args
 
-def read_sample_list(sample_file,prefix):
-    '''Create a randomized sample name and a sampleKey.txt file for temporary renaming purposes'''
+class IdRegistry(object):
+    '''Persistent registry of the delinked IDs that have been handed out, indexed both ways (MSN => delinked ID in 
+       `ids`, and delinked ID => MSN in `msns`).  The registry is an append only CSV file that is locked while new IDs 
+       are assigned, so separate batches (even ones running at the same time) can never hand out the same ID, and a 
+       sample that has been delinked before always gets its old ID back.'''
+    def __init__(self, registry_file):
+        self.registry_file = registry_file
+        self.ids = {}
+        self.msns = {}
+        reg_dir = os.path.dirname(os.path.abspath(registry_file))
+        if not os.path.isdir(reg_dir):
+            os.makedirs(reg_dir)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.registry_file):
+            return
+        with open(self.registry_file) as fh:
+            self._read(fh)
+
+    def _read(self, fh):
+        for line in fh:
+            if not line.strip():
+                continue
+            msn, name = line.rstrip('\n').split(',')[:2]
+            self.ids[msn] = name
+            self.msns[name] = msn
+
+    def assign(self, samples, prefix):
+        '''Return a dict of MSN => delinked ID for the samples, reusing any IDs already in the registry and adding new
+           random ones for the rest.  The number of digits grows with the registry so that there is always plenty of 
+           room to pick from.'''
+        with open(self.registry_file, 'a+') as fh:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                # Pick up anything another batch added since we loaded.
+                fh.seek(0)
+                self._read(fh)
+
+                todo = [s for s in samples if s not in self.ids]
+                width = max(4, len(str(10 * (len(self.msns) + len(todo)))))
+                for sample in todo:
+                    name = gen_rand_name(prefix, width)
+                    while name in self.msns:
+                        name = gen_rand_name(prefix, width)
+                    self.ids[sample] = name
+                    self.msns[name] = sample
+                    fh.write('{},{}\n'.format(sample,name))
+                fh.flush()
+                os.fsync(fh.fileno())
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+        return {s : self.ids[s] for s in samples}
+
+def read_sample_list(sample_file,prefix,registry):
+    '''Get a delinked sample name for each MSN in the sample list from the ID registry.'''
     with open(sample_file) as fh:
-        samples = ['MSN'+i.rstrip('\n').lstrip('MSN') for i in fh] # make sure we have a MSN designator in string.
-        
-    rnd = gen_rand_name(len(samples))
-    name = [prefix +'-'+ str(x).zfill(4) for x in rnd]
-    new_names = dict(zip(samples,name))
+        samples = ['MSN'+i.rstrip('\n').lstrip('MSN') for i in fh if i.strip()] # make sure we have a MSN designator in string.
+    return registry.assign(samples, prefix)
 
-    with open('sampleKey.txt', 'w') as outfh:
-        for i in new_names:
-            outfh.write('{},{}\n'.format(i,new_names[i]))
-    return new_names 
+def gen_rand_name(prefix, width):
+    return prefix + '-' + str(random.randrange(10**width)).zfill(width)
 
-def gen_rand_name(num_elems):
-    return random.sample(range(0,9999),num_elems)
+def read_status():
+    '''Get the MSNs that have already been delinked from the status file'''
+    if not os.path.exists(status_file):
+        return {}
+    with open(status_file) as fh:
+        return dict(line.rstrip('\n').split(',')[:2] for line in fh if line.strip())
+
+def record_status(sample,delinked_id):
+    with open(status_file, 'a') as fh:
+        fh.write('{},{}\n'.format(sample,delinked_id))
+        fh.flush()
+        os.fsync(fh.fileno())
 
 def check_manifest(dirs,samples):
-    '''Based on the directories loaded and the sample list, make sure all match'''
-    orig_samples = samples.keys()
-    count = defaultdict(int)
+    '''Based on the directories loaded and the sample list, make sure all match.  Returns the samples to process, and 
+       an index of MSN to sample directory.'''
+    dir_index = {}
     skipped_dirs = []
     
     print('Validating manifest of samples and directories to process...',end='')
     for d in dirs:
-        msn = d.rstrip('/').split('_')[1]
-        if msn in orig_samples:
-            count[msn] += 1
+        try:
+            msn = d.rstrip('/').split('_')[1]
+        except IndexError:
+            msn = None
+        if msn in samples:
+            dir_index[msn] = d
         else:
             sys.stderr.write("WARN: {} does not have an entry in the original sample manifest file.  Skipping this dataset (NOTE: All skipped runs found in 'skipped_dirs' directory).\n".format(d))
             skipped_dirs.append(d)
-            del dirs[d]
 
     if skipped_dirs:
-        os.mkdir('skipped_expts')
+        if not os.path.exists('skipped_expts'):
+            os.mkdir('skipped_expts')
         for d in skipped_dirs:
             new_location = os.path.join('skipped_expts',d)
             shutil.move(d,new_location)
 
-    extra_samples = []
     for s in samples:
-        if not count[s]:
+        if s not in dir_index:
             sys.stderr.write("WARN: {} is in the sample list, but the data was not found! Removing this one from list and skipping.\n".format(s))
-            extra_samples.append(s)
 
-    if extra_samples:
-        samples = {s : samples[s] for s in samples if s not in extra_samples}
+    samples = {s : samples[s] for s in samples if s in dir_index}
     print('Done!')
-    return samples, dirs
+    return samples, dir_index
 
 def get_header(line):
     return line.split('=')[0]
@@ -97,115 +172,274 @@ def time():
     utc = str(datetime.datetime.utcnow())
     return now,utc.replace(' ', 'T')
 
-def cleanup(sample_id):
-    wd = os.getcwd()
-    all_files = os.listdir(wd)
-    for f in all_files:
-        if not f.startswith(sample_id):
-            os.remove(f)
+def cleanup(sample_dir, sample_id):
+    for f in os.listdir(sample_dir):
+        path = os.path.join(sample_dir, f)
+        if f.startswith(sample_id):
+            continue
+        if os.path.isdir(path) and f.startswith('.delink_'):
+            # Scratch dir left in the sample dir by an older version.
+            shutil.rmtree(path)
+        elif not os.path.isdir(path):
+            os.remove(path)
+
+def make_backup(d):
+    '''Back up the sample dir to `orig_data`.  The copy is made under a temp name and only renamed into place once it 
+       is complete, so a backup that is there is always a whole one.'''
+    backup = os.path.join('orig_data', d)
+    if os.path.exists(backup):
+        return backup
+    partial = os.path.join('orig_data', '.partial_' + d)
+    if os.path.exists(partial):
+        shutil.rmtree(partial)
+    shutil.copytree(d,partial,copy_function=link_or_copy,ignore=shutil.ignore_patterns('.delink_*'))
+    os.rename(partial,backup)
+    return backup
 
-def proc_vcf(vcf,delinked_id):
-    '''Read in VCF file and substitute the appropriate lines with new data to delink the specimen'''
+def proc_vcf(vcf,delinked_id,outdir):
+    '''Read in the VCF header and substitute the appropriate lines with new data to delink the specimen.  The body of 
+       the VCF is not changed, so it's copied over in large blocks rather than line by line.  Compressed (.vcf.gz) VCFs 
+       are streamed through and written back out bgzip compressed.'''
     now,utc = time()
-    sys.stdout.write('\tDelinking VCF file %s...' % vcf)
-    new_vcf = delinked_id + '.vcf'
-    out_fh = open(new_vcf, 'w')
-    
-    with open(vcf) as vcf_fh:
-        for line in vcf_fh:
-            if line.startswith('##fileDate'):
-                new_line = get_header(line) + '=' +  now + ' (delinked)'
-                out_fh.write("{}\n".format(new_line))
-            elif line.startswith('##fileUTCtime'):
-                new_line = get_header(line) +'='+ utc + ' (delinked)'
-                out_fh.write("{}\n".format(new_line))
-            elif line.startswith('#CHROM'):
-                elems = line.split()
-                elems[9] = delinked_id
-                out_fh.write('\t'.join(elems))
-                out_fh.write('\n')
+    sys.stdout.write('\tDelinking VCF file {}\n'.format(vcf))
+    if vcf.endswith('.gz'):
+        new_vcf = os.path.join(outdir, delinked_id + '.vcf.gz')
+        in_fh = gzip.open(vcf, 'rb')
+        out_fh = ocp_vcf.BgzfWriter(new_vcf)
+    else:
+        new_vcf = os.path.join(outdir, delinked_id + '.vcf')
+        in_fh = open(vcf, 'rb')
+        out_fh = open(new_vcf, 'wb')
+
+    header_len = 0
+    for line in in_fh:
+        if not line.startswith(b'#'):
+            break
+        header_len += len(line)
+        line = line.decode('utf-8')
+        if line.startswith('##fileDate'):
+            line = get_header(line) + '=' +  now + ' (delinked)\n'
+        elif line.startswith('##fileUTCtime'):
+            line = get_header(line) +'='+ utc + ' (delinked)\n'
+        elif line.startswith('#CHROM'):
+            elems = line.split()
+            elems[9] = delinked_id
+            line = '\t'.join(elems) + '\n'
+        out_fh.write(line.encode('utf-8'))
+
+    if vcf.endswith('.gz'):
+        in_fh.seek(header_len)
+        for block in iter(lambda: in_fh.read(1 << 20), b''):
+            out_fh.write(block)
+        out_fh.close()
+    else:
+        copy_range(in_fh, out_fh, header_len)
+        out_fh.close()
+    in_fh.close()
+
+def parse_bam_header(data):
+    '''Return the header text and the length of the whole BAM header (text plus reference list) from the start of 
+       the uncompressed BAM data, or None if we don't have all of it yet.'''
+    if len(data) < 8:
+        return None
+    if data[:4] != b'BAM\x01':
+        raise RuntimeError('not a BAM file')
+    l_text = struct.unpack_from('<i', data, 4)[0]
+    pos = 8 + l_text
+    if len(data) < pos + 4:
+        return None
+    n_ref = struct.unpack_from('<i', data, pos)[0]
+    pos += 4
+    for _ in range(n_ref):
+        if len(data) < pos + 4:
+            return None
+        pos += 4 + struct.unpack_from('<i', data, pos)[0] + 4
+    if len(data) < pos:
+        return None
+    return data[8:8+l_text], pos
+
+def copy_range(src, dst, offset):
+    '''Copy everything in `src` from `offset` on to the end of `dst`, in the kernel if we can.'''
+    count = os.fstat(src.fileno()).st_size - offset
+    dst.flush()
+    try:
+        while count > 0:
+            if hasattr(os, 'copy_file_range'):
+                sent = os.copy_file_range(src.fileno(), dst.fileno(), count, offset)
             else:
-                out_fh.write(line)
-    out_fh.close()
-    sys.stdout.write('Done!\n')
+                os.lseek(dst.fileno(), 0, os.SEEK_END)
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, count)
+            if sent == 0:
+                break
+            offset += sent
+            count -= sent
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+            raise
+    if count > 0:
+        src.seek(offset)
+        dst.seek(0, os.SEEK_END)
+        shutil.copyfileobj(src, dst, 1 << 20)
 
-def proc_bam(bam,orig_id,delinked_id):
-    '''Read BAM header in and edit appropriate information to delink specimen'''
+def proc_bam(bam,orig_id,delinked_id,outdir):
+    '''Edit the BAM header to delink specimen.  Only the BGZF blocks that hold the header are read and rewritten; the 
+       rest of the (compressed) BAM file is copied over as is, without decompressing the reads.  Like `samtools 
+       reheader`, this means that any old BAM index is no longer valid.'''
     if bam.endswith('rna.bam'):
-        new_bam = delinked_id + '_rna.bam'
+        new_bam = os.path.join(outdir, delinked_id + '_rna.bam')
     elif bam.endswith('dna.bam'):
-        new_bam = delinked_id + '_dna.bam'
+        new_bam = os.path.join(outdir, delinked_id + '_dna.bam')
 
     now,utc = time()
-    bam_fh = open(new_bam, 'w')
+    sys.stdout.write('\tDelinking and Reheadering BAM file: {}\n'.format(bam))
 
-    sys.stdout.write('\tDelinking and Reheadering BAM file: {}...'.format(bam))
-    sys.stdout.flush()
+    # Read blocks until we have the whole header.
+    reader = ocp_vcf.BgzfReader(bam)
+    data = b''
+    header = None
+    try:
+        while header is None:
+            block = reader.read_block()
+            if not block:
+                raise RuntimeError('truncated BAM header')
+            data += block
+            header = parse_bam_header(data)
+    except (RuntimeError, ValueError, zlib.error, struct.error) as err:
+        reader.close()
+        raise RuntimeError('Can not read BAM header for {}: {}'.format(bam,err))
+    text, header_len = header
+
+    new_text = []
+    for line in text.rstrip(b'\x00').decode('ascii').split('\n'):
+        line = line.replace(orig_id,delinked_id)
+        line = re.sub('DT:.*?\t','DT:%s\t' % utc,line)
+        line = re.sub('CL:.*?$','CL:<delinked>',line)
+        new_text.append(line)
+    new_text = '\n'.join(new_text).encode('ascii')
+
+    # Write the new header, along with any reads that were in the last header block, as fresh blocks and then tack on 
+    # the rest of the original file byte for byte.
+    writer = ocp_vcf.BgzfWriter(new_bam)
+    writer.write(b'BAM\x01' + struct.pack('<i', len(new_text)) + new_text)
+    writer.write(data[8+len(text):])
+    writer.flush()
+    copy_range(reader.fh, writer.fh, reader.next_block)
+    writer.fh.close()
+    reader.close()
+
+def link_or_copy(src, dst):
+    '''Back up a file as a hardlink, or a reflink on filesystems that support it, and only make a full copy if 
+       neither can be done.  The originals are never changed in place, only removed, so a link is a safe backup.'''
     try:
-        p = subprocess.check_output(['samtools', 'view', '-H', bam], stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as err:
-        print('ERROR: Can not read BAM header: {} ({})!'.format(err,err.returncode))
-    header = p.decode('ascii').split('\n')
-
-    # Create a temporary header that we can use to fix BAM.
-    with open('tmp.header', 'a') as out_fh:
-        for line in header:
-            line = line.replace(orig_id,delinked_id)
-            line = re.sub('DT:.*?\t','DT:%s\t' % utc,line)
-            line = re.sub('CL:.*?$','CL:<delinked>',line)
-            out_fh.write("%s\n" % line)
-
-    # Re-header the BAM file
+        os.link(src, dst)
+        return dst
+    except OSError:
+        pass
     try:
-        subprocess.run(['samtools', 'reheader', '-P', 'tmp.header', bam], stdout=bam_fh, check=True)
-        os.remove('tmp.header')
-    except subprocess.CalledProcessError as err:
-        sys.stderr.write("ERROR: failed to re-header the BAM file: {}!\n".format(err,err.returncode))
-        sys.exit(1)
-    sys.stdout.write('Done!\n')
+        with open(src, 'rb') as src_fh, open(dst, 'wb') as dst_fh:
+            fcntl.ioctl(dst_fh.fileno(), 0x40049409, src_fh.fileno()) # FICLONE
+        shutil.copystat(src, dst)
+        return dst
+    except (OSError, IOError):
+        pass
+    return shutil.copy2(src, dst)
 
-def delink_data(sample_list,dirs):
-    '''For each elem in the sample list dict, find appropriate dict, read in VCF file and change, read in BAM file 
-       change. Move all original data to a copies dir to make sure we have what we need before we finish'''
+def delink_sample(sample,delinked_id,d):
+    '''Delink the VCF and BAM files for one sample.  The new files are built in a scratch dir of their own under 
+       the batch work dir, and only moved into place (and the original data removed) once everything is done and 
+       backed up, so that an interrupted run can just be started over for this sample.'''
+    try:
+        # Create a place to store original data before we expunge it.
+        make_backup(d)
 
-    # Create a place to store original data before we expunge it.
-    if not os.path.exists('orig_data'):
-        os.mkdir('orig_data')
-    
-    count = 0
-    for sample in sample_list:
-        count += 1
-        print('  [{}/{}] Processing sample: {}'.format(count,len(sample_list),sample))
-        for d in dirs:
-            if d.endswith(sample):
-                if not os.path.exists('orig_data/' + d):
-                    sys.stdout.write('\tCopying {} to backup location...'.format(d))
-                    sys.stdout.flush()
-                    shutil.copytree(d,'orig_data/'+d)
-                    sys.stdout.write('Done!\n')
-
-                files = os.listdir(d)
-                os.chdir(d)
-                for f in files:
-                    if f.startswith(sample) and f.endswith('vcf'):
-                        proc_vcf(f,sample_list[sample])
-                    elif f.startswith(sample) and f.endswith('bam'):
-                        proc_bam(f,sample,sample_list[sample])
-                cleanup(sample_list[sample])
-                os.chdir(cwd)
-                os.rename(d,sample_list[sample])
-                print()
-                continue
+        scratch = os.path.join(work_dir, d)
+        if os.path.exists(scratch):
+            shutil.rmtree(scratch)
+        os.mkdir(scratch)
+        for f in os.listdir(d):
+            path = os.path.join(d, f)
+            if f.startswith(sample) and f.endswith(('vcf', 'vcf.gz')):
+                with ocp_profile.record('proc_vcf', path):
+                    proc_vcf(path,delinked_id,scratch)
+            elif f.startswith(sample) and f.endswith('bam'):
+                with ocp_profile.record('proc_bam', path):
+                    proc_bam(path,sample,delinked_id,scratch)
+
+        for f in os.listdir(scratch):
+            os.rename(os.path.join(scratch, f), os.path.join(d, f))
+        os.rmdir(scratch)
+        cleanup(d, delinked_id)
+        os.rename(d,delinked_id)
+    except Exception as err:
+        shutil.rmtree(os.path.join(work_dir, d), ignore_errors=True)
+        return sample, delinked_id, str(err)
+    return sample, delinked_id, None
+
+def arg_star(args):
+    with ocp_profile.record('delink_sample', args[0]):
+        return delink_sample(*args)
+
+def delink_data(sample_list,dir_index,num_procs=1):
+    '''For each elem in the sample list dict, look up the sample dir, read in VCF file and change, read in BAM file 
+       change. Move all original data to a copies dir to make sure we have what we need before we finish.  Samples 
+       are run in a pool of `num_procs` workers, and each one is recorded in the status file as it finishes.'''
+    for new_dir in ('orig_data', work_dir):
+        if not os.path.exists(new_dir):
+            os.mkdir(new_dir)
+
+    task_list = [(s, sample_list[s], dir_index[s]) for s in sorted(sample_list)]
+    if num_procs < 2:
+        results = map(arg_star, task_list)
+    else:
+        pool = multiprocessing.Pool(num_procs)
+        results = pool.imap_unordered(arg_star, task_list)
+
+    failed = []
+    for count, (sample, delinked_id, err) in enumerate(results, 1):
+        if err:
+            sys.stderr.write('ERROR: Could not delink sample {}: {}!\n'.format(sample,err))
+            failed.append(sample)
+            continue
+        record_status(sample, delinked_id)
+        print('  [{}/{}] Delinked sample: {} => {}'.format(count,len(task_list),sample,delinked_id))
+
+    if num_procs > 1:
+        pool.close()
+        pool.join()
+    if not os.listdir(work_dir):
+        os.rmdir(work_dir)
+    return failed
 
 if __name__=='__main__':
     args = get_args()
+    ocp_profile.start('match_delinker', args)
+
+    with ocp_profile.stage('read_sample_list'):
+        sample_list = read_sample_list(args.sample_file,args.prefix,IdRegistry(args.registry))
 
-    sample_list = read_sample_list(args.sample_file,args.prefix)
+    # Skip anything that we finished on an earlier run.  If a run stopped after the dir was renamed but before the
+    # sample was recorded, the delinked dir is there and the original is gone, so count it as done too.
+    completed = read_status()
+    for sample in sample_list:
+        if (sample not in completed and os.path.isdir(sample_list[sample]) 
+                and not any(d.rstrip('/').endswith(sample) for d in args.sample_dirs)):
+            record_status(sample, sample_list[sample])
+            completed[sample] = sample_list[sample]
+    if completed:
+        sys.stdout.write("Skipping {} sample(s) already delinked.\n".format(
+            len([s for s in sample_list if s in completed])))
+    sample_list = {s : sample_list[s] for s in sample_list if s not in completed}
 
-    dirs = [d.replace('/','') for d in args.sample_dirs]
-    final_samplelist,final_dirlist = check_manifest(dirs,sample_list)
+    dirs = [d.replace('/','') for d in args.sample_dirs if os.path.isdir(d)]
+    with ocp_profile.stage('check_manifest'):
+        final_samplelist,dir_index = check_manifest(dirs,sample_list)
 
     sys.stdout.write("Delinking {} files based on input list.\n".format(len(final_samplelist)))
     sys.stdout.flush()
-    delink_data(final_samplelist, final_dirlist)
+    with ocp_profile.stage('delink'):
+        failed = delink_data(final_samplelist, dir_index, args.num_procs)
+    if failed:
+        sys.stderr.write("{} sample(s) could not be delinked: {}. Re-run to try them again.\n".format(
+            len(failed), ', '.join(failed)))
+        sys.exit(1)
     sys.stdout.write("All MATCH data for manifest is now delinked. Original data stored in 'orig_data' dir and must be deleted manually\n")
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Python implementation of the NCI-MATCH MOI rules from `match_moi_report.pl`,
+# run on the records from `ocp_vcf` rather than on the helper script output.
+#
+# 10/17/2026
+################################################################################
+"""
+Run the NCI-MATCH MOI rules on an OCA VCF in-process and return the same rows
+that `match_moi_report.pl --Raw` would print. The SNV / Indel, CNV, and fusion
+rules mirror `match_moi_report.pl`, `ocp_cnv_report.pl`, and
+`ocp_fusion_report.pl` so that the Python tools can skip the Perl pipeline (and
+the half dozen reads of the VCF that go along with it) altogether.
+"""
+import re
+import sys
+import csv
+import argparse
+
+from pprint import pprint as pp # noqa
+
+import ocp_vcf
+import ocp_resources
+from moi_record import num_str
+
+version = '1.2.101726'
+
+# Default thresholds from `match_moi_report.pl`.
+defaults = {
+    'freq'     : 5,
+    'cn'       : None,
+    'cu'       : 4,
+    'cl'       : 1,
+    'reads'    : 100,
+    'blood'    : False,
+    'pedmatch' : False,
+    'nocall'   : False,
+}
+
+
+def load_blacklist(blacklist=ocp_resources.blacklist_file):
+    """
+    Return the SNV / Indel blacklist version string and the set of
+    `chr:pos:ref:alt` IDs. The list is only read once per process.
+    """
+    return ocp_resources.load_blacklist(blacklist)
+
+def parse_moi_args(arg_list):
+    """
+    Convert a `match_moi_report.pl` style option list (e.g. `['--cn', '7',
+    '-r', '1000', '-R']`) into keyword args for `moi_report()`, so that the
+    Python and Perl paths can be driven from the same params.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-f', '--freq', type=float)
+    parser.add_argument('-c', '--cn', type=int)
+    parser.add_argument('--cu', type=int)
+    parser.add_argument('--cl', type=int)
+    parser.add_argument('-r', '--reads', type=int)
+    parser.add_argument('-b', '--blood', action='store_true')
+    parser.add_argument('-p', '--ped_match', dest='pedmatch',
+        action='store_true')
+    parser.add_argument('-n', '--nocall', action='store_true')
+    parser.add_argument('-R', '--Raw', action='store_true')
+    parser.add_argument('-o', '--output')
+    opts = vars(parser.parse_args(arg_list))
+    return dict((k, opts[k]) for k in defaults if opts[k] is not None)
+
+def version_key(string):
+    """
+    Sort key that approximates `Sort::Versions::versioncmp`, so that the rows
+    come out in the same order as they do from the Perl script.
+    """
+    return [(0, int(x), '') if x.isdigit() else (1, 0, x)
+        for x in re.findall(r'\d+|[^\d\W]+', string)]
+
+def snv_rule(fields, freq, study):
+    """
+    Run the SNV / Indel MOI rules on a list of `vcfExtractor` fields, and
+    return the rule that the variant passes (if any). Like the Perl, the
+    function field is filled in with the location when it's missing.
+    """
+    vaf, gene, ocp_vc, hotspot_id = (float(fields[3]), fields[8], fields[14],
+        fields[7])
+    if fields[13] == '---':
+        function = fields[13] = fields[12]
+    else:
+        function = fields[13]
+
+    exon = fields[12][4:] if fields[12].startswith('Exon') else '-'
+
+    if vaf < freq:
+        return
+    if hotspot_id != '.' or ocp_vc == 'Hotspot':
+        return 'Hotspot Variant'
+    elif ocp_vc == 'Deleterious':
+        return 'Deleterious in TSG'
+    elif gene == 'EGFR':
+        if study == 'pediatric':
+            return
+        if exon == '19' and function == 'nonframeshiftDeletion':
+            return 'EGFR in-frame deletion in Exon 19'
+        elif exon == '20' and function == 'nonframeshiftInsertion':
+            return 'EGFR in-frame insertion in Exon 20'
+    elif (gene == 'ERBB2' and exon == '20'
+            and function == 'nonframeshiftInsertion'):
+        if study != 'pediatric':
+            return 'ERBB2 in-frame insertion in Exon 20'
+    elif (gene == 'KIT' and exon in ('9', '11', '13', '14')
+            and ('nonframeshift' in function or 'missense' in function)):
+        if study != 'pediatric':
+            return 'KIT in-frame indel in Exons 9, 11, 13, or 14'
+
+def proc_snv_indel(vcf_data, freq, study, blacklist):
+    results = {}
+    for snv in vcf_data.snvs:
+        # Same as `vcfExtractor.pl -N -n`: no NOCALLs and no ref calls.
+        if snv.filter == 'NOCALL' or snv.alt_cov == 0:
+            continue
+        fields = ocp_vcf.extractor_fields(snv)
+        varid = ':'.join(fields[:3])
+        if varid in blacklist:
+            continue
+        rule = snv_rule(fields, freq, study)
+        if rule:
+            results[varid] = fields + [rule]
+    return results
+
+def proc_cnv(vcf_data, cn, cu, cl, nocall):
+    results = {}
+    for cnv in vcf_data.cnvs:
+        if nocall and cnv.filter == 'NOCALL':
+            continue
+        # `ocp_cnv_report.pl` only reports hotspot CNVs by default.
+        if not cnv.hotspot or cnv.gene == '.':
+            continue
+
+        # The CIs are rounded in the CNV report, and thresholds are checked
+        # on the rounded values.
+        ci_05, ci_95 = ['{:.2f}'.format(x) for x in (cnv.ci_05, cnv.ci_95)]
+        if cu and cl:
+            if not (float(ci_05) >= cu or float(ci_95) <= cl):
+                continue
+        elif cn == 4:
+            if not float(ci_05) >= cn:
+                continue
+        elif not cnv.cn >= cn:
+            continue
+        results[cnv.gene] = [cnv.chrom, str(cnv.tiles), ci_05,
+            num_str(cnv.cn), ci_95]
+    return results
+
+def get_driver(pair):
+    drivers = ocp_resources.load_drivers()
+    gene1, _, gene2 = pair.partition('-')
+    if pair in ('MET-MET', 'EGFR-EGFR'):
+        return gene1, gene1
+    elif gene1 in drivers:
+        return gene1, gene2
+    elif gene2 in drivers:
+        return gene2, gene1
+    else:
+        return 'UNKNOWN', '{},{}'.format(gene1, gene2)
+
+def proc_fusion(vcf_data, reads, nocall):
+    results = {}
+    for fusion in vcf_data.fusions:
+        if nocall and fusion.filter in ('FAIL', 'NOCALL'):
+            continue
+        if fusion.read_count == 0:
+            continue
+        driver, partner = get_driver(fusion.pair)
+        results['|'.join((fusion.pair, fusion.junction, fusion.fusion_id))] = [
+            fusion.read_count, driver, partner]
+
+    # Fusion report has a floor of 25 reads before we ever see it.
+    return dict((k, v) for k, v in results.items()
+        if v[0] >= 25 and v[0] >= reads)
+
+def moi_report(vcf, freq=5, cn=None, cu=None, cl=None, reads=100, blood=False,
+        pedmatch=False, nocall=False, blacklist=None):
+    """
+    Generate the list of MOI rows for a VCF file (or an already loaded
+    `ocp_vcf.VcfData` object), in the same layout and order as the CSV output
+    of `match_moi_report.pl --Raw`.
+    """
+    if isinstance(vcf, ocp_vcf.VcfData):
+        vcf_data = vcf
+    else:
+        vcf_data = ocp_vcf.read_vcf(vcf)
+
+    if not vcf_data.header:
+        raise ValueError("The input file '%s' does not appear to be a valid "
+            "VCF file!" % vcf_data.path)
+    if not (vcf_data.fusion_header or blood):
+        raise ValueError("You have tried to load a VCF file without fusion "
+            "data and without selecting the DNA only option!")
+
+    # Raw CN cutoff disables the CI cutoffs like in MATCH prod.
+    if cn:
+        cu = cl = None
+    else:
+        cu = defaults['cu'] if cu is None else cu
+        cl = defaults['cl'] if cl is None else cl
+
+    if blacklist is None:
+        blacklist = load_blacklist()[1]
+    study = 'pediatric' if (pedmatch or blood) else 'adult'
+
+    rows = []
+    snvs = proc_snv_indel(vcf_data, freq, study, blacklist)
+    for var in sorted(snvs, key=version_key):
+        rows.append(['SNV'] + snvs[var])
+
+    cnvs = proc_cnv(vcf_data, cn, cu, cl, nocall)
+    for gene in sorted(cnvs, key=lambda g: version_key(cnvs[g][0])):
+        rows.append(['CNV', gene] + cnvs[gene] + [vcf_data.mapd])
+
+    if not blood:
+        fusions = proc_fusion(vcf_data, reads, nocall)
+        for var in sorted(fusions, key=version_key):
+            pair, junct, fid = var.split('|')
+            count, driver, partner = fusions[var]
+            rows.append(['Fusion', '{}.{}'.format(pair, junct), fid,
+                str(count), driver, partner])
+    return rows
+
+def commify(val):
+    integer, _, decimal = str(val).partition('.')
+    integer = '{:,}'.format(int(integer)) if integer.isdigit() else integer
+    return integer + '.' + decimal if decimal else integer
+
+def flag_str(val, over=None, under=None):
+    """Same as `format_string` in `match_moi_report.pl`, without the colors."""
+    flagged = ((over is not None and float(val) > over) 
+        or (under is not None and float(val) < under))
+    return '***{}***'.format(commify(val)) if flagged else commify(val)
+
+def get_pool_sums(vcf_data, panel):
+    """RNA pool sums from `match_rna_qc.pl -a`, via `get_metrics_from_vcf`."""
+    import get_metrics_from_vcf
+    if panel is None:
+        panel = get_metrics_from_vcf.load_panel(
+            get_metrics_from_vcf.default_panel)
+    if panel is None:
+        raise ValueError("Can not find the panel JSON file needed to get the "
+            "RNA pool reads for {}".format(vcf_data.path))
+    return get_metrics_from_vcf.get_rna_pool_info(vcf_data, panel)
+
+def format_report(vcf_data, rows, freq=5, cn=None, cu=None, cl=None, reads=100,
+        blood=False, pedmatch=False, panel=None, **kwargs):
+    """
+    Format MOI rows from `moi_report()` as the plain text report that 
+    `match_moi_report.pl` writes to its `--output` file.
+    """
+    if cn:
+        cu = cl = None
+    else:
+        cu = defaults['cu'] if cu is None else cu
+        cl = defaults['cl'] if cl is None else cl
+    study = 'Pediatric NCI-MATCH' if (pedmatch or blood) else 'Adult NCI-MATCH'
+    snvs = [r[1:] for r in rows if r[0] == 'SNV']
+    cnvs = [r[1:] for r in rows if r[0] == 'CNV']
+    fusions = [r[1:] for r in rows if r[0] == 'Fusion']
+    out = []
+
+    names = re.search(r'^(?:.*/)?(.*?)_v\d+_(.*?)_RNA_v\d+\.vcf', 
+        vcf_data.path)
+    out.append('-' * 150 + '\n')
+    out.append('{} MOI Report for {}\n'.format(study, 
+        '{} DNA / {} RNA'.format(*names.groups()) if names else vcf_data.path))
+    out.append('-' * 150 + '\n')
+
+    out.append('::: MATCH Reportable SNVs and Indels (VAF >= {}) :::\n'.format(
+        num_str(freq)))
+    if snvs:
+        widths = [max(max(len(s[i]) for s in snvs) + 2, minimum) 
+            for i, minimum in ((1, 5), (2, 5), (10, 5), (11, 9), (13, 10))]
+        snv_format = ' '.join(['%-16s', '%-{}s', '%-{}s', '%-7s', '%-7s', 
+            '%-7s', '%-7s', '%-12s', '%-8s', '%-16s', '%-{}s', '%-{}s', '%-8s', 
+            '%-{}s', '%-21s', '%s']).format(*widths) + '\n'
+        out.append(snv_format % ('Chrom:Pos', 'Ref', 'Alt', 'VAF', 'TotCov', 
+            'RefCov', 'AltCov', 'VARID', 'Gene', 'Transcript', 'CDS', 
+            'Protein', 'Exon', 'Function', 'oncomineVariantClass', 
+            'FunctionalRule'))
+        for snv in snvs:
+            out.append(snv_format % tuple(snv))
+    else:
+        out.append('\n\t>>>>  No Reportable SNVs or Indels Found in Sample  '
+            '<<<<\n')
+    out.append('\n')
+
+    cellularity = vcf_data.cellularity
+    out.append('::: MATCH Reportable CNVs (Gender: {}, Cellularity: {}, MAPD: '
+        '{}'.format(vcf_data.gender, 
+        '%d%%' % (float(cellularity) * 100) if cellularity else '', 
+        flag_str(vcf_data.mapd, over=0.5)))
+    if cu:
+        out.append(', 5% CI >= {}, 95% CI <= {}) :::\n'.format(cu, cl))
+    else:
+        out.append('{} {}) :::\n'.format(', 5% CI >=' if cn == 4 else ', CN >=',
+            cn))
+    if cnvs:
+        out.append('%-9s %-10s %-6s %-10s %-10s %-10s\n' % ('Chr', 'Gene', 
+            'Tiles', 'CI_05', 'CN', 'CI_95'))
+        for gene, chrom, tiles, ci_05, copies, ci_95, _ in cnvs:
+            out.append('%-9s %-10s %-6s %-10.2f %-10.2f %-10.2f\n' % (chrom, 
+                gene, tiles, float(ci_05), float(copies), float(ci_95)))
+    else:
+        out.append('\n\t>>>>  No Reportable CNVs Found in Sample  <<<<\n')
+    out.append('\n')
+
+    if blood:
+        return ''.join(out)
+
+    # OCAv3 reports pool level reads, and has a higher mapped reads threshold.
+    out.append('::: MATCH Reportable Fusions (Total Mapped Reads: ')
+    if version_key(vcf_data.ovat_version or '0') >= version_key('2.3'):
+        pool1, pool2 = get_pool_sums(vcf_data, panel)
+        out.append(flag_str(vcf_data.mapped_fusion_reads, under=500000))
+        out.append('; Pool1 Expression Reads: {}; Pool2 Expression Reads: '
+            '{}'.format(flag_str(pool1, under=100000), 
+            flag_str(pool2, under=100000)))
+    else:
+        out.append(flag_str(vcf_data.mapped_fusion_reads, under=100000))
+        out.append('; Expression Control Sum: {}'.format(flag_str(
+            vcf_data.expr_sum('ExprControl'), under=20000)))
+    out.append('; Threshold: {}) :::\n'.format(commify(reads)))
+
+    if fusions:
+        fusion_format = '%-{}s %-12s %-12s %-15s %-15s\n'.format(
+            max(len(f[0]) for f in fusions) + 4)
+        out.append(fusion_format % ('Fusion', 'ID', 'Read_Count', 
+            'Driver_Gene', 'Partner_Gene'))
+        for fusion in fusions:
+            out.append(fusion_format % tuple(fusion))
+    else:
+        out.append('\n\t>>>>  No Reportable Fusions found in Sample  <<<<\n')
+    return ''.join(out)
+
+def moi_text(vcf, panel=None, **params):
+    """
+    Read a VCF once, and return the plain text MOI report for it (see 
+    `format_report()`).
+    """
+    vcf_data = vcf if isinstance(vcf, ocp_vcf.VcfData) else ocp_vcf.read_vcf(vcf)
+    rows = moi_report(vcf_data, **params)
+    return format_report(vcf_data, rows, panel=panel, **params)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args:
+        sys.stderr.write('USAGE: match_moi.py [match_moi_report.pl options] '
+            '<VCF>\n')
+        sys.exit(1)
+    csv_writer = csv.writer(sys.stdout, lineterminator='\n')
+    for row in moi_report(args[-1], **parse_moi_args(args[:-1])):
+        csv_writer.writerow(row)
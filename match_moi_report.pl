@@ -11,6 +11,8 @@ use constant DEBUG => 0;
 
 use Getopt::Long qw( :config bundling auto_abbrev no_ignore_case );
 use File::Basename;
+use lib dirname($0);
+use OcpVcf;
 use Sort::Versions;
 use Term::ANSIColor;
 use Data::Dump;
@@ -132,12 +134,13 @@ if ( $outfile ) {
 my $study;
 ($ped_match or $blood) ? ($study = 'pediatric') : ($study = 'adult');
 
-# Create a blacklist lookup file for SNV and Indel parsing.
+# Create a blacklist lookup hash for SNV and Indel parsing (same list that
+# ocp_resources.py loads for the Python tools).
 my $blacklist_file = dirname($0) . '/resource/blacklist.txt';
 open(my $fh, "<", $blacklist_file);
 my $header = <$fh>;
 my $blist_ver = (split(/ /,$header))[1];
-my @blacklisted_variants = map{ chomp; $_ } <$fh>;
+my %blacklisted_variants = map { chomp; $_ => 1 } grep { /\S/ && !/^#/ } <$fh>;
 close $fh;
 
 if (DEBUG) {
@@ -173,7 +176,7 @@ my $current_version = version->parse('2.3');
 my $assay_version = version->parse( vcf_version_check(\$vcf_file) );
 print "[INFO]: OVAT version: $assay_version\n" if DEBUG;
 
-my $snv_indel_data          = proc_snv_indel(\$vcf_file, \@blacklisted_variants);
+my $snv_indel_data          = proc_snv_indel(\$vcf_file, \%blacklisted_variants);
 my $cnv_data                = proc_cnv(\$vcf_file);
 my $fusion_data             = proc_fusion(\$vcf_file) unless $blood;  
 
@@ -195,8 +198,14 @@ sub vcf_version_check {
     # Check the VCF version, as well as, determining if we loaded a DNA only 
     # file and asked for both DNA and RNA data.
     my $vcf = shift;
-    open(my $vcf_fh, "<", $$vcf);
-    my @header = grep{ /^#/ } <$vcf_fh>;
+    # Only need the header, so stop at the first record.
+    my $vcf_fh = open_vcf($$vcf);
+    my @header;
+    while (<$vcf_fh>) {
+        last unless /^#/;
+        push(@header, $_);
+    }
+    close_vcf($vcf_fh, $$vcf);
     die "ERROR: The input file '$$vcf' does not appear to be a valid VCF file!\n" unless @header;
     
     die "ERROR: You have tried to load a VCF file witout fusion data and without ",
@@ -211,7 +220,11 @@ sub proc_snv_indel {
     my ($vcf, $blacklisted_variants) = @_;
     my %results;
 
-    open(my $vcf_data, "-|", "vcfExtractor.pl -Nna $$vcf") 
+    # vcfExtractor only reads plain text, so stream compressed VCFs into it.
+    my $cmd = ($$vcf =~ /\.gz$/) 
+        ? "gzip -dc $$vcf | vcfExtractor.pl -Nna /dev/stdin"
+        : "vcfExtractor.pl -Nna $$vcf";
+    open(my $vcf_data, "-|", $cmd) 
         or die "ERROR: can't parse VCF";
 
     # Check to see if we're using the dev version VCF extractor and issue 
@@ -230,7 +243,7 @@ sub proc_snv_indel {
         next unless /^chr/;
         my @fields = split;
         my $id = join(':', @fields[0..2]);
-        next if grep {$id eq $_} @$blacklisted_variants;
+        next if exists $blacklisted_variants->{$id};
 
         # Map these variables to make typing easier and the code cleaner 
         # downstream
@@ -327,9 +340,13 @@ sub proc_fusion {
         };
     }
     # Get the total mapped RNA reads
-    open(my $fh, "<", $$vcf_file);
-    my ($mapped_reads) = map { /^##TotalMappedFusionPanelReads=(\d+)/ } <$fh>;
-    close $fh;
+    my $fh = open_vcf($$vcf_file);
+    my $mapped_reads;
+    while (<$fh>) {
+        last unless /^#/;
+        ($mapped_reads) = /^##TotalMappedFusionPanelReads=(\d+)/ and last;
+    }
+    close_vcf($fh, $$vcf_file);
     $results{'MAPPED_RNA'} = $mapped_reads;
     return \%results;
 }
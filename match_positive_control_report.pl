@@ -15,9 +15,12 @@ use Parallel::ForkManager;
 use Term::ANSIColor;
 use Sort::Versions;
 use JSON::XS;
+use Digest::SHA;
+use File::Path qw(make_path);
+use File::Temp qw(tempfile);
 
 my $scriptname = basename($0);
-my $version = "v2.0.041019";
+my $version = "v2.1.101726";
 my $description = <<"EOT";
 Generate a summary MATCH control report.  Need to input a list of VCF files and
 the version of the MATCH control used. Also, can output as a pretty printed 
@@ -30,6 +33,7 @@ my $outfile;
 my $lookup_table = 3;
 my $format = 'pp';
 my $sequencing_site;
+my $cache_dir;
 
 my $usage = <<"EOT";
 USAGE: $scriptname [options] <vcf_file(s)>
@@ -39,6 +43,9 @@ USAGE: $scriptname [options] <vcf_file(s)>
                     the file data.
     -f, --format    Method to format the report output (pp: pretty print, csv:
                     CSV file).  DEFAULT: '$format'.
+    -c, --cache     Directory of cached MOI results to reuse (and add to) 
+                    rather than re-running match_moi_report.pl on VCFs that 
+                    have not changed. Can be shared with collate_moi_reports.py.
     -o, --output    Send output to custom file.  Default is STDOUT.
     -v, --version   Version information
     -h, --help      Print this help information
@@ -48,6 +55,7 @@ GetOptions( "lookup|l=s"    => \$lookup_table,
             "format|f=s"    => \$format,
             "output|o=s"    => \$outfile,
             "site|s=s"      => \$sequencing_site,
+            "cache|c=s"     => \$cache_dir,
             "version|v"     => \$ver_info,
             "help|h"        => \$help )
         or die $usage;
@@ -87,6 +95,9 @@ if ($sequencing_site) {
 # Get the appropriate control lookup table.
 my $control_vars = get_lookup_table("v$lookup_table");
 
+# Blacklist these calls since they are artifact or not reliable.
+my $filtered_variants = get_filtered_variants("v$lookup_table");
+
 # Write output to either indicated file or STDOUT
 my $out_fh;
 if ( $outfile ) {
@@ -248,17 +259,25 @@ sub proc_vcf {
     my ($vcf, $name) = @_;
     my %results;
 
-    # Blacklist these calls since they are artifact or not reliable.
-    my @filtered_variants = qw( chr17:7579473:G:C:TP53 chr17:CDK12 chr17:RAD51C);
-
-    push(@filtered_variants, 'EML4-ALK.E6bA20') if $lookup_table =~ /[23]/; 
+    my %moi_params = (nocall => 1, reads => 1000, cn => 7);
     my $cmd = qq(match_moi_report.pl -n -R -r1000 -c7 $$vcf) ;
 
-    open( my $moi_report_pipe, '-|', $cmd);
-    while (<$moi_report_pipe>) {
-        chomp;
-        next if /NOTE/;
-        my @data = split(/,/);
+    my ($cache_file, $moi_rows);
+    if ($cache_dir) {
+        $cache_file = moi_cache_file($$vcf, \%moi_params);
+        $moi_rows = read_cache($cache_file);
+    }
+    unless ($moi_rows) {
+        open( my $moi_report_pipe, '-|', $cmd);
+        $moi_rows = [ map { chomp; [split(/,/, $_, -1)] } grep { /\S/ } 
+            <$moi_report_pipe> ];
+        close $moi_report_pipe;
+        write_cache($cache_file, $moi_rows) if $cache_file;
+    }
+
+    for my $row (@$moi_rows) {
+        next if grep { /NOTE/ } @$row;
+        my @data = @$row;
         my $varid; 
         if ($data[0] eq 'SNV') {
             $data[0] = 'SNV_Indel';
@@ -272,11 +291,60 @@ sub proc_vcf {
         elsif ($data[0] eq 'Fusion') {
             $varid = $data[1];
         }
-        $results{$varid} = [@data] unless grep { $varid eq $_ } @filtered_variants;
+        $results{$varid} = [@data] unless exists $filtered_variants->{$varid};
     }
     return \%results;
 }
 
+sub moi_cache_file {
+    # Same key as moi_cache.py: SHA-256 of the VCF contents, engine, the full 
+    # set of MOI thresholds (with the match_moi_report.pl defaults filled in), 
+    # and the blacklist version.
+    my ($vcf, $params) = @_;
+    my %full = (freq => 5, cn => '', cu => 4, cl => 1, reads => 100, blood => 0,
+        pedmatch => 0, nocall => 0, %$params);
+    @full{qw(cu cl)} = ('', '') if $full{cn};
+    my $param_string = join(';', map { 
+        "$_=" . (($full{$_} eq '') ? '' : sprintf('%g', $full{$_})) 
+    } sort keys %full);
+
+    open(my $blist_fh, '<', dirname($0) . '/resource/blacklist.txt');
+    my $header = <$blist_fh>;
+    close $blist_fh;
+    (my $blist_ver = (split(/ /, $header))[1]) =~ s/\s+$//;
+
+    my $vcf_digest = Digest::SHA->new(256)->addfile($vcf)->hexdigest;
+    my $key = Digest::SHA::sha256_hex(join("\t", $vcf_digest, 'perl', 
+            $param_string, $blist_ver));
+    return "$cache_dir/" . substr($key, 0, 2) . "/$key.json";
+}
+
+sub read_cache {
+    my $cache_file = shift;
+    return unless -e $cache_file;
+    my $json_text = do {
+        local $/;
+        open(my $fh, '<', $cache_file);
+        <$fh>;
+    };
+    my $rows = eval { JSON::XS->new->decode($json_text) };
+    utime(undef, undef, $cache_file) if $rows;
+    return $rows;
+}
+
+sub write_cache {
+    # Write to a temp file and rename so a concurrent reader never sees a 
+    # partial entry.
+    my ($cache_file, $rows) = @_;
+    my $entry_dir = dirname($cache_file);
+    make_path($entry_dir) unless -d $entry_dir;
+    my ($fh, $tmp) = tempfile(DIR => $entry_dir, SUFFIX => '.tmp');
+    print {$fh} JSON::XS->new->encode($rows);
+    close $fh;
+    rename($tmp, $cache_file);
+    return;
+}
+
 sub get_width {
     my $sample_names = shift;
     my $width = 0;
@@ -310,6 +378,19 @@ sub get_lookup_table {
     return $vars->{$lookup_table};
 }
 
+sub get_filtered_variants {
+    # Calls to leave out of the report for all controls, plus any for this
+    # lookup table. Same list that ocp_resources.py loads for the Python tools.
+    my $lookup_table = shift;
+    my $json_file = dirname($0) . "/resource/positive_control_filters.json";
+    die "ERROR: Can not find the control filters JSON file!\n" if (! -e $json_file);
+
+    my $filters = parse_json($json_file);
+    my %filtered = map { $_ => 1 } 
+        (@{$filters->{'all'} // []}, @{$filters->{$lookup_table} // []});
+    return \%filtered;
+}
+
 sub parse_json {
     my $json_file = shift;
     my $data = do {
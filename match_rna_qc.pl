@@ -11,6 +11,8 @@ use autodie;
 
 use Getopt::Long qw( :config bundling auto_abbrev no_ignore_case );
 use File::Basename;
+use lib dirname($0);
+use OcpVcf;
 use Data::Dump;
 use JSON;
 use List::Util qw(sum);
@@ -159,7 +161,7 @@ sub read_vcf {
     my ($vcf, $panel) = @_;
     my ($mapped_reads, $sample_name, %control_data, %summary_data);
 
-    open(my $vcf_fh, "<", $vcf);
+    my $vcf_fh = open_vcf($vcf);
     while (<$vcf_fh>) {
         $mapped_reads = $1 if (/^##TotalMappedFusionPanelReads=(\d+)/);
         if (/^#CHROM/) {
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# On-disk cache of parsed MOI reports so that re-running a collation on the
+# same set of VCFs does not re-run the MOI pipeline on every file.
+#
+# 10/17/2026
+################################################################################
+"""
+Content addressed cache for MOI report rows. Entries are keyed on the SHA-256
+of the VCF contents, the full set of MOI thresholds, the version of the SNV /
+Indel blacklist in `resource/blacklist.txt`, and the engine that generated the
+rows (`perl` for `match_moi_report.pl` or `native` for `match_moi`). Entries
+are JSON files stored under `<cache_dir>/<key[:2]>/<key>.json`, and the cache
+is trimmed back to a maximum size by removing the least recently used entries.
+
+The key is built the same way in `match_positive_control_report.pl` so that the
+Perl and Python tools can share a cache directory.
+"""
+import os
+import sys
+import json
+import hashlib
+import tempfile
+
+from pprint import pprint as pp # noqa
+
+import match_moi
+
+version = '1.0.101726'
+
+default_cache_size = 1024  # MB
+
+
+def file_sha256(path, blocksize=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def canonical_params(params):
+    """
+    Return the full set of MOI thresholds as a stable string from either a
+    `match_moi_report.pl` style option list or a dict of `moi_report()` kwargs.
+    Unset values are filled in from the `match_moi_report.pl` defaults, and a
+    raw CN cutoff clears the CI cutoffs just like it does in the report.
+    """
+    if isinstance(params, dict):
+        opts = params
+    else:
+        opts = match_moi.parse_moi_args(params)
+    full = dict(match_moi.defaults)
+    full.update(opts)
+    if full['cn']:
+        full['cu'] = full['cl'] = None
+
+    elems = []
+    for key in sorted(full):
+        val = full[key]
+        if isinstance(val, bool):
+            val = int(val)
+        elif val is None:
+            val = ''
+        else:
+            val = '%g' % val
+        elems.append('{}={}'.format(key, val))
+    return ';'.join(elems)
+
+def cache_key(vcf_digest, params, engine, blacklist_version):
+    key_string = '\t'.join((vcf_digest, engine, canonical_params(params),
+        blacklist_version))
+    return hashlib.sha256(key_string.encode('utf-8')).hexdigest()
+
+
+class MoiCache(object):
+    """
+    Get and put MOI report rows for a VCF. The blacklist version is read once
+    when the cache is created.
+    """
+    def __init__(self, cache_dir, max_size=default_cache_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size * 1024 * 1024
+        self.blacklist_version = match_moi.load_blacklist()[0]
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, vcf, params, engine):
+        return cache_key(file_sha256(vcf), params, engine,
+            self.blacklist_version)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        """Return the cached rows for `key`, or None on a miss."""
+        entry = self.path(key)
+        try:
+            with open(entry) as fh:
+                rows = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+        # Bump the mtime so that eviction is least recently used.
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        return rows
+
+    def put(self, key, rows):
+        """
+        Write out an entry atomically so that concurrent workers (or a
+        concurrent Perl run) never see a partial file.
+        """
+        entry = self.path(key)
+        entry_dir = os.path.dirname(entry)
+        if not os.path.isdir(entry_dir):
+            try:
+                os.makedirs(entry_dir)
+            except OSError:
+                pass
+        fd, tmp = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(rows, fh)
+        os.rename(tmp, entry)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is under the
+        maximum size. Returns the number of entries removed.
+        """
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if not f.endswith('.json'):
+                    continue
+                path = os.path.join(root, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+if __name__ == '__main__':
+    # Quick helper to trim a cache dir: moi_cache.py <cache_dir> [max_size_MB]
+    if len(sys.argv) < 2:
+        sys.stderr.write('USAGE: moi_cache.py <cache_dir> [max_size_MB]\n')
+        sys.exit(1)
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else default_cache_size
+    removed = MoiCache(sys.argv[1], size).evict()
+    sys.stdout.write('Removed %s cache entries.\n' % removed)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Columnar (Parquet or Arrow IPC) output of collated MOIs for cohort level
+# analysis in pandas, Arrow, Spark, etc.
+#
+# 10/17/2026
+################################################################################
+"""
+Write the MOI rows from `collate_moi_reports.py --columnar <file>` to a Parquet
+(`.parquet` / `.pq`) or Arrow IPC (`.arrow` / `.feather`) file with a typed
+schema: numeric VAF, copy number, coverage, and read counts, and dictionary
+encoded sample, type, gene, function, etc. columns. Rows are written out in
+row groups (Parquet) or record batches (Arrow) as samples complete rather than
+all at the end. Samples with no MOIs get one row with a null `type`.
+
+Needs the `pyarrow` package, which is only imported if this output is used.
+"""
+import os
+
+from pprint import pprint as pp # noqa
+
+from cohort_db import moi_cols, moi_values
+
+version = '1.1.101726'
+
+# Rows to hold before writing out a row group / record batch.
+default_batch_rows = 65536
+
+formats = {
+    '.parquet' : 'parquet',
+    '.pq' : 'parquet',
+    '.arrow' : 'arrow',
+    '.feather' : 'arrow',
+    '.ipc' : 'arrow',
+}
+
+# Low cardinality columns to dictionary encode, besides the sample columns.
+dict_cols = ('type', 'gene', 'exon', 'function', 'oncomine_class', 'rule',
+    'transcript', 'partner')
+int_cols = ('coverage', 'ref_cov', 'alt_cov', 'tiles', 'read_count')
+float_cols = ('vaf', 'ci05', 'copy_number', 'ci95')
+
+columns = ('sample', 'rna_sample', 'vcf') + moi_cols
+
+
+def get_format(path):
+    '''Output format from the file extension, or None if we don't know it.'''
+    return formats.get(os.path.splitext(path)[1].lower())
+
+def have_pyarrow():
+    try:
+        import pyarrow # noqa
+    except ImportError:
+        return False
+    return True
+
+
+class MoiColumnWriter(object):
+    '''
+    Add MOI rows a sample at a time with `add_sample()`, and `close()` to write
+    out the last batch.
+    '''
+    def __init__(self, path, batch_rows=default_batch_rows):
+        import pyarrow as pa
+        self.pa = pa
+        self.path = path
+        self.fmt = get_format(path)
+        self.batch_rows = batch_rows
+
+        fields = []
+        for col in columns:
+            if col in ('sample', 'rna_sample', 'vcf') or col in dict_cols:
+                fields.append(pa.field(col, pa.dictionary(pa.int32(),
+                    pa.string())))
+            elif col in int_cols:
+                fields.append(pa.field(col, pa.int32()))
+            elif col in float_cols:
+                fields.append(pa.field(col, pa.float64()))
+            else:
+                fields.append(pa.field(col, pa.string()))
+        self.schema = pa.schema(fields)
+
+        # Keep one dictionary per column for the whole file, so later batches
+        # only ever add to it.
+        self._dicts = dict((f.name, {}) for f in fields if
+            pa.types.is_dictionary(f.type))
+        self._cols = dict((c, []) for c in columns)
+        self._rows = 0
+
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema,
+                compression='zstd')
+        else:
+            import pyarrow.ipc as ipc
+            self.writer = ipc.new_file(path, self.schema,
+                options=ipc.IpcWriteOptions(compression='zstd',
+                emit_dictionary_deltas=True))
+
+    def add_sample(self, vcf, dna_sample, rna_sample, records):
+        records = ([moi_values(rec) for rec in records] or 
+            [[None] * len(moi_cols)])
+        name = os.path.basename(vcf)
+        for vals in records:
+            self._cols['sample'].append(dna_sample)
+            self._cols['rna_sample'].append(rna_sample)
+            self._cols['vcf'].append(name)
+            for col, val in zip(moi_cols, vals):
+                self._cols[col].append(val)
+        self._rows += len(records)
+        if self._rows >= self.batch_rows:
+            self.flush()
+
+    def _array(self, field):
+        pa = self.pa
+        values = self._cols[field.name]
+        if field.name not in self._dicts:
+            return pa.array(values, type=field.type)
+        lookup = self._dicts[field.name]
+        indices = []
+        for val in values:
+            if val is None:
+                indices.append(None)
+                continue
+            idx = lookup.get(val)
+            if idx is None:
+                idx = lookup[val] = len(lookup)
+            indices.append(idx)
+        return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()),
+            pa.array(list(lookup), pa.string()))
+
+    def flush(self):
+        if not self._rows:
+            return
+        batch = self.pa.RecordBatch.from_arrays(
+            [self._array(f) for f in self.schema], schema=self.schema)
+        if self.fmt == 'parquet':
+            self.writer.write_table(self.pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+        self._cols = dict((c, []) for c in columns)
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
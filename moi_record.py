@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Compact typed records for the SNV / Indel, CNV, and fusion MOIs, shared by
+# the tools that collate and annotate MOI reports.
+#
+# 10/17/2026
+################################################################################
+"""
+Typed records for the rows of a MOI report (`match_moi_report.pl --Raw` or
+`match_moi.moi_report()`). Each type of MOI is a small `__slots__` class, the
+numeric fields are parsed once when the record is made, and the repeated
+strings (genes, exons, functions, etc.) are interned so that a cohort of
+samples shares one copy of each. Missing values are stored as None rather
+than as '-' placeholders, and are only turned into text when formatted. Fields
+whose report text can't be rebuilt exactly from the number (the copy number,
+which is passed through from the VCF as is) keep the text they came with.
+
+    records = moi_record.from_rows(rows)
+    rec.vaf             # 16.67
+    rec.text('vaf')     # '16.67', formatted the same as in the report
+    rec.row()           # Back to the raw report row.
+
+The raw rows are still what goes over the wire (MOI cache, MOI server).
+Records from `match_amoi_reporter.py` also carry the aMOI `arms`, which go on
+the end of the row.
+"""
+import sys
+
+from pprint import pprint as pp # noqa
+
+version = '1.1.101726'
+
+missing = ('', '-', 'NA', 'None')
+
+
+def num_str(val):
+    """
+    Format a float the way Perl prints a number, without any trailing zeros
+    (e.g. 7.50 => '7.5', 7.0 => '7') and without cutting off decimals.
+    """
+    return '%.15g' % val
+
+def two_places(val):
+    return '{:.2f}'.format(val)
+
+def parse(val, func):
+    if val in missing:
+        return None
+    return func(val)
+
+def intern(val):
+    return sys.intern(val) if val is not None else None
+
+
+class MoiRecord(object):
+    """
+    Base class for the MOI records. Subclasses list their `fields` in report
+    row order, with the numeric ones in `numbers` (field => (parse function,
+    format function)), and the low cardinality ones to intern in `shared`.
+    Numeric fields in `keep_text` also keep their report text in a
+    `<field>_text` slot, which is used in place of the format function.
+    """
+    __slots__ = ('arms',)
+    type = None
+    fields = ()
+    numbers = {}
+    shared = ()
+    keep_text = ()
+
+    def __init__(self, row):
+        for name, val in zip(self.fields, row[1:]):
+            if name in self.keep_text:
+                setattr(self, name + '_text', intern(val))
+            if name in self.numbers:
+                val = parse(val, self.numbers[name][0])
+            elif name in self.shared:
+                val = intern(val)
+            setattr(self, name, val)
+        extra = row[len(self.fields)+1:]
+        self.arms = extra[0] if extra else None
+
+    def text(self, name):
+        """A field as it appears in the report, or '-' if it's missing."""
+        val = getattr(self, name)
+        if val is None:
+            return '-'
+        if name in self.keep_text:
+            return getattr(self, name + '_text')
+        if name in self.numbers:
+            return self.numbers[name][1](val)
+        return val
+
+    def row(self):
+        """The raw report row, with the aMOI arms on the end if we have them."""
+        row = [self.type] + [self.text(name) for name in self.fields]
+        if self.arms is not None:
+            row.append(self.arms)
+        return row
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.row() == other.row()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.row())
+
+    def __getstate__(self):
+        return [getattr(self, name) for name in self.__slots__ + ('arms',)]
+
+    def __setstate__(self, state):
+        for name, val in zip(self.__slots__ + ('arms',), state):
+            if name in self.shared or name[:-5] in self.keep_text:
+                val = intern(val)
+            setattr(self, name, val)
+
+
+class SnvRecord(MoiRecord):
+    __slots__ = ('position', 'ref', 'alt', 'vaf', 'coverage', 'ref_cov',
+        'alt_cov', 'varid', 'gene', 'transcript', 'cds', 'aa', 'exon',
+        'function', 'oncomine_class', 'rule')
+    type = 'SNV'
+    fields = __slots__
+    numbers = {
+        'vaf' : (float, two_places),
+        'coverage' : (int, str),
+        'ref_cov' : (int, str),
+        'alt_cov' : (int, str),
+    }
+    shared = ('gene', 'transcript', 'exon', 'function', 'oncomine_class',
+        'rule')
+
+
+class CnvRecord(MoiRecord):
+    __slots__ = ('gene', 'chrom', 'tiles', 'ci05', 'copy_number', 'ci95',
+        'mapd', 'copy_number_text')
+    type = 'CNV'
+    fields = __slots__[:-1]
+    numbers = {
+        'tiles' : (int, str),
+        'ci05' : (float, two_places),
+        'copy_number' : (float, num_str),
+        'ci95' : (float, two_places),
+    }
+    # MAPD is copied as is from the VCF header, and is the same for every CNV
+    # in a sample.
+    shared = ('gene', 'chrom', 'mapd')
+    keep_text = ('copy_number',)
+
+
+class FusionRecord(MoiRecord):
+    __slots__ = ('fusion', 'varid', 'read_count', 'gene', 'partner')
+    type = 'Fusion'
+    fields = __slots__
+    numbers = {
+        'read_count' : (int, str),
+    }
+    shared = ('fusion', 'varid', 'gene', 'partner')
+
+
+record_types = dict((cls.type, cls) for cls in (SnvRecord, CnvRecord,
+    FusionRecord))
+
+def from_row(row):
+    """Make a record from a raw report row."""
+    try:
+        return record_types[row[0]](row)
+    except KeyError:
+        raise ValueError('Unknown MOI type in row: {}'.format(row))
+
+def from_rows(rows):
+    return [from_row(row) for row in rows]
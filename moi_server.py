@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Long running local MOI report service, so that the tools in this package
+# don't have to pay for interpreter and process startup on every VCF.
+#
+# 10/17/2026
+################################################################################
+"""
+Local MOI report server. Runs the NCI-MATCH MOI rules (`match_moi`), the VCF QC
+metrics (`get_metrics_from_vcf`), and the aMOI mapping (`match_amoi_reporter`)
+for any number of clients over a Unix socket, with the blacklist, fusion driver
+list, positive control tables, panel JSON, and aMOI lookup index loaded once
+for the life of the server rather than once per VCF. The VCFs themselves are
+processed in a pool of worker processes.
+
+    moi_server.py start -d      # Start a server in the background.
+    moi_server.py status        # Check that it's up.
+    moi_server.py stop          # Shut it down.
+
+Tools use the server when run with `-S/--moi_server` (`collate_moi_reports.py`,
+`match_amoi_reporter.py`, `get_metrics_from_vcf.py`, and `variant_review.py`).
+
+Requests and responses are one line of JSON each. A request is a dict with a
+`cmd` and its args, and a failed request gets back a dict with an `error`:
+
+    moi_report      {vcf, params}           => {sample, rows}
+    moi_text        {vcf, params, panel}    => {text}
+    metrics         {vcf, dna_only, panel}  => {sample, data}
+    amoi            {vcf, status, outside}  => {sample, rows}
+    control_targets {table}                 => {targets, filters}
+    ping / shutdown
+
+The `params` are `match_moi_report.pl` style options (e.g. `['--cn', '7']`),
+and VCF and panel paths must be absolute since the server has its own working
+directory.
+"""
+import os
+import sys
+import json
+import time
+import errno
+import signal
+import socket
+import argparse
+import threading
+import socketserver
+import multiprocessing
+
+from pprint import pprint as pp # noqa
+
+import ocp_vcf
+import match_moi
+import moi_record
+import ocp_resources
+
+version = '1.0.101726'
+
+default_socket = os.path.join(os.path.expanduser('~'), '.ocp_tools',
+    'moi_server.sock')
+
+# Same MOI params that `match_amoi_reporter.py` runs with.
+amoi_params = ['--cn', '7', '--reads', '1000', '--Raw']
+
+# How often to write new aMOI index entries back to disk.
+index_save_interval = 60
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description = __doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'action',
+        choices=('start', 'stop', 'status'),
+        help='Start a server, or stop or check on a running one.'
+    )
+    parser.add_argument(
+        '-s', '--socket',
+        metavar='<socket>',
+        default=default_socket,
+        help='Unix socket to listen on (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '-n', '--num_procs',
+        metavar='<INT>',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='Number of worker processes to run VCFs on (DEFAULT: %(default)s)'
+    )
+    parser.add_argument(
+        '-i', '--index',
+        metavar='<index.json>',
+        help='aMOI lookup index file to use (DEFAULT: the '
+            '`match_amoi_reporter.py` default)'
+    )
+    parser.add_argument(
+        '-d', '--daemon',
+        action='store_true',
+        help='Run the server in the background.'
+    )
+    parser.add_argument(
+        '-l', '--log',
+        metavar='<logfile>',
+        help='Log file for a background server (DEFAULT: <socket>.log)'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version = '%(prog)s - ' + version
+    )
+    return parser.parse_args()
+
+def add_args(parser):
+    """Add the option for using a MOI server to a tool's argparse parser."""
+    parser.add_argument(
+        '-S', '--moi_server',
+        metavar='<socket>',
+        nargs='?',
+        const=default_socket,
+        help='Send the VCFs to a running `moi_server.py` rather than '
+            'processing them here. Uses the default socket ({}) if none is '
+            'given.'.format(default_socket)
+    )
+
+
+class MoiServerError(Exception):
+    pass
+
+
+class MoiClient(object):
+    """
+    Client for a `moi_server.py` server. Each request is made on a connection
+    of its own, so one client can be shared by worker threads.
+    """
+    def __init__(self, socket_path=default_socket, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, cmd, **kwargs):
+        kwargs['cmd'] = cmd
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(kwargs).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as fh:
+                line = fh.readline()
+        finally:
+            sock.close()
+        if not line:
+            raise MoiServerError('No response from the MOI server.')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise MoiServerError(response['error'])
+        return response
+
+    def ping(self):
+        return self.request('ping')
+
+    def moi_report(self, vcf, params):
+        resp = self.request('moi_report', vcf=os.path.abspath(vcf),
+            params=list(params))
+        return resp['sample'], resp['rows']
+
+    def moi_text(self, vcf, params, panel=None):
+        return self.request('moi_text', vcf=os.path.abspath(vcf),
+            params=list(params), panel=panel and os.path.abspath(panel))['text']
+
+    def metrics(self, vcf, dna_only=False, panel=None):
+        resp = self.request('metrics', vcf=os.path.abspath(vcf),
+            dna_only=dna_only, panel=panel and os.path.abspath(panel))
+        return resp['sample'], resp['data']
+
+    def amoi(self, vcf, status, outside):
+        resp = self.request('amoi', vcf=os.path.abspath(vcf), status=status,
+            outside=outside)
+        return resp['sample'], resp['rows']
+
+    def control_targets(self, table):
+        resp = self.request('control_targets', table=table)
+        return resp['targets'], set(resp['filters'])
+
+    def shutdown(self):
+        return self.request('shutdown')
+
+def connect(socket_path=default_socket):
+    """
+    Return a client for the server on `socket_path`, or bail out if there's
+    no server running there.
+    """
+    client = MoiClient(socket_path)
+    try:
+        client.ping()
+    except (socket.error, MoiServerError, ValueError) as e:
+        sys.stderr.write('ERROR: Can not reach a MOI server on {}: {}. Start '
+            'one with `moi_server.py start -d -s {}`.\n'.format(socket_path, e,
+            socket_path))
+        sys.exit(1)
+    return client
+
+
+# Jobs run in the worker processes. Panels are cached per worker.
+_panels = {}
+
+def load_panel(panel_file):
+    if panel_file is None:
+        import get_metrics_from_vcf
+        panel_file = get_metrics_from_vcf.default_panel
+    try:
+        mtime = os.path.getmtime(panel_file)
+    except OSError:
+        return None
+    if _panels.get(panel_file, (None,))[0] != mtime:
+        with open(panel_file) as fh:
+            _panels[panel_file] = (mtime, json.load(fh))
+    return _panels[panel_file][1]
+
+def job_moi_report(vcf, params):
+    vcf_data = ocp_vcf.read_vcf(vcf)
+    return vcf_data.sample, match_moi.moi_report(vcf_data,
+        **match_moi.parse_moi_args(params))
+
+def job_moi_text(vcf, params, panel_file):
+    return match_moi.moi_text(vcf, panel=load_panel(panel_file),
+        **match_moi.parse_moi_args(params))
+
+def job_metrics(vcf, dna_only, panel_file):
+    import get_metrics_from_vcf as gm
+    panel = None if dna_only else load_panel(panel_file)
+    return gm.read_vcf(vcf, gm.mapd_threshold, gm.rna_reads, gm.pool_reads,
+        gm.expr_sum, panel, dna_only)
+
+def warm_up():
+    """Load everything that we can up front, before the workers are forked."""
+    ocp_resources.load_blacklist()
+    ocp_resources.load_drivers()
+    for table in ocp_resources.control_tables():
+        ocp_resources.load_control_targets(table)
+        ocp_resources.load_control_filters(table)
+    load_panel(None)
+
+
+class MoiRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.dispatch(json.loads(line.decode(
+                    'utf-8')))
+            except Exception as e:
+                response = {'error' : '{}: {}'.format(type(e).__name__, e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class MoiServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, num_procs, index_file=None):
+        warm_up()
+        self.pool = multiprocessing.Pool(num_procs)
+        self.num_procs = num_procs
+        self.index_file = index_file
+        self.amoi_index = None
+        self.index_lock = threading.Lock()
+        self.last_save = time.time()
+        self.started = time.time()
+        self.requests = 0
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+            MoiRequestHandler)
+        os.chmod(socket_path, 0o600)
+
+    def get_amoi_index(self):
+        if self.amoi_index is None:
+            import match_amoi_reporter
+            self.amoi_index = match_amoi_reporter.AmoiIndex(self.index_file or
+                match_amoi_reporter.default_index)
+        return self.amoi_index
+
+    def map_amoi(self, rows, status, outside):
+        import match_amoi_reporter
+        with self.index_lock:
+            records = match_amoi_reporter.build_variant_dict(
+                moi_record.from_rows(rows), status, outside,
+                self.get_amoi_index())
+            if time.time() - self.last_save > index_save_interval:
+                self.amoi_index.save()
+                self.last_save = time.time()
+        return [rec.row() for rec in records]
+
+    def dispatch(self, req):
+        self.requests += 1
+        cmd = req.get('cmd')
+        if cmd == 'ping':
+            return {'version' : version, 'pid' : os.getpid(), 'workers' :
+                self.num_procs, 'requests' : self.requests, 'uptime' :
+                round(time.time() - self.started, 1)}
+        elif cmd == 'moi_report':
+            sample, rows = self.pool.apply(job_moi_report, (req['vcf'],
+                req.get('params', [])))
+            return {'sample' : sample, 'rows' : rows}
+        elif cmd == 'moi_text':
+            return {'text' : self.pool.apply(job_moi_text, (req['vcf'],
+                req.get('params', []), req.get('panel')))}
+        elif cmd == 'metrics':
+            sample, data = self.pool.apply(job_metrics, (req['vcf'],
+                req.get('dna_only', False), req.get('panel')))
+            return {'sample' : sample, 'data' : data}
+        elif cmd == 'amoi':
+            sample, rows = self.pool.apply(job_moi_report, (req['vcf'],
+                amoi_params))
+            return {'sample' : sample, 'rows' : self.map_amoi(rows,
+                req.get('status', 'OPEN'), req.get('outside', True))}
+        elif cmd == 'control_targets':
+            return {
+                'targets' : ocp_resources.load_control_targets(req['table']),
+                'filters' : sorted(ocp_resources.load_control_filters(
+                    req['table'])),
+            }
+        elif cmd == 'shutdown':
+            threading.Thread(target=self.shutdown).start()
+            return {'status' : 'stopping'}
+        raise ValueError("Unknown request '{}'".format(cmd))
+
+    def close(self):
+        if self.amoi_index is not None:
+            self.amoi_index.save()
+        self.pool.terminate()
+        self.pool.join()
+        self.server_close()
+
+
+def check_socket(socket_path):
+    """
+    Return True if there is a server on `socket_path`, removing the socket if
+    it was left behind by a server that is gone.
+    """
+    if not os.path.exists(socket_path):
+        return False
+    try:
+        MoiClient(socket_path, timeout=5).ping()
+        return True
+    except (socket.error, MoiServerError, ValueError):
+        os.remove(socket_path)
+        return False
+
+def daemonize(log_file):
+    if os.fork():
+        return False
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(os.devnull) as null:
+        os.dup2(null.fileno(), sys.stdin.fileno())
+    with open(log_file, 'a') as log:
+        os.dup2(log.fileno(), sys.stdout.fileno())
+        os.dup2(log.fileno(), sys.stderr.fileno())
+    return True
+
+def wait_for_server(socket_path, timeout=60):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            return MoiClient(socket_path, timeout=5).ping()
+        except (socket.error, MoiServerError, ValueError):
+            time.sleep(0.1)
+    return None
+
+def start(args):
+    socket_dir = os.path.dirname(os.path.abspath(args.socket))
+    try:
+        os.makedirs(socket_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if check_socket(args.socket):
+        sys.stderr.write('ERROR: There is already a MOI server running on '
+            '{}.\n'.format(args.socket))
+        sys.exit(1)
+
+    if args.daemon:
+        log_file = args.log or args.socket + '.log'
+        if not daemonize(log_file):
+            info = wait_for_server(args.socket)
+            if not info:
+                sys.stderr.write('ERROR: MOI server did not start. See {} for '
+                    'details.\n'.format(log_file))
+                sys.exit(1)
+            sys.stdout.write('MOI server (pid {}) running on {}.\n'.format(
+                info['pid'], args.socket))
+            return
+
+    server = MoiServer(args.socket, args.num_procs, args.index)
+    # Shut down cleanly on a plain `kill` too.
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(
+        target=server.shutdown).start())
+    sys.stdout.write('MOI server v{} (pid {}) listening on {} with {} '
+        'workers.\n'.format(version, os.getpid(), args.socket, args.num_procs))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        sys.stdout.write('MOI server stopped after {} requests.\n'.format(
+            server.requests))
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.action == 'start':
+        start(args)
+    elif args.action == 'status':
+        if not check_socket(args.socket):
+            sys.stdout.write('No MOI server running on {}.\n'.format(
+                args.socket))
+            sys.exit(1)
+        info = MoiClient(args.socket).ping()
+        sys.stdout.write('MOI server v{version} (pid {pid}) up for {uptime}s '
+            'with {workers} workers; {requests} requests served.\n'.format(
+            **info))
+    elif args.action == 'stop':
+        if not check_socket(args.socket):
+            sys.stdout.write('No MOI server running on {}.\n'.format(
+                args.socket))
+            sys.exit(1)
+        MoiClient(args.socket).shutdown()
+        sys.stdout.write('Stopping MOI server on {}.\n'.format(args.socket))
@@ -8,6 +8,8 @@ use autodie;
 
 use Getopt::Long qw( :config bundling auto_abbrev no_ignore_case );
 use File::Basename;
+use lib dirname($0);
+use OcpVcf;
 use Sort::Versions;
 use JSON -support_by_pp;
 use Parallel::ForkManager;
@@ -348,7 +350,7 @@ sub proc_vcf {
     my ($sample_id, $gender, $mapd, $cellularity, $sample_name);
     my %results;
 
-    open( my $vcf_fh, "<", $$vcf);
+    my $vcf_fh = open_vcf($$vcf);
     while (<$vcf_fh>) {
         if ( /^##/ ) {
             if ( $_ =~ /sampleGender=(\w+)/ ) {
@@ -6,6 +6,8 @@ use autodie;
 
 use Getopt::Long qw( :config bundling auto_abbrev no_ignore_case );
 use File::Basename;
+use lib dirname($0);
+use OcpVcf;
 use Data::Dump;
 use Term::ANSIColor;
 
@@ -88,8 +90,8 @@ for my $input_file ( @files ) {
         push(@used_controls, $control) unless grep {$_ eq $control} @used_controls;
     }
     
-    (my $name = basename($input_file)) =~ s/\.vcf//;
-    open( my $in_fh, "<", $input_file ) || die "Can't open the file '$input_file' for reading: $!";
+    (my $name = basename($input_file)) =~ s/\.vcf(?:\.gz)?//;
+    my $in_fh = open_vcf($input_file);
     my %parsed_data;
     my ($sum, $pool1_sum, $pool2_sum) = 0;
     my $sample;
@@ -195,9 +197,9 @@ sub select_expr_controls {
     );
     return @{$expr_controls{$version}} if $version;
 
-    open(my $fh, "<", $$vcf);
+    my $fh = open_vcf($$vcf);
     my ($ovat_version) = map { /^##OncomineVariantAnnotationToolVersion=\d\.(\d)\.\d+$/ } <$fh>;
-    close $fh;
+    close_vcf($fh, $$vcf);
     $ovat_version = 1 if $ovat_version eq 0;
     $match_version = $ovat_version;
     return @{$expr_controls{$ovat_version}};
@@ -12,12 +12,14 @@ use autodie;
 
 use Getopt::Long qw( :config bundling auto_abbrev no_ignore_case );
 use File::Basename;
+use lib dirname($0);
+use OcpVcf;
 use Parallel::ForkManager;
 use Data::Dump;
 use Sort::Versions;
 
 my $scriptname = basename($0);
-my $version = "v4.1.053119";
+my $version = "v4.2.101726";
 my $description = <<"EOT";
 Print out a summary table of fusions detected by the OCP Fusion Workflow VCF 
 files. Can choose to output anything seen, or just limit to annotated fusions.
@@ -101,6 +103,10 @@ my @genes_list = map{uc($_)} split(/,/, $gene) if $gene;
 my %results;
 my $fwidth=0;
 
+# Driver gene lookup; same list that ocp_resources.py loads for the Python 
+# tools.
+my $drivers = read_drivers();
+
 my $pm = Parallel::ForkManager->new($num_procs);
 $pm->run_on_finish(
     sub {
@@ -115,7 +121,7 @@ $pm->run_on_finish(
 
 for my $input_file ( @files ) {
     $pm->start and next;
-    my ($return_data, $sample_id) = proc_vcf(\$input_file);
+    my ($return_data, $sample_id) = proc_vcf(\$input_file, $drivers);
     $pm->finish(0,
         {
             result => $return_data,
@@ -154,22 +160,14 @@ for my $sample ( sort keys %results ) {
 }
 
 sub proc_vcf {
-    my $vcf = shift;
-    # Version 1,2, and 3 drivers. Not all exist in the current version, but 
-    # keep all for backward compatibility.
-    my @drivers = qw(ABL1 AKT2 AKT3 ALK AR AXL BRAF BRCA1 BRCA2 CDKN2A EGFR 
-        ERBB2 ERBB4 ERG ESR1 ETV1 ETV1a ETV1b ETV4 ETV4a ETV5 ETV5a ETV5d FGFR1
-        FGFR2 FGFR3 FGR FLT3 JAK2 KRAS MDM4 MET MYB MYBL1 NF1 NOTCH1 NOTCH4 NRG1
-        NTRK1 NTRK2 NTRK3 NUTM1 PDGFRA PDGFRB PIK3CA PPARG PRKACA PRKACB PTEN 
-        RAD51B RAF1 RB1 RELA RET ROS1 RSPO2 RSPO3 TERT
-    );
+    my ($vcf, $drivers) = @_;
 
     my %results;
 
-    (my $sample_name = $$vcf) =~ s/(:?_Fusion_filtered)?\.vcf$//i;
+    (my $sample_name = $$vcf) =~ s/(:?_Fusion_filtered)?\.vcf(?:\.gz)?$//i;
     $sample_name =~ s/_RNA//;
 
-    open( my $in_fh, "<", $$vcf );
+    my $in_fh = open_vcf($$vcf);
     while (<$in_fh>) {
         next if /^#/;
         my @data = split;
@@ -195,11 +193,11 @@ sub proc_vcf {
             if ( $pair eq 'MET-MET' || $pair eq 'EGFR-EGFR' ) {
                 $results{$fid}->{'DRIVER'} = $results{$fid}->{'PARTNER'} = $gene1;
             }
-            elsif (grep {$_ eq $gene1} @drivers) {
+            elsif (exists $drivers->{$gene1}) {
                 $results{$fid}->{'DRIVER'} = $gene1;
                 $results{$fid}->{'PARTNER'} = $gene2;
             }
-            elsif (grep {$_ eq $gene2} @drivers) {
+            elsif (exists $drivers->{$gene2}) {
                 $results{$fid}->{'DRIVER'} = $gene2;
                 $results{$fid}->{'PARTNER'} = $gene1;
             }
@@ -216,6 +214,16 @@ sub proc_vcf {
     return \%results, \$sample_name;
 }
 
+sub read_drivers {
+    # Version 1,2, and 3 drivers. Not all exist in the current version, but 
+    # keep all for backward compatibility.
+    my $drivers_file = dirname($0) . '/resource/fusion_drivers.txt';
+    open(my $fh, '<', $drivers_file);
+    my %drivers = map { chomp; $_ => 1 } grep { /\S/ && !/^#/ } <$fh>;
+    close $fh;
+    return \%drivers;
+}
+
 sub print_data {
     my ($sample_name,$fusion_name,$id,$data,$format) = @_;
 
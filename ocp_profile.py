@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Timing and profiling hooks shared by the Python tools in this package, so
+# that a slow run can be broken down without having to edit the scripts.
+#
+# 10/17/2026
+################################################################################
+"""
+Per-stage and per-file timing for the tools in this package. Tools add the
+`--profile` / `--cprofile` options with `add_args()`, call `start()` once the
+args are parsed, and then wrap their work in `stage()` (a step of the run in the
+main process, like reading the VCFs or writing the output) and `record()` (one
+unit of work, like the MOI report for one VCF, which may run in a worker thread
+or process). When profiling is not turned on, both are no-ops.
+
+At exit a JSON trace is written with:
+
+    - the time from process start to `start()` (interpreter startup, imports,
+      and arg parsing).
+    - the wall, CPU, and child process CPU time, and the number of
+      subprocesses started, for each stage. These are process wide, so stages
+      that overlap (e.g. in different threads) share them.
+    - the wall time, CPU time of the thread that did the work, and number of
+      subprocesses started for each file, along with a per-stage summary
+      including the slowest file.
+    - the number of subprocesses started by command (`match_moi_report.pl`,
+      `samtools`, etc), and the CPU time each command used.
+
+Only processes started directly from Python are counted. Anything those start
+in turn (e.g. `vcfExtractor.pl` and `match_rna_qc.pl`, which are run by the
+Perl reporters) is not counted on its own, but its CPU time is included in the
+CPU time of the command that started it.
+
+If `--cprofile` is given, the main thread is also run under cProfile and the
+stats dumped for use with `pstats` or `snakeviz`.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import resource
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from contextlib import contextmanager
+
+version = '1.1.101726'
+
+_profiler = None
+
+# Thread CPU time isn't available before Python 3.7; fall back to process time.
+_thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+def add_args(parser):
+    """Add the profiling options to a tool's argparse parser."""
+    parser.add_argument(
+        '--profile',
+        metavar='<trace.json>',
+        help='Write a JSON trace of the wall and CPU time, and subprocesses '
+            'started, for each stage of the run and each file processed. Only '
+            'processes started directly by the tool are counted; CPU time of '
+            'the ones that they start (e.g. vcfExtractor.pl) is included with '
+            'the command that started them.'
+    )
+    parser.add_argument(
+        '--cprofile',
+        metavar='<file.prof>',
+        help='Also run the main thread under cProfile and dump the stats to '
+            'this file. Requires `--profile`.'
+    )
+
+def start(tool, args):
+    """
+    Turn on profiling for this run if `--profile` was passed. Safe to call when
+    it wasn't, in which case nothing is recorded.
+    """
+    global _profiler
+    trace_file = getattr(args, 'profile', None)
+    cprofile_file = getattr(args, 'cprofile', None)
+    if cprofile_file and not trace_file:
+        sys.stderr.write('ERROR: `--cprofile` requires `--profile`.\n')
+        sys.exit(1)
+    if trace_file and _profiler is None:
+        _profiler = Profiler(tool, trace_file, cprofile_file)
+    return _profiler
+
+def enabled():
+    return _profiler is not None
+
+@contextmanager
+def stage(name):
+    """Time a stage of the run in the main process."""
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.stage(name):
+            yield
+
+@contextmanager
+def record(stage_name, item):
+    """
+    Time one unit of work (usually one input file) in a stage. Can be used from
+    worker threads and from forked worker processes.
+    """
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.record(stage_name, item):
+            yield
+
+def process_age():
+    """
+    Seconds since this process was started, from /proc. Returns None where that
+    isn't available.
+    """
+    try:
+        with open('/proc/self/stat') as fh:
+            # The command name can have spaces, so split after it.
+            fields = fh.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as fh:
+            uptime = float(fh.read().split()[0])
+        return uptime - float(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+def command_name(args):
+    if isinstance(args, (str, bytes)):
+        args = args.split()
+    if not args:
+        return '?'
+    name = args[0]
+    if isinstance(name, bytes):
+        name = name.decode('utf-8', 'replace')
+    return os.path.basename(str(name))
+
+
+class _CountingPopen(subprocess.Popen):
+    """
+    `subprocess.Popen` that tells the profiler about every process started, and
+    how much CPU time it (and any of its own children that it waited for) used
+    once it has been waited on.
+    """
+    def __init__(self, args, *posargs, **kwargs):
+        super(_CountingPopen, self).__init__(args, *posargs, **kwargs)
+        if _profiler is not None:
+            _profiler.count_subprocess(args)
+
+    def _try_wait(self, wait_flags):
+        # Same as `Popen._try_wait()`, but with wait4() to get the rusage.
+        try:
+            pid, sts, usage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return self.pid, 0
+        if pid == self.pid and _profiler is not None:
+            _profiler.add_child_cpu(self.args, usage.ru_utime + usage.ru_stime)
+        return pid, sts
+
+
+class Profiler(object):
+    def __init__(self, tool, trace_file, cprofile_file=None):
+        self.tool = tool
+        self.trace_file = trace_file
+        self.cprofile_file = cprofile_file
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.startup = process_age()
+        self.start_wall = time.time()
+        self.start_cpu = time.process_time()
+        self.subprocesses = defaultdict(int)
+        self.child_cpu = defaultdict(float)
+        self.worker_pid = None
+        self.worker_procs = defaultdict(int)
+        self.worker_cpu = defaultdict(float)
+        self.stages = []
+        self.stage_stack = []
+
+        # Per-file records can come from forked workers, so they're spooled to
+        # a file per process and gathered up at the end.
+        self.spool = tempfile.mkdtemp(prefix='ocp_profile_')
+
+        # Tools call `subprocess.Popen` (directly or through `check_output`,
+        # etc) at call time, so swapping the class here counts all of them.
+        subprocess.Popen = _CountingPopen
+
+        self.cprofile = None
+        if cprofile_file:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+        atexit.register(self.write)
+
+    def count_subprocess(self, args):
+        pid = os.getpid()
+        with self.lock:
+            if pid == self.pid:
+                self.subprocesses[command_name(args)] += 1
+            else:
+                self.worker_counts(pid)[command_name(args)] += 1
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def add_child_cpu(self, args, cpu):
+        pid = os.getpid()
+        with self.lock:
+            if pid == self.pid:
+                self.child_cpu[command_name(args)] += cpu
+            else:
+                self.worker_counts(pid)
+                self.worker_cpu[command_name(args)] += cpu
+
+    def total_subprocesses(self):
+        with self.lock:
+            return sum(self.subprocesses.values())
+
+    @contextmanager
+    def stage(self, name):
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        entry = {
+            'stage'      : name,
+            'parent'     : self.stage_stack[-1] if self.stage_stack else None,
+            'start'      : round(time.time() - self.start_wall, 6),
+        }
+        wall = time.time()
+        cpu = time.process_time()
+        procs = self.total_subprocesses()
+        self.stage_stack.append(name)
+        try:
+            yield
+        finally:
+            self.stage_stack.pop()
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            entry['wall_time'] = round(time.time() - wall, 6)
+            entry['cpu_time'] = round(time.process_time() - cpu, 6)
+            entry['child_cpu_time'] = round((after.ru_utime - usage.ru_utime) +
+                (after.ru_stime - usage.ru_stime), 6)
+            entry['subprocesses'] = self.total_subprocesses() - procs
+            self.stages.append(entry)
+
+    @contextmanager
+    def record(self, stage_name, item):
+        wall = time.time()
+        cpu = _thread_time()
+        procs = getattr(self.local, 'count', 0)
+        status = 'ok'
+        try:
+            yield
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            entry = {
+                'stage'        : stage_name,
+                'file'         : str(item),
+                'pid'          : os.getpid(),
+                'thread'       : threading.current_thread().name,
+                'start'        : round(wall - self.start_wall, 6),
+                'wall_time'    : round(time.time() - wall, 6),
+                'cpu_time'     : round(_thread_time() - cpu, 6),
+                'subprocesses' : getattr(self.local, 'count', 0) - procs,
+                'status'       : status,
+            }
+            spool_file = os.path.join(self.spool, '%s.jsonl' % os.getpid())
+            with self.lock:
+                if os.getpid() != self.pid:
+                    # Counts in a worker process never make it back to the
+                    # main process' totals, so carry them along with the
+                    # record.
+                    entry['worker_subprocesses'] = dict(self.worker_counts(
+                        os.getpid()))
+                    entry['worker_child_cpu'] = dict(self.worker_cpu)
+                    self.worker_procs.clear()
+                    self.worker_cpu.clear()
+                with open(spool_file, 'a') as fh:
+                    fh.write(json.dumps(entry) + '\n')
+
+    def worker_counts(self, pid):
+        """
+        Subprocess counts in this worker process since its last record. A
+        forked worker starts with a copy of whatever its parent had, so start
+        over the first time we see a new pid.
+        """
+        if self.worker_pid != pid:
+            self.worker_pid = pid
+            self.worker_procs = defaultdict(int)
+            self.worker_cpu = defaultdict(float)
+        return self.worker_procs
+
+    def read_records(self):
+        records = []
+        for spool_file in sorted(os.listdir(self.spool)):
+            with open(os.path.join(self.spool, spool_file)) as fh:
+                records.extend(json.loads(line) for line in fh if line.strip())
+        records.sort(key=lambda r: r['start'])
+        return records
+
+    @staticmethod
+    def summarize(records):
+        summary = {}
+        for rec in records:
+            stats = summary.setdefault(rec['stage'], {
+                'files'        : 0,
+                'errors'       : 0,
+                'wall_time'    : 0.0,
+                'cpu_time'     : 0.0,
+                'subprocesses' : 0,
+                'slowest_file' : None,
+                'slowest_time' : 0.0,
+            })
+            stats['files'] += 1
+            stats['errors'] += rec['status'] != 'ok'
+            stats['wall_time'] += rec['wall_time']
+            stats['cpu_time'] += rec['cpu_time']
+            stats['subprocesses'] += rec['subprocesses']
+            if rec['wall_time'] >= stats['slowest_time']:
+                stats['slowest_file'] = rec['file']
+                stats['slowest_time'] = rec['wall_time']
+        for stats in summary.values():
+            stats['mean_wall_time'] = stats['wall_time'] / stats['files']
+            for field in ('wall_time', 'cpu_time', 'mean_wall_time',
+                    'slowest_time'):
+                stats[field] = round(stats[field], 6)
+        return summary
+
+    def write(self):
+        # Forked workers inherit the atexit hook; only the main process writes.
+        if os.getpid() != self.pid:
+            return
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_file)
+
+        records = self.read_records()
+        shutil.rmtree(self.spool, ignore_errors=True)
+        subprocesses = defaultdict(int, self.subprocesses)
+        child_cpu = defaultdict(float, self.child_cpu)
+        for rec in records:
+            for cmd, count in rec.pop('worker_subprocesses', {}).items():
+                subprocesses[cmd] += count
+            for cmd, cpu in rec.pop('worker_child_cpu', {}).items():
+                child_cpu[cmd] += cpu
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        trace = {
+            'tool'              : self.tool,
+            'argv'              : sys.argv,
+            'pid'               : self.pid,
+            'date'              : time.strftime('%Y-%m-%dT%H:%M:%S',
+                time.localtime(self.start_wall)),
+            'startup_time'      : (round(self.startup, 3)
+                if self.startup is not None else None),
+            'wall_time'         : round(time.time() - self.start_wall, 6),
+            'cpu_time'          : round(time.process_time() - self.start_cpu,
+                6),
+            'child_cpu_time'    : round(child_usage.ru_utime +
+                child_usage.ru_stime, 6),
+            'max_rss_kb'        : usage.ru_maxrss,
+            'child_max_rss_kb'  : child_usage.ru_maxrss,
+            'subprocesses'      : {
+                'total'      : sum(subprocesses.values()),
+                'by_command' : dict(subprocesses),
+                'cpu_time_by_command' : dict((cmd, round(cpu, 6))
+                    for cmd, cpu in child_cpu.items()),
+            },
+            'stages'            : sorted(self.stages, key=lambda s: s['start']),
+            'file_summary'      : self.summarize(records),
+            'files'             : records,
+            'cprofile'          : self.cprofile_file,
+        }
+
+        tmp_fh, tmp_name = tempfile.mkstemp(dir=os.path.dirname(
+            os.path.abspath(self.trace_file)), suffix='.tmp')
+        with os.fdopen(tmp_fh, 'w') as fh:
+            json.dump(trace, fh, indent=2)
+        os.rename(tmp_name, self.trace_file)
+        sys.stderr.write('Profile trace written to %s.\n' % self.trace_file)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Shared loader for the lookup lists in `resource/` (variant blacklist, fusion
+# drivers, and positive control targets and filters).
+#
+# 10/17/2026
+################################################################################
+"""
+Load the lookup lists used by the MOI and QC reporters from `resource/`, and
+build them into sets (or dicts) once per process so that every check against
+them is a constant time lookup rather than a scan of the list. The same files
+are read into hashes by the Perl reporters:
+
+    - `blacklist.txt`: SNV / Indel `chr:pos:ref:alt` IDs that are never
+      reported (`match_moi_report.pl`).
+    - `fusion_drivers.txt`: genes that are the driver in a fusion pair
+      (`ocp_fusion_report.pl`).
+    - `positive_control_targets.json`: expected variants for each version of
+      the MATCH positive control (`match_positive_control_report.pl`).
+    - `positive_control_filters.json`: artifact calls that are left out of the
+      positive control report, for all versions (`all`) or just some.
+
+The list files have a `#version: <version>` line at the top, and can have
+other `#` comment lines and blank lines, which are skipped.
+"""
+import os
+import sys
+import json
+
+from pprint import pprint as pp # noqa
+
+try:
+    from functools import lru_cache
+except ImportError:
+    # Python 2; just don't cache.
+    def lru_cache(maxsize=None):
+        return lambda func: func
+
+version = '1.0.101726'
+
+resource_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'resource')
+blacklist_file = os.path.join(resource_dir, 'blacklist.txt')
+drivers_file = os.path.join(resource_dir, 'fusion_drivers.txt')
+control_targets_file = os.path.join(resource_dir,
+    'positive_control_targets.json')
+control_filters_file = os.path.join(resource_dir,
+    'positive_control_filters.json')
+
+
+@lru_cache(maxsize=None)
+def read_list(list_file):
+    """
+    Read a one entry per line resource list, and return the version string
+    (or None if there isn't one) and a frozenset of the entries.
+    """
+    list_version = None
+    entries = set()
+    with open(list_file) as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            elif line.startswith('#'):
+                if line.startswith('#version:') and list_version is None:
+                    list_version = line.split(':', 1)[1].strip()
+                continue
+            entries.add(line)
+    return list_version, frozenset(entries)
+
+def load_blacklist(blacklist=blacklist_file):
+    """
+    Return the blacklist version string and a set of `chr:pos:ref:alt` IDs
+    that should not be reported.
+    """
+    return read_list(blacklist)
+
+def load_drivers(drivers=drivers_file):
+    """Return the set of fusion driver genes."""
+    return read_list(drivers)[1]
+
+@lru_cache(maxsize=None)
+def read_json(json_file):
+    with open(json_file) as fh:
+        return json.load(fh)
+
+def control_tables(targets=control_targets_file):
+    """Return the names of the positive control lookup tables (e.g. `v3`)."""
+    return sorted(read_json(targets))
+
+def load_control_targets(table, targets=control_targets_file):
+    """
+    Return a dict of the expected variants in positive control lookup table
+    `table` (e.g. `v3`). Raises KeyError if there is no such table.
+    """
+    tables = read_json(targets)
+    if table not in tables:
+        raise KeyError("Lookup table '{}' is not a valid lookup table! Valid "
+            "tables are: {}".format(table, ', '.join(sorted(tables))))
+    return dict(tables[table])
+
+def load_control_filters(table, filters=control_filters_file):
+    """
+    Return the set of variant IDs to leave out of the positive control report
+    for lookup table `table`.
+    """
+    filter_lists = read_json(filters)
+    return frozenset(filter_lists.get('all', []) +
+        filter_lists.get(table, []))
+
+if __name__ == '__main__':
+    # Quick look at what's loaded, e.g. after editing one of the lists.
+    blist_version, blacklist = load_blacklist()
+    sys.stdout.write('Blacklist version {}: {} variants\n'.format(
+        blist_version, len(blacklist)))
+    sys.stdout.write('Fusion drivers: {}\n'.format(len(load_drivers())))
+    for table in control_tables():
+        sys.stdout.write('Positive control {}: {} targets, {} filtered\n'.format(
+            table, len(load_control_targets(table)),
+            len(load_control_filters(table))))
@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Single pass reader for Ion Reporter Oncomine VCF files that can be shared by
+# the rest of the tools in this package.
+#
+# 10/17/2026
+################################################################################
+"""
+Read an Oncomine Comprehensive Assay (OCA) / Oncomine Cancer Panel (OCP) VCF
+file once and return typed records for the SNVs / Indels, CNVs, fusions, and
+expression data, along with the header metadata.  The SNV / Indel records carry
+the same fields (and field order) that `vcfExtractor.pl -Nna` outputs so that
+the MOI rules can be run on them without re-reading the file.
+
+Plain text and bgzip compressed (`.vcf.gz`) VCFs are both read transparently.
+If a compressed VCF has a tabix index (`.vcf.gz.tbi`), `fetch()` and the
+`region` option of `read_vcf()` seek straight to the blocks that cover the
+region rather than reading the whole file.
+"""
+import os
+import re
+import sys
+import gzip
+import zlib
+import struct
+import argparse
+
+from collections import namedtuple
+from pprint import pprint as pp # noqa
+
+version = '1.1.101726'
+
+# SNV / Indel fields are in the same order as the `vcfExtractor.pl` columns.
+SNV = namedtuple('SNV', ['chrpos', 'ref', 'alt', 'vaf', 'tot_cov', 'ref_cov',
+    'alt_cov', 'varid', 'gene', 'transcript', 'cds', 'aa', 'location',
+    'function', 'oncomine_vc', 'filter'])
+
+CNV = namedtuple('CNV', ['chrom', 'pos', 'gene', 'end', 'length', 'tiles',
+    'raw_cn', 'ref_cn', 'ci_05', 'ci_95', 'cn', 'hotspot', 'gene_class',
+    'variant_class', 'filter'])
+
+Fusion = namedtuple('Fusion', ['assay_id', 'pair', 'junction', 'fusion_id',
+    'elem', 'read_count', 'filter'])
+
+# ExprControl and GeneExpression assays.
+Expression = namedtuple('Expression', ['svtype', 'assay_id', 'read_count',
+    'filter'])
+
+# Record types that can be requested from `read_vcf()`.
+record_types = ('snv', 'cnv', 'fusion', 'expression')
+
+svtype_re = re.compile(r'SVTYPE=(\w+)')
+func_block_re = re.compile(r'\{(.*?)\}')
+func_pair_re = re.compile(r"'(\w+)':(?:'([^']*)'|([^,}]*))")
+ovat_re = re.compile(r'^(\d+\.\d+)\.\d+')
+region_re = re.compile(r'^(.+?)(?::([\d,]+)(?:-([\d,]+))?)?$')
+
+# Max uncompressed data per BGZF block, and the standard empty EOF block.
+bgzf_block_size = 0xff00
+bgzf_eof = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43'
+    b'\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+
+class VcfData(object):
+    """
+    Container for everything we pull out of a VCF. The `header` dict holds the
+    `##key=value` metadata lines (structured lines like `##INFO=<...>` are
+    skipped), and the typed records are stored in a list for each type.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header = {}
+        self.sample = None
+        self.gender = None
+        self.cellularity = None
+        self.fusion_header = False
+        self.snvs = []
+        self.cnvs = []
+        self.fusions = []
+        self.expression = []
+
+    @property
+    def mapd(self):
+        return self.header.get('mapd')
+
+    @property
+    def mapped_fusion_reads(self):
+        return self.header.get('TotalMappedFusionPanelReads')
+
+    @property
+    def file_date(self):
+        return self.header.get('fileDate')
+
+    @property
+    def ovat_version(self):
+        """
+        Major and minor version of the Oncomine Variant Annotation Tool (e.g.
+        `2.3`), which is how we determine which version of the assay was run.
+        """
+        ovat = self.header.get('OncomineVariantAnnotationToolVersion', '')
+        match = ovat_re.search(ovat)
+        if match:
+            return match.group(1)
+
+    def expr_sum(self, svtype='ExprControl'):
+        return sum(x.read_count for x in self.expression if x.svtype == svtype)
+
+
+def open_vcf(vcf_file):
+    """
+    Open a VCF for reading as text, whether it's plain text or gzip / bgzip
+    compressed.
+    """
+    if vcf_file.endswith('.gz'):
+        return gzip.open(vcf_file, 'rt')
+    return open(vcf_file)
+
+def read_vcf(vcf_file, wanted=record_types, region=None):
+    """
+    Read a VCF file in one pass and return a `VcfData` object. Limit the
+    records that are parsed by passing a subset of `record_types` in `wanted`;
+    lines of other types are skipped without being split. If a `region` (e.g.
+    `chr7:55241000-55243000`) is passed, only the header and the records in that
+    region are read, using the tabix index if there is one. If no record types
+    are wanted at all, reading stops at the end of the header.
+    """
+    data = VcfData(vcf_file)
+    with open_vcf(vcf_file) as fh:
+        for line in fh:
+            if line.startswith('##'):
+                parse_meta(line.rstrip('\n'), data)
+            elif line.startswith('#CHROM'):
+                data.sample = line.rstrip('\n').split('\t')[-1]
+                if region or not wanted:
+                    break
+            elif line.strip():
+                parse_record(line, data, wanted)
+
+    if region:
+        for line in fetch(vcf_file, *parse_region(region)):
+            parse_record(line, data, wanted)
+    return data
+
+def parse_meta(line, data):
+    if 'Fusion' in line:
+        data.fusion_header = True
+
+    key, sep, value = line[2:].partition('=')
+    if not sep or value.startswith('<'):
+        return
+    data.header.setdefault(key, value)
+
+    # Mirror the way that `ocp_cnv_report.pl` finds the sample metadata, which
+    # can be on the IR lines or on the newer CNV plugin lines.
+    match = re.search(r'sampleGender=(\w+)', line)
+    if match:
+        data.gender = match.group(1)
+    else:
+        match = re.search(r'AssumedGender=([mf])', line)
+        if match:
+            data.gender = 'Male' if match.group(1) == 'm' else 'Female'
+    match = re.search(r'CellularityAsAFractionBetween0-1=(.*)$', line)
+    if match:
+        data.cellularity = match.group(1)
+
+def parse_record(line, data, wanted):
+    if 'SVTYPE=' in line:
+        svtype = svtype_re.search(line).group(1)
+        if svtype == 'Fusion' and 'fusion' in wanted:
+            data.fusions.append(parse_fusion(line))
+        elif (svtype in ('ExprControl', 'GeneExpression')
+                and 'expression' in wanted):
+            data.expression.append(parse_expression(line, svtype))
+    elif '\t<CNV>\t' in line:
+        if 'cnv' in wanted:
+            data.cnvs.append(parse_cnv(line))
+    elif 'snv' in wanted:
+        data.snvs.extend(parse_snv(line))
+
+def parse_info(info):
+    """
+    Split the INFO field into a dict.  Flags (e.g. `HS`) are set to `True`.
+    """
+    info_data = {}
+    for elem in info.split(';'):
+        key, sep, value = elem.partition('=')
+        info_data[key] = value if sep else True
+    return info_data
+
+def parse_func(func):
+    """
+    The FUNC annotation is a list of Python-ish dicts, one per allele. Return a
+    list of dicts with the values as strings.
+    """
+    blocks = []
+    if not func or func is True:
+        return blocks
+    for block in func_block_re.findall(func):
+        blocks.append(dict((k, q or u) for k, q, u in
+            func_pair_re.findall(block)))
+    return blocks
+
+def trim_alleles(pos, ref, alt):
+    """
+    IR pads all of the alleles in a multi-allelic record to the same REF. Trim
+    the shared suffix and prefix so that each allele is reported in its minimal
+    VCF representation (keeping the anchor base for indels).
+    """
+    while len(ref) > 1 and len(alt) > 1 and ref[-1] == alt[-1]:
+        ref, alt = ref[:-1], alt[:-1]
+    while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+        ref, alt = ref[1:], alt[1:]
+        pos += 1
+    return pos, ref, alt
+
+def to_int(val):
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return 0
+
+def to_float(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return 0.0
+
+def get_func_block(blocks, pos, alt):
+    if len(blocks) == 1:
+        return blocks[0]
+    for block in blocks:
+        if block.get('normalizedAlt') == alt or block.get('origAlt') == alt:
+            return block
+    for block in blocks:
+        if block.get('normalizedPos') == str(pos):
+            return block
+    return {}
+
+def parse_snv(line):
+    fields = line.rstrip('\n').split('\t')
+    chrom, pos, varid, ref, alts, _, filt, info = fields[:8]
+    info = parse_info(info)
+    blocks = parse_func(info.get('FUNC'))
+
+    tot_cov = to_int(info.get('FDP', info.get('DP')))
+    ref_cov = to_int(info.get('FRO', info.get('RO')))
+    alt_counts = str(info.get('FAO', info.get('AO', ''))).split(',')
+
+    records = []
+    for i, alt in enumerate(alts.split(',')):
+        alt_cov = to_int(alt_counts[i]) if i < len(alt_counts) else 0
+        vaf = round(float(alt_cov) / tot_cov * 100, 2) if tot_cov else 0.0
+        var_pos, var_ref, var_alt = trim_alleles(int(pos), ref, alt)
+
+        func = get_func_block(blocks, var_pos, var_alt)
+        if func.get('exon'):
+            location = 'Exon' + func['exon']
+        else:
+            location = func.get('location') or '---'
+
+        records.append(SNV(
+            chrpos      = '{}:{}'.format(chrom, var_pos),
+            ref         = var_ref,
+            alt         = var_alt,
+            vaf         = vaf,
+            tot_cov     = tot_cov,
+            ref_cov     = ref_cov,
+            alt_cov     = alt_cov,
+            varid       = varid,
+            gene        = func.get('gene') or '---',
+            transcript  = func.get('transcript') or '---',
+            cds         = func.get('coding') or '---',
+            aa          = func.get('protein') or '---',
+            location    = location,
+            function    = func.get('function') or '---',
+            oncomine_vc = func.get('oncomineVariantClass') or '---',
+            filter      = filt
+        ))
+    return records
+
+def parse_cnv(line):
+    fields = line.rstrip('\n').split('\t')
+    info = parse_info(fields[7])
+
+    ci_05 = ci_95 = 0.0
+    match = re.search(r'0\.05:(.*?),0\.95:(.*)$', str(info.get('CI', '')))
+    if match:
+        ci_05, ci_95 = (to_float(x) for x in match.groups())
+
+    cn = fields[9].split(':')[-1] if len(fields) > 9 else None
+
+    gene_class = variant_class = '---'
+    func = parse_func(info.get('FUNC'))
+    if func and 'oncomineGeneClass' in func[0]:
+        gene_class = func[0].get('oncomineGeneClass', '---')
+        variant_class = func[0].get('oncomineVariantClass', '---')
+
+    return CNV(
+        chrom         = fields[0],
+        pos           = int(fields[1]),
+        gene          = fields[2],
+        end           = to_int(info.get('END')),
+        length        = info.get('LEN'),
+        tiles         = to_int(info.get('NUMTILES')),
+        raw_cn        = to_float(info.get('RAW_CN')),
+        ref_cn        = to_float(info.get('REF_CN')),
+        ci_05         = ci_05,
+        ci_95         = ci_95,
+        cn            = to_float(cn),
+        hotspot       = 'HS' in info,
+        gene_class    = gene_class,
+        variant_class = variant_class,
+        filter        = fields[6]
+    )
+
+def parse_fusion(line):
+    fields = line.split('\t', 8)
+    match = re.search(r'(.*?)_([12])$', fields[2])
+    if match:
+        name, elem = match.groups()
+    else:
+        name, elem = fields[2], None
+
+    # ID is <pair>.<junction>.<id>; not all of them have the trailing ID.
+    elems = name.split('.')
+    elems += ['-'] * (3 - len(elems))
+
+    return Fusion(
+        assay_id   = name,
+        pair       = elems[0],
+        junction   = elems[1],
+        fusion_id  = elems[2],
+        elem       = elem,
+        read_count = to_int(parse_info(fields[7]).get('READ_COUNT')),
+        filter     = fields[6]
+    )
+
+def parse_expression(line, svtype):
+    fields = line.split('\t', 8)
+    return Expression(
+        svtype     = svtype,
+        assay_id   = re.sub(r'_[12]$', '', fields[2]),
+        read_count = to_int(parse_info(fields[7]).get('READ_COUNT')),
+        filter     = fields[6]
+    )
+
+def parse_region(region):
+    """
+    Parse a `chr`, `chr:pos`, or `chr:start-end` string into a (chrom, start,
+    end) tuple with 1-based, inclusive coordinates.
+    """
+    match = region_re.match(region)
+    if not match:
+        raise ValueError("Can not parse region '%s'!" % region)
+    chrom, start, end = match.groups()
+    start = int(start.replace(',', '')) if start else 1
+    end = int(end.replace(',', '')) if end else (start if match.group(2)
+        else 1 << 29)
+    return chrom, start, end
+
+def fetch(vcf_file, chrom, start, end):
+    """
+    Yield the body lines of a VCF that overlap `chrom:start-end` (1-based,
+    inclusive). Bgzip compressed VCFs with a tabix index are read by seeking
+    to the indexed blocks; anything else gets a linear scan.
+    """
+    index_file = vcf_file + '.tbi'
+    if vcf_file.endswith('.gz') and os.path.exists(index_file):
+        index = TabixIndex(index_file)
+        with BgzfReader(vcf_file) as reader:
+            for chunk_start, chunk_end in index.chunks(chrom, start, end):
+                reader.seek(chunk_start)
+                while reader.tell() < chunk_end:
+                    line = reader.readline()
+                    if not line:
+                        break
+                    overlap = line_overlaps(line, chrom, start, end)
+                    if overlap is None:
+                        break
+                    elif overlap:
+                        yield line
+    else:
+        with open_vcf(vcf_file) as fh:
+            for line in fh:
+                if not line.startswith('#') and line_overlaps(line, chrom,
+                        start, end):
+                    yield line
+
+def line_overlaps(line, chrom, start, end):
+    """
+    Returns True if the record overlaps the region, False if not, and None if
+    it's past the end of the region (the file is sorted, so we can stop). Like
+    tabix, a record ends at INFO/END if it has one (e.g. <CNV> records), and
+    at the end of REF if not.
+    """
+    fields = line.split('\t', 8)
+    if fields[0] != chrom:
+        return False
+    pos = int(fields[1])
+    if pos > end:
+        return None
+    rec_end = pos + len(fields[3]) - 1
+    if len(fields) > 7 and 'END=' in fields[7]:
+        for item in fields[7].split(';'):
+            if item.startswith('END='):
+                if to_int(item[4:]) >= pos:
+                    rec_end = to_int(item[4:])
+                break
+    return rec_end >= start
+
+def reg2bins(beg, end):
+    """
+    Bins that can hold features in the 0-based, half open interval [beg, end)
+    from the UCSC binning scheme used by tabix.
+    """
+    end -= 1
+    bins = [0]
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+    return bins
+
+
+class TabixIndex(object):
+    """
+    Read a tabix (`.tbi`) index, and return the BGZF virtual offset chunks that
+    need to be read for a region.
+    """
+    def __init__(self, index_file):
+        with gzip.open(index_file, 'rb') as fh:
+            raw = fh.read()
+        if raw[:4] != b'TBI\x01':
+            raise ValueError("'%s' is not a valid tabix index!" % index_file)
+
+        n_ref = struct.unpack_from('<i', raw, 4)[0]
+        l_nm = struct.unpack_from('<i', raw, 32)[0]
+        names = [x.decode('utf-8') for x in raw[36:36 + l_nm].split(b'\0')]
+        offset = 36 + l_nm
+
+        self.refs = {}
+        for name in names[:n_ref]:
+            bins = {}
+            n_bin = struct.unpack_from('<i', raw, offset)[0]
+            offset += 4
+            for _ in range(n_bin):
+                bin_id, n_chunk = struct.unpack_from('<Ii', raw, offset)
+                offset += 8
+                chunks = struct.unpack_from('<%dQ' % (n_chunk * 2), raw, offset)
+                offset += 16 * n_chunk
+                bins[bin_id] = list(zip(chunks[::2], chunks[1::2]))
+            n_intv = struct.unpack_from('<i', raw, offset)[0]
+            offset += 4
+            ioff = struct.unpack_from('<%dQ' % n_intv, raw, offset)
+            offset += 8 * n_intv
+            self.refs[name] = (bins, ioff)
+
+    def chunks(self, chrom, start, end):
+        if chrom not in self.refs:
+            return []
+        bins, ioff = self.refs[chrom]
+        beg = max(start - 1, 0)
+        min_offset = ioff[min(beg >> 14, len(ioff) - 1)] if ioff else 0
+
+        chunks = sorted(chunk for b in reg2bins(beg, end)
+            for chunk in bins.get(b, []) if chunk[1] > min_offset)
+
+        # Merge overlapping chunks so we don't read the same lines twice.
+        merged = []
+        for chunk_start, chunk_end in chunks:
+            chunk_start = max(chunk_start, min_offset)
+            if merged and chunk_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], chunk_end)
+            else:
+                merged.append([chunk_start, chunk_end])
+        return merged
+
+
+class BgzfReader(object):
+    """
+    Minimal random access reader for BGZF (bgzip) files using the virtual
+    offsets from a tabix index (compressed block offset << 16 | offset within
+    the uncompressed block).
+    """
+    def __init__(self, path):
+        self.fh = open(path, 'rb')
+        self.block_start = self.next_block = self.pos = 0
+        self.buffer = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.fh.close()
+
+    def _load(self, coffset):
+        self.fh.seek(coffset)
+        header = self.fh.read(12)
+        if len(header) < 12:
+            self.buffer = b''
+            self.block_start = self.next_block = coffset
+            self.pos = 0
+            return False
+
+        xlen = struct.unpack_from('<H', header, 10)[0]
+        extra = self.fh.read(xlen)
+        bsize = None
+        i = 0
+        while i < xlen:
+            si1, si2, slen = struct.unpack_from('<BBH', extra, i)
+            if si1 == 66 and si2 == 67:
+                bsize = struct.unpack_from('<H', extra, i + 4)[0]
+            i += 4 + slen
+        if bsize is None:
+            raise ValueError("'%s' is not a BGZF file!" % self.fh.name)
+
+        cdata = self.fh.read(bsize - xlen - 19)
+        self.buffer = zlib.decompress(cdata, -15)
+        self.block_start = coffset
+        self.next_block = coffset + bsize + 1
+        self.pos = 0
+        return True
+
+    def seek(self, virtual_offset):
+        coffset, uoffset = virtual_offset >> 16, virtual_offset & 0xffff
+        if coffset != self.block_start or not self.buffer:
+            self._load(coffset)
+        self.pos = uoffset
+
+    def tell(self):
+        if self.pos >= len(self.buffer):
+            return self.next_block << 16
+        return (self.block_start << 16) | self.pos
+
+    def read_block(self):
+        """
+        Read the next whole block and return its uncompressed data, or an empty
+        string at the end of the file. `next_block` is then the file offset of
+        the block after it.
+        """
+        if not self._load(self.next_block):
+            return b''
+        self.pos = len(self.buffer)
+        return self.buffer
+
+    def readline(self):
+        parts = []
+        while True:
+            if self.pos >= len(self.buffer):
+                if not self._load(self.next_block):
+                    break
+                continue
+            idx = self.buffer.find(b'\n', self.pos)
+            if idx == -1:
+                parts.append(self.buffer[self.pos:])
+                self.pos = len(self.buffer)
+            else:
+                parts.append(self.buffer[self.pos:idx + 1])
+                self.pos = idx + 1
+                break
+        return b''.join(parts).decode('utf-8')
+
+
+class BgzfWriter(object):
+    """
+    Write a BGZF (bgzip) compressed file so that output stays compatible with
+    tabix and the other htslib tools.
+    """
+    def __init__(self, path, level=6):
+        self.fh = open(path, 'wb')
+        self.level = level
+        self.buffer = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.buffer += data
+        while len(self.buffer) >= bgzf_block_size:
+            self._write_block(self.buffer[:bgzf_block_size])
+            self.buffer = self.buffer[bgzf_block_size:]
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66,
+            67, 2, len(cdata) + 25)
+        self.fh.write(header + cdata + struct.pack('<II',
+            zlib.crc32(data) & 0xffffffff, len(data)))
+
+    def flush(self):
+        """Write out any buffered data as a (short) block."""
+        if self.buffer:
+            self._write_block(self.buffer)
+            self.buffer = b''
+        self.fh.flush()
+
+    def close(self):
+        self.flush()
+        self.fh.write(bgzf_eof)
+        self.fh.close()
+
+def extractor_fields(snv):
+    """
+    Return the SNV as a list of strings laid out like a `vcfExtractor.pl -Nna`
+    output line, which is what the MOI rules index into.
+    """
+    return [snv.chrpos, snv.ref, snv.alt, '{:.2f}'.format(snv.vaf),
+        str(snv.tot_cov), str(snv.ref_cov), str(snv.alt_cov), snv.varid,
+        snv.gene, snv.transcript, snv.cds, snv.aa, snv.location, snv.function,
+        snv.oncomine_vc]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('vcf', metavar='<VCF(s)>', nargs='+',
+        help='VCF file(s) to read.')
+    parser.add_argument('-r', '--region', metavar='<chr:start-end>',
+        help='Only read records in this region.')
+    args = parser.parse_args()
+
+    for vcf in args.vcf:
+        vcf_data = read_vcf(vcf, region=args.region)
+        sys.stdout.write('{}: {} SNVs, {} CNVs, {} fusion lines, {} expression '
+            'lines\n'.format(vcf_data.sample, len(vcf_data.snvs),
+            len(vcf_data.cnvs), len(vcf_data.fusions),
+            len(vcf_data.expression)))
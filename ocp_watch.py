@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Watch a directory for new or changed VCF files and keep track of the results
+# we already have for each one, so that a collated report can be kept current
+# without re-running the whole cohort.
+#
+# 10/17/2026
+################################################################################
+"""
+Helpers for the `--watch` mode of `collate_moi_reports.py`.
+
+`VcfWatcher` finds new, changed, and removed VCFs under a directory tree. On
+Linux it uses inotify (through libc, so no extra packages needed) and only
+looks at the files named in the events. Anywhere inotify is not available it
+falls back to walking the tree every `poll_interval` seconds. Files found by a
+walk are only handed back once they have not been modified for `settle`
+seconds, so that we don't pick up a VCF that IR is still writing.
+
+`CohortState` keeps the results for each VCF in its own JSON file under a
+state directory, keyed on the VCF path, along with the mtime and size of the
+VCF they came from. A restarted watcher only has to process the VCFs that
+were added or changed while it was down.
+"""
+import os
+import re
+import sys
+import json
+import time
+import errno
+import select
+import struct
+import hashlib
+import tempfile
+import ctypes
+import ctypes.util
+
+from pprint import pprint as pp # noqa
+
+version = '1.0.101726'
+
+default_poll_interval = 10  # seconds
+default_settle = 5  # seconds
+
+vcf_re = re.compile(r'\.vcf(?:\.gz)?$')
+
+# inotify(7) event masks.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+
+def atomic_write(path, text):
+    '''Write out a file by way of a temp file so readers never see half of it.'''
+    out_dir = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=out_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as fh:
+        fh.write(text)
+    os.rename(tmp, path)
+
+def file_stat(path):
+    '''(mtime in ns, size) for a file, or None if it's gone.'''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def find_vcfs(vcf_dir):
+    '''Walk the tree under `vcf_dir` and stat every VCF in it.'''
+    found = {}
+    for root, dirs, files in os.walk(vcf_dir):
+        for f in files:
+            if vcf_re.search(f):
+                path = os.path.join(root, f)
+                stat = file_stat(path)
+                if stat:
+                    found[path] = stat
+    return found
+
+
+class Inotify(object):
+    '''
+    Minimal inotify(7) wrapper over libc. Raises OSError or AttributeError if
+    inotify is not available on this system.
+    '''
+    mask = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+        IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.watches = {}
+
+    def add_watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), self.mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.watches[wd] = path
+
+    def read(self, timeout):
+        '''
+        Wait up to `timeout` seconds for events and return a list of (path,
+        mask). An overflowed event queue comes back as (None, IN_Q_OVERFLOW).
+        '''
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except InterruptedError:
+            return []
+        if not ready:
+            return []
+        buf = os.read(self.fd, 65536)
+        events = []
+        i = 0
+        while i < len(buf):
+            wd, mask, cookie, length = struct.unpack_from('iIII', buf, i)
+            i += 16
+            name = buf[i:i+length].rstrip(b'\0')
+            i += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            watch_dir = self.watches.get(wd)
+            if watch_dir is None:
+                continue
+            if name:
+                events.append((os.path.join(watch_dir, os.fsdecode(name)), mask))
+            else:
+                events.append((watch_dir, mask | IN_ISDIR))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class VcfWatcher(object):
+    '''
+    Find the VCFs under `vcf_dir` that are new or changed compared to what we
+    already know about. Call `check()` to get them, and `wait()` to block
+    until there might be more.
+    '''
+    def __init__(self, vcf_dir, poll_interval=default_poll_interval,
+            settle=default_settle, use_inotify=True):
+        self.vcf_dir = os.path.abspath(vcf_dir)
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.add_watches()
+            except (OSError, AttributeError) as e:
+                sys.stderr.write("WARN: Can not use inotify to watch '{}' ({}). "
+                    "Polling every {}s instead.\n".format(self.vcf_dir, e,
+                    poll_interval))
+                self.close()
+        self.mode = 'inotify' if self.inotify else 'polling'
+
+        # Paths named in inotify events since the last check; these have been
+        # closed or moved into place, so are ready to go.
+        self._ready = set()
+        # Paths that we've seen but that had not settled yet.
+        self._pending = set()
+        self._rescan = True
+
+    def add_watches(self):
+        self.close()
+        self.inotify = Inotify()
+        for root, dirs, files in os.walk(self.vcf_dir):
+            self.inotify.add_watch(root)
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+
+    def check(self, known):
+        '''
+        Return a dict of the VCFs that are new or changed compared to their
+        (mtime, size) in `known` along with their current (mtime, size), and a
+        list of the VCFs in `known` that are gone. The first check, and every
+        check when polling, walks the whole tree; after that inotify tells us
+        which files to look at.
+        '''
+        if self._rescan or not self.inotify:
+            current = find_vcfs(self.vcf_dir)
+            candidates = set(current) | set(known)
+            ready = set()
+            self._rescan = False
+        else:
+            candidates = self._ready | self._pending
+            current = dict((p, file_stat(p)) for p in candidates)
+            ready = self._ready
+        self._ready = set()
+        self._pending = set()
+
+        changed = {}
+        removed = []
+        now = time.time()
+        for path in candidates:
+            stat = current.get(path)
+            if stat is None:
+                if path in known:
+                    removed.append(path)
+                continue
+            if known.get(path) == stat:
+                continue
+            if path not in ready and now - stat[0] / 1e9 < self.settle:
+                self._pending.add(path)
+                continue
+            changed[path] = stat
+        return changed, sorted(removed)
+
+    def waiting(self):
+        '''VCFs from the last check that were still being written.'''
+        return sorted(self._pending)
+
+    def wait(self):
+        '''
+        Block until inotify has something for us, we need to recheck a file
+        that had not settled, or it's time to poll again.
+        '''
+        timeout = self.poll_interval
+        if self._pending:
+            timeout = min(timeout, self.settle)
+        if not self.inotify:
+            time.sleep(timeout)
+            return
+
+        for path, mask in self.inotify.read(timeout):
+            if path is None:
+                # Lost events; walk the tree again.
+                self._rescan = True
+            elif mask & IN_ISDIR:
+                # A new directory needs watches of its own, and one that went
+                # away (or moved) leaves stale watch paths behind. Either way
+                # start over with a fresh set of watches and a walk.
+                if mask & (IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE |
+                        IN_DELETE_SELF | IN_MOVE_SELF):
+                    try:
+                        self.add_watches()
+                    except OSError as e:
+                        if e.errno != errno.ENOENT:
+                            raise
+                    self._rescan = True
+            elif vcf_re.search(path):
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE |
+                        IN_MOVED_FROM):
+                    self._ready.add(path)
+                    self._pending.discard(path)
+
+
+class CohortState(object):
+    '''
+    Results for each VCF that we've processed, stored as `<state_dir>/<sha1 of
+    VCF path>.json`. Each entry holds the VCF path, its (mtime, size) when it
+    was processed, and whatever `data` the caller wants to keep for it. If the
+    `params` used to make the results change, the old entries are dropped.
+    '''
+    def __init__(self, state_dir, params):
+        self.state_dir = state_dir
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+
+        self.entries = {}
+        params_file = os.path.join(state_dir, 'params.json')
+        old_params = None
+        if os.path.isfile(params_file):
+            with open(params_file) as fh:
+                old_params = json.load(fh)
+
+        for f in os.listdir(state_dir):
+            if not f.endswith('.json') or f == 'params.json':
+                continue
+            path = os.path.join(state_dir, f)
+            if old_params != params:
+                os.remove(path)
+                continue
+            try:
+                with open(path) as fh:
+                    entry = json.load(fh)
+            except (IOError, ValueError):
+                os.remove(path)
+                continue
+            self.entries[entry['vcf']] = entry
+
+        if old_params is not None and old_params != params:
+            sys.stderr.write("WARN: MOI params have changed since the last run. "
+                "Reprocessing all VCFs.\n")
+        if old_params != params:
+            atomic_write(params_file, json.dumps(params))
+
+    def path(self, vcf):
+        digest = hashlib.sha1(vcf.encode('utf-8')).hexdigest()
+        return os.path.join(self.state_dir, digest + '.json')
+
+    def known(self):
+        return dict((vcf, e['stat']) for vcf, e in self.entries.items())
+
+    def put(self, vcf, stat, data):
+        entry = {'vcf' : vcf, 'stat' : stat, 'data' : data}
+        atomic_write(self.path(vcf), json.dumps(entry))
+        self.entries[vcf] = entry
+
+    def remove(self, vcf):
+        if self.entries.pop(vcf, None) is not None:
+            try:
+                os.remove(self.path(vcf))
+            except OSError:
+                pass
+
+    def data(self):
+        '''(vcf, data) for each entry in VCF order.'''
+        return [(vcf, self.entries[vcf]['data']) for vcf in sorted(self.entries)]
@@ -1,39 +1,74 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 import sys
 import os
 import re
+import ssl
+import json
+import hashlib
+import tempfile
+import time
+import queue
 import shutil
 import argparse
+import threading
 import subprocess
 import fnmatch
+import http.client
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from time import sleep
 from pprint import pprint as pp
 
-version = '3.0.1_042117'
+import ocp_profile
+import moi_server
+
+version = '3.4.1_101726'
+
+# IR REST API endpoint used to look up an analysis and its download links.
+ir_analysis_api = '/api/v1/analysis'
 
 def get_args():
     parser = argparse.ArgumentParser(
         formatter_class = lambda prog: argparse.HelpFormatter(prog, max_help_position = 100, width=200),
         description='''
         Wrapper program for several shell commands and other programs that are invoked for a variant review process.
-        Wrote a script to help automate this and (possibly) save on some carpal tunnel!
+        Wrote a script to help automate this and (possibly) save on some carpal tunnel!  The BAM indexing and the IR
+        data retrieval and MOI report are all run at the same time.  Many cases can be set up at once by passing a
+        manifest file (one case per line: PSN, MSN, DNA BAM, RNA BAM, and an optional IR analysis ID, separated by
+        commas or whitespace) with the "--manifest" option.
         ''',
-        version = '%(prog)s  - ' + version,
         )
-    parser.add_argument("dna_bam", help='DNA BAM file from MATCHBox.')
-    parser.add_argument("rna_bam", help='RNA BAM file from MATCHBox.')
-    parser.add_argument('-a', '--analysis_id', metavar='<ir_analysis_id>', 
+    parser.add_argument('-v', '--version', action='version', version = '%(prog)s  - ' + version)
+    moi_server.add_args(parser)
+    ocp_profile.add_args(parser)
+    parser.add_argument("dna_bam", nargs='?', help='DNA BAM file from MATCHBox.')
+    parser.add_argument("rna_bam", nargs='?', help='RNA BAM file from MATCHBox.')
+    parser.add_argument('-a', '--analysis_id', metavar='<ir_analysis_id>',
             help='The IR analysis ID that will be used to pull the data from the IR server if different than in BAM name')
-    parser.add_argument('-i', '--ip', metavar='<ip_address>', 
-            help='IP Address of server if not using config file (not recommended!). Must be used with the "--token" option')
-    parser.add_argument('-t', '--token', metavar='<ir_token>', 
+    parser.add_argument('-i', '--ip', metavar='<ip_address>',
+            help='IP Address of server if not using config file (not recommended!). Must be used with the "--token" option. '
+                'Data is then retrieved in-process over a pooled connection rather than with "ir_api_retrieve.py". Can '
+                'also be a full URL (e.g. http://localhost:8000) for testing.')
+    parser.add_argument('-t', '--token', metavar='<ir_token>',
             help='An Ion Reporter API token to use with the "--ip" address function if not using a config file (not recommended!)')
     parser.add_argument('-s', '--site', metavar='<match_site_id>', default='nci',
             help='The site ID used in the ir_api_retrieve script to pull out the data (DEFAULT: %(default)s)')
-
-    requiredNamed = parser.add_argument_group('Required Named Arguments')
-    requiredNamed.add_argument('-p', '--psn', metavar='<PSN>', required=True, help='PSN for this case')
-    requiredNamed.add_argument('-m', '--msn', metavar='<MSN>', required=True, help='MSN for this case')
+    parser.add_argument('-b', '--retry_budget', metavar='<seconds>', type=int, default=120,
+            help='Total time to spend waiting between retries if the IR server can not be reached. The wait doubles '
+                'after each failed attempt, starting from 5 seconds (DEFAULT: %(default)s)')
+    parser.add_argument('-M', '--manifest', metavar='<manifest>',
+            help='Manifest of cases to set up for review in one batch, rather than a single PSN / MSN and BAM pair.')
+    parser.add_argument('-n', '--num_procs', metavar='<INT>', type=int, default=4,
+            help='Number of cases in a batch to prepare at the same time (DEFAULT: %(default)s)')
+    parser.add_argument('-f', '--force', action='store_true',
+            help='Remove any existing review directory for a case and rerun every step.  By default an existing review '
+                'directory is reused, and only the steps whose output is missing or out of date are rerun.')
+
+    requiredNamed = parser.add_argument_group('Required Named Arguments (unless using a manifest)')
+    requiredNamed.add_argument('-p', '--psn', metavar='<PSN>', help='PSN for this case')
+    requiredNamed.add_argument('-m', '--msn', metavar='<MSN>', help='MSN for this case')
 
     thresholdArgs = parser.add_argument_group('Variant Reporting Threholds')
     thresholdArgs.add_argument('--cu', metavar='INT', default='4', help='CNV 5%% CI to use as lower bound for copy gain calling (DEFAULT: %(default)s)')
@@ -44,23 +79,16 @@ def get_args():
 
     args = parser.parse_args()
 
-    if not os.path.isfile(args.dna_bam):
-        sys.stderr.write("ERROR: '%s' does not exist!\n" % args.dna_bam)
-        sys.exit(1)
-        
-    if not os.path.isfile(args.rna_bam):
-        sys.stderr.write("ERROR: '%s' does not exist!\n" % args.rna_bam)
-        sys.exit(1)
-
-    match=re.search('(PSN)([0-9]+$)', args.psn)
-    if not match:
-        sys.stderr.write("ERROR: '%s' is not a valid PSN!\n" % args.psn)
-        sys.exit(1)
+    if args.manifest:
+        args.cases = read_manifest(args.manifest)
+    else:
+        if not (args.dna_bam and args.rna_bam and args.psn and args.msn):
+            parser.error('the DNA and RNA BAM files and the "--psn" and "--msn" options are required unless using a '
+                'manifest')
+        args.cases = [(args.psn, args.msn, args.dna_bam, args.rna_bam, args.analysis_id)]
 
-    match=re.search('(MSN)([0-9]+)$', args.msn)
-    if not match:
-        sys.stderr.write("ERROR: '%s' is not a valid MSN!\n" % args.msn)
-        sys.exit(1)
+    for psn, msn, dna_bam, rna_bam, analysis_id in args.cases:
+        validate_case(psn, msn, dna_bam, rna_bam)
 
     if args.ip:
         args.site = None
@@ -69,18 +97,66 @@ def get_args():
             sys.exit(1)
     return args
 
-def gen_wd(psn,msn):
-    new_dir = psn +'_'+ msn +'_variant_reports'
+def read_manifest(manifest):
+    cases = []
+    with open(manifest) as fh:
+        for line in fh:
+            if not line.strip() or line.startswith('#'):
+                continue
+            elems = re.split(r'[,\s]+', line.strip())
+            if len(elems) not in (4, 5):
+                sys.stderr.write("ERROR: Can not parse manifest line '%s'!\n" % line.rstrip('\n'))
+                sys.exit(1)
+            elems += [None] * (5 - len(elems))
+            cases.append(tuple(elems))
+    return cases
+
+def validate_case(psn, msn, dna_bam, rna_bam):
+    # On a rerun the BAMs have already been moved into the review directory.
+    for bam, na_type in ((dna_bam, 'dna'), (rna_bam, 'rna')):
+        if not os.path.isfile(bam) and not os.path.isfile(os.path.join(wd_name(psn, msn),
+                validate_bams(msn, bam, na_type)[0])):
+            sys.stderr.write("ERROR: '%s' does not exist!\n" % bam)
+            sys.exit(1)
+
+    match=re.search('(PSN)([0-9]+$)', psn)
+    if not match:
+        sys.stderr.write("ERROR: '%s' is not a valid PSN!\n" % psn)
+        sys.exit(1)
+
+    match=re.search('(MSN)([0-9]+)$', msn)
+    if not match:
+        sys.stderr.write("ERROR: '%s' is not a valid MSN!\n" % msn)
+        sys.exit(1)
+
+def wd_name(psn,msn):
+    return psn +'_'+ msn +'_variant_reports'
+
+def gen_wd(psn,msn,force=False,keep=()):
+    '''Make the working directory for a case.  With `force`, old data is cleared out of it, except for the files in 
+       `keep` (the BAMs, which on a rerun may only be in here).'''
+    new_dir = wd_name(psn,msn)
 
     if os.path.isdir(new_dir):
+        if not force:
+            sys.stdout.write("Reusing existing directory '%s'. Only steps that are out of date will be rerun.\n" % new_dir)
+            return new_dir
         sys.stderr.write("WARN: Directory '%s' already exists!" % new_dir)
         choice = user_query(' Overwrite current data?')
         if not choice:
             sys.stdout.write("Exiting so we don't overwrite old data! You should move old data to a new directory and try again.\n")
             sys.exit(1)
         else:
-            sys.stdout.write("Revoming old directory to make room for new data.\n")
-            shutil.rmtree(new_dir)
+            sys.stdout.write("Removing old data to make room for new data.\n")
+            for f in os.listdir(new_dir):
+                path = os.path.join(new_dir, f)
+                if f in keep:
+                    continue
+                elif os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            return new_dir
 
     sys.stdout.write("Making new directory to store data: %s.\n" % new_dir)
     os.mkdir(new_dir)
@@ -101,7 +177,7 @@ def user_query(query, default='no'):
 
     while True:
         sys.stdout.write(query + prompt)
-        choice = raw_input().lower()
+        choice = input().lower()
         if default is not None and choice == '':
             return valid[default]
         elif choice in valid:
@@ -110,13 +186,13 @@ def user_query(query, default='no'):
             sys.stderr.write("Invalid choice '%s'! Please enter 'y' or 'n'." % choice)
 
 def validate_bams(msn, bam, na_type):
-    '''Validate the BAM files passed into the script, and if OK, get a new file name, get analysis ID, and index them'''
-    match = re.search('^.*?(MSN\d+_(?:[DR]NA_)?[cv]\d+_.*)_([dr]na).bam', bam)
+    '''Validate the BAM files passed into the script, and if OK, get a new file name and the analysis ID'''
+    match = re.search(r'^.*?(MSN\d+_(?:[DR]NA_)?[cv]\d+_.*)_([dr]na).bam', bam)
     try:
         sample = match.group(2)
     except AttributeError:
         sys.stderr.write("ERROR: BAM file '%s' does not have valid MSN nomenclature and can not be processed.\n" % bam)
-        sys.exit(1) 
+        sys.exit(1)
 
     if sample != na_type:
         sys.stderr.write("ERROR: Expecting a %s file, but got file %s instead.  Check the file name and / or order!\n" % (na_type, bam))
@@ -129,17 +205,227 @@ def validate_bams(msn, bam, na_type):
         sys.exit(1)
 
     new_file_name = analysis_id + '_' + sample + '.bam'
-    
-    sys.stdout.write("\tStripping off extra prefix from %s file if exists..." % na_type.upper())
-    os.rename(bam, new_file_name)
-    sys.stdout.write("Done!\n")
+    return (new_file_name, analysis_id)
 
-    sys.stdout.write("\tIndexing %s BAM file..." % na_type.upper())
-    p = subprocess.Popen(['samtools','index', new_file_name], stdout=subprocess.PIPE)
-    p.communicate()
-    sys.stdout.write("Done!\n")
 
-    return (new_file_name, analysis_id)
+class StageStats(object):
+    '''Thread safe record of how long each stage of the review prep took (and how much data it moved) so that we can
+       report the throughput of each stage at the end of a run.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = defaultdict(list)
+
+    @contextmanager
+    def time(self, stage, item=None):
+        '''Time a stage.  Yields a dict where the stage can record the number of bytes it handled.  `item` is the
+           file or case the stage is working on, for the `--profile` trace.'''
+        info = {'bytes' : 0}
+        start = time.time()
+        with ocp_profile.record(stage, item):
+            yield info
+        with self.lock:
+            self.stages[stage].append((time.time() - start, info['bytes']))
+
+    def report(self, wall_time, out_fh=sys.stdout):
+        out_fh.write('\n{:<14}{:>8}{:>12}{:>10}{:>12}{:>10}\n'.format('Stage', 'Cases', 'Total(s)', 'Mean(s)',
+            'Cases/min', 'MB/s'))
+        for stage in ('index', 'ir_download', 'ir_extract', 'moi_report'):
+            if stage not in self.stages:
+                continue
+            times = [t for t, b in self.stages[stage]]
+            total = sum(times)
+            mbytes = sum(b for t, b in self.stages[stage]) / 1048576.0
+            out_fh.write('{:<14}{:>8}{:>12.1f}{:>10.1f}{:>12.1f}{:>10}\n'.format(stage, len(times), total,
+                total / len(times), len(times) * 60.0 / wall_time if wall_time else 0,
+                '{:.1f}'.format(mbytes / total) if mbytes and total else '-'))
+
+
+class ReviewCache(object):
+    '''Record of what went into (and came out of) each step of the review prep for a case, stored in the review dir, 
+       so that a rerun can skip any step that is still up to date.  Files are compared by size and mtime, and by
+       checksum if only the mtime changed (e.g. the file was copied back in).  For big files like BAMs, the checksum is
+       only taken over the start and end of the file.'''
+    cache_file = '.review_cache.json'
+
+    def __init__(self, work_dir):
+        self.path = os.path.join(work_dir, self.cache_file)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as fh:
+                self.steps = json.load(fh)
+        except (IOError, ValueError):
+            self.steps = {}
+
+    @staticmethod
+    def checksum(path, blocksize=1<<20):
+        digest = hashlib.sha256()
+        size = os.path.getsize(path)
+        with open(path, 'rb') as fh:
+            if size <= 8 * blocksize:
+                for block in iter(lambda: fh.read(blocksize), b''):
+                    digest.update(block)
+            else:
+                digest.update(fh.read(blocksize))
+                fh.seek(-blocksize, os.SEEK_END)
+                digest.update(fh.read(blocksize))
+        return digest.hexdigest()
+
+    def fingerprint(self, path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime, self.checksum(path)]
+
+    def same_file(self, path, fingerprint):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        size, mtime, checksum = fingerprint
+        if st.st_size != size:
+            return False
+        return st.st_mtime == mtime or self.checksum(path) == checksum
+
+    def is_fresh(self, step, inputs, params=None):
+        '''Check that a step was run on the same input files and params, and that its output files are unchanged.'''
+        with self.lock:
+            entry = self.steps.get(step)
+        if not entry or entry['params'] != params:
+            return False
+        if sorted(entry['inputs']) != sorted(inputs):
+            return False
+        return all(self.same_file(f, fp) for f, fp in list(entry['inputs'].items()) + list(entry['outputs'].items()))
+
+    def record(self, step, inputs, outputs, params=None):
+        entry = {
+            'inputs'  : dict((f, self.fingerprint(f)) for f in inputs),
+            'outputs' : dict((f, self.fingerprint(f)) for f in outputs),
+            'params'  : params,
+        }
+        with self.lock:
+            self.steps[step] = entry
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(self.steps, fh, indent=2)
+            os.rename(tmp, self.path)
+
+
+class IrError(Exception):
+    pass
+
+
+class IrClient(object):
+    '''Small in-process client for the IR REST API.  Keeps a pool of keep-alive connections to the server that are
+       shared by all of the worker threads, rather than starting an `ir_api_retrieve.py` process (and a new connection)
+       for every analysis.  The IR servers use self signed certificates, so the certificate is not verified, just like
+       `ir_api_retrieve.py`.'''
+    def __init__(self, ip, token, pool_size=4, timeout=300):
+        if not re.match(r'https?://', ip):
+            ip = 'https://' + ip
+        url = urllib.parse.urlsplit(ip)
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.token = token
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout,
+                context=ssl._create_unverified_context())
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    @contextmanager
+    def _request(self, path):
+        '''Send a GET request over a pooled connection and yield the response.  A connection the server has dropped is
+           replaced once before giving up.'''
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        for attempt in (1, 2):
+            try:
+                conn.request('GET', path, headers={'Authorization' : self.token, 'Connection' : 'keep-alive'})
+                resp = conn.getresponse()
+                break
+            except (http.client.HTTPException, OSError) as err:
+                conn.close()
+                if attempt == 2:
+                    raise IrError('Can not connect to IR server {}: {}'.format(self.netloc, err))
+                conn = self._connect()
+
+        try:
+            if resp.status != 200:
+                resp.read()
+                raise IrError('IR server returned {} {} for {}'.format(resp.status, resp.reason, path))
+            yield resp
+            # Make sure the whole response is read before the connection is reused.
+            resp.read()
+        except BaseException:
+            conn.close()
+            raise
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def get_json(self, path, **params):
+        if params:
+            path += '?' + urllib.parse.urlencode(params)
+        with self._request(path) as resp:
+            try:
+                return json.loads(resp.read().decode('utf-8'))
+            except ValueError as err:
+                raise IrError('Can not parse IR server response for {}: {}'.format(path, err))
+
+    def download(self, url, outfile, blocksize=1<<20):
+        '''Stream a file from the server into `outfile`.  Returns the number of bytes written.'''
+        url = urllib.parse.urlsplit(url)
+        path = url.path + ('?' + url.query if url.query else '')
+        size = 0
+        with self._request(path) as resp, open(outfile, 'wb') as out_fh:
+            for block in iter(lambda: resp.read(blocksize), b''):
+                out_fh.write(block)
+                size += len(block)
+        return size
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def retrieve(self, analysis_id, work_dir):
+        '''Download the variant data zip file for an analysis into `work_dir`, the same way `ir_api_retrieve.py` does
+           so that `extract_ir_data.sh` can find it.  Returns the size of the download.'''
+        data = self.get_json(ir_analysis_api, format='json', name=analysis_id)
+        if not data:
+            raise IrError('No analysis named {} on the IR server'.format(analysis_id))
+        try:
+            link = data[0]['data_links']['unfiltered_variants']
+        except (KeyError, IndexError, TypeError):
+            raise IrError('No variant data link for analysis {} on the IR server'.format(analysis_id))
+        return self.download(link, os.path.join(work_dir, analysis_id + '_download.zip'))
+
+
+def index_bam(bam, na_type, stats, cache):
+    # Don't need to reindex if the index we made last time is still there and newer than the BAM.
+    bai = bam + '.bai'
+    if (cache.is_fresh('index_' + na_type, [bam]) and os.path.isfile(bai) 
+            and os.path.getmtime(bai) >= os.path.getmtime(bam)):
+        sys.stdout.write("\t%s BAM index is up to date.\n" % na_type.upper())
+        return
+
+    sys.stdout.write("\tIndexing %s BAM file %s.\n" % (na_type.upper(), bam))
+    with stats.time('index', bam) as info:
+        p = subprocess.Popen(['samtools','index', bam], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result,error = p.communicate()
+        info['bytes'] = os.path.getsize(bam)
+    if p.returncode != 0:
+        sys.stderr.write("ERROR: Can not index the %s BAM file '%s': %s\n" % (na_type.upper(), bam, error.decode('ascii')))
+        sys.exit(1)
+    cache.record('index_' + na_type, [bam], [bai])
+    sys.stdout.write("\tDone indexing %s BAM file.\n" % na_type.upper())
 
 def gen_retr_cmd(arg_list):
     '''Generate a option list to pass to ir api retrieve based on how we want to run.'''
@@ -151,74 +437,140 @@ def gen_retr_cmd(arg_list):
     else:
         return ['ir_api_retrieve.py', '-i', arg_list['ip'], '-t', arg_list['token'], arg_list['analysis_id']]
 
-def get_ir_data(ir_params):
-    '''Use ir_api_retrieve and extract_ir_data to get IR data for review'''
+def fetch_ir_data(ir_arg_list, work_dir, client=None):
+    '''Get the IR data zip file into `work_dir`, either in-process with the IR client or with ir_api_retrieve.  Returns
+       the size of the download if known.'''
+    if client:
+        return client.retrieve(ir_arg_list['analysis_id'], work_dir)
+
+    p = subprocess.Popen(gen_retr_cmd(ir_arg_list),stdout=subprocess.PIPE,stderr=subprocess.PIPE,cwd=work_dir)
+    result,error = p.communicate()
+    if p.returncode != 0 or error:
+        raise IrError(error.decode('ascii', 'replace'))
+    return 0
+
+def get_ir_data(ir_arg_list, work_dir, stats, client=None, retry_budget=120, delay=5):
+    '''Use ir_api_retrieve (or the IR client) and extract_ir_data to get IR data for review.  If the retrieval fails,
+       keep trying with an exponential backoff (5, 10, 20... seconds) until the next wait would go over `retry_budget`
+       seconds in total.'''
     count = 1
-    while count:
-        p = subprocess.Popen(ir_params,stdout=subprocess.PIPE,stderr=subprocess.PIPE) 
-        result,error = p.communicate()
-        if p.returncode != 0 or error:
-            sys.stderr.write("\nError retrieving data: {}\n".format(error))
-            if count == 3:
-                sys.stderr.write('\nERROR: Can not retrieve data from IR server. Max attempts reached (3).  Check the connection and try again!\n')
+    waited = 0
+    with stats.time('ir_download', ir_arg_list['analysis_id']) as info:
+        while True:
+            try:
+                info['bytes'] = fetch_ir_data(ir_arg_list, work_dir, client)
+                break
+            except IrError as err:
+                sys.stderr.write("\nError retrieving data: {}\n".format(err))
+            if waited + delay > retry_budget:
+                sys.stderr.write('\nERROR: Can not retrieve data from IR server. Gave up after {} attempts ({} seconds of '
+                    'retries).  Check the connection and try again!\n'.format(count, waited))
                 sys.exit(1)
-            sys.stderr.write('\nWaiting 5 seconds and trying again [attempt: {}]...\n'.format(count+1))
-            sleep(5)
+            sys.stderr.write('\nWaiting {} seconds and trying again [attempt: {}]...\n'.format(delay, count+1))
+            sleep(delay)
+            waited += delay
+            delay *= 2
             count += 1
-        else:
-            break
-    sys.stdout.write('Done!\n')
-
-    sys.stdout.write("Extracting IR results...")
-    p = subprocess.Popen('extract_ir_data.sh', stdout=subprocess.PIPE)
-
-    # Check that helper programs installed and can be executed
-    verify_env()
-    p.communicate()
-    sys.stdout.write("Done!\n")
+    sys.stdout.write('Done getting data from IR for {}.\n'.format(ir_arg_list['analysis_id']))
 
-def gen_moi_report(msn,vcf,thresholds):
-    filename = msn + '_MATCH_MOI_Report.txt'
+    sys.stdout.write("Extracting IR results for {}.\n".format(ir_arg_list['analysis_id']))
+    with stats.time('ir_extract', ir_arg_list['analysis_id']):
+        p = subprocess.Popen('extract_ir_data.sh', stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=work_dir)
+        result,error = p.communicate()
+    if p.returncode != 0:
+        sys.stderr.write("ERROR: Can not extract the IR data for {}: {}\n".format(ir_arg_list['analysis_id'],
+            error.decode('ascii', 'replace')))
+        sys.exit(1)
+    sys.stdout.write("Done extracting IR results for {}.\n".format(ir_arg_list['analysis_id']))
+
+def get_vcf(work_dir):
+    '''Get the VCF file extracted from the IR data for processing.'''
+    vcf_dir = os.path.join(work_dir, 'vcfs')
+    files = [f for f in os.listdir(vcf_dir) if fnmatch.fnmatch(f, '*.vcf')] if os.path.isdir(vcf_dir) else []
+    if not files:
+        sys.stderr.write("ERROR: Can not find a VCF file in the IR data in {}!\n".format(work_dir))
+        sys.exit(1)
+    return os.path.join(vcf_dir, files[0])
 
-    cmd = ['match_moi_report.pl']
+def ir_pipeline(run_id, ir_arg_list, msn, thresholds, work_dir, stats, client, retry_budget, cache, moi_client=None):
+    '''Get the IR data and generate the MOI report as soon as the VCF is ready.  Either step is skipped if the data 
+       from an earlier run is still there and up to date.'''
+    if cache.is_fresh('ir_data', [], {'analysis_id' : run_id}):
+        sys.stdout.write('IR data for analysis ID {} is up to date.\n'.format(run_id))
+    else:
+        sys.stdout.write('Getting data from IR for analysis ID {}.\n'.format(run_id))
+        sys.stdout.flush()
+        get_ir_data(ir_arg_list, work_dir, stats, client, retry_budget)
+        cache.record('ir_data', [], [get_vcf(work_dir)], {'analysis_id' : run_id})
+
+    vcf = get_vcf(work_dir)
+    filename = os.path.join(work_dir, msn + '_MATCH_MOI_Report.txt')
+    if cache.is_fresh('moi_report', [vcf], thresholds) and os.path.isfile(filename):
+        sys.stdout.write("MATCH MOI Report for {} is up to date.\n".format(msn))
+        return
+    # Only gets recorded if the report was made; gen_moi_report() exits if not.
+    gen_moi_report(msn, vcf, thresholds, work_dir, stats, moi_client)
+    cache.record('moi_report', [vcf], [filename], thresholds)
+
+def remove_stale(filename):
+    '''Don't leave a report from an earlier run (and maybe other thresholds) behind when making a new one fails.'''
+    if os.path.isfile(filename):
+        os.remove(filename)
+
+def gen_moi_report(msn,vcf,thresholds,work_dir,stats,moi_client=None):
+    '''Run match_moi_report.pl on the VCF, or have a MOI server write the same report if we have one.'''
+    filename = os.path.join(work_dir, msn + '_MATCH_MOI_Report.txt')
+
+    params = []
     for key in thresholds:
         if thresholds[key]:
-            cmd.extend([key,thresholds[key]])
-    cmd.extend(['-o',filename,vcf])
-
-    sys.stdout.write("Generating a MATCH MOI Report for {}...".format(msn))
-    p=subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    result,error = p.communicate()
-    sys.stdout.write("Done!\n")
+            params.extend([key,thresholds[key]])
+
+    sys.stdout.write("Generating a MATCH MOI Report for {}.\n".format(msn))
+    if moi_client:
+        with stats.time('moi_report', vcf):
+            try:
+                report = moi_client.moi_text(vcf, params)
+            except moi_server.MoiServerError as err:
+                remove_stale(filename)
+                sys.stderr.write("ERROR: Can not generate a MATCH MOI Report for {}: {}\n".format(msn, err))
+                sys.exit(1)
+            with open(filename, 'w') as fh:
+                fh.write(report)
+        sys.stdout.write("Done generating MOI report for {}.\n".format(msn))
+        sys.stdout.write("Writing results to {}...\n{}".format(filename, report))
+        return
+
+    cmd = ['match_moi_report.pl'] + params + ['-o',filename,vcf]
+    with stats.time('moi_report', vcf):
+        p=subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result,error = p.communicate()
+    if p.returncode != 0 or not os.path.isfile(filename):
+        remove_stale(filename)
+        sys.stderr.write("ERROR: Can not generate a MATCH MOI Report for {}: {}\n".format(msn,
+            error.decode('ascii', 'replace')))
+        sys.exit(1)
+    sys.stdout.write("Done generating MOI report for {}.\n".format(msn))
     sys.stdout.write(result.decode('ascii'))
 
-def verify_env():
-    prog_list = ['match_moi_report.pl', 'ir_api_retrieve.py', 'extract_ir_data.sh', 'samtools']
+def verify_env(in_process=False, moi_server=False):
+    prog_list = ['extract_ir_data.sh', 'samtools']
+    if not moi_server:
+        prog_list.append('match_moi_report.pl')
+    if not in_process:
+        prog_list.append('ir_api_retrieve.py')
     for p in prog_list:
         if not os.popen('which %s' % p).read():
             sys.stderr.write("ERROR: Can not find helper program '{program}' in your $PATH.  Please be sure that '{program}' is installed before continuing.\n".format(program=p))
             sys.exit(1)
 
-def main():
-    args = get_args()
-
-    # Check that helper programs installed and can be executed
-    verify_env()
-    
-    sys.stdout.write("Validating DNA and RNA BAM files...\n")
-    (new_dna_bam, dna_run_id) = validate_bams(args.msn, args.dna_bam, 'dna')
-    (new_rna_bam, rna_run_id) = validate_bams(args.msn, args.rna_bam, 'rna')
-
-    # Generate a new working directory for our data and move the BAMs there.
-    work_dir = gen_wd(args.psn, args.msn)
-    shutil.move(new_dna_bam, work_dir)
-    shutil.move(new_dna_bam + '.bai', work_dir)
-    shutil.move(new_rna_bam, work_dir)
-    shutil.move(new_rna_bam + '.bai', work_dir)
-    os.chdir(work_dir)
+def setup_case(psn, msn, dna_bam, rna_bam, analysis_id, force=False):
+    '''Validate the BAMs and the analysis ID for a case, and move the BAMs into a new working directory.'''
+    (new_dna_bam, dna_run_id) = validate_bams(msn, dna_bam, 'dna')
+    (new_rna_bam, rna_run_id) = validate_bams(msn, rna_bam, 'rna')
 
     # Determine the Run ID
-    if not args.analysis_id:
+    if not analysis_id:
         if dna_run_id == rna_run_id:
             run_id = dna_run_id
         else:
@@ -226,7 +578,21 @@ def main():
             sys.stderr.write("\tDNA: %s\n\tRNA: %s" % (dna_run_id, rna_run_id))
             sys.exit(1)
     else:
-        run_id = args.analysis_id 
+        run_id = analysis_id
+
+    # Generate a new working directory for our data and move the BAMs there, stripping off any extra prefix.
+    work_dir = gen_wd(psn, msn, force, keep=(new_dna_bam, new_rna_bam))
+    new_dna_bam = os.path.join(work_dir, new_dna_bam)
+    new_rna_bam = os.path.join(work_dir, new_rna_bam)
+    for bam, new_bam in ((dna_bam, new_dna_bam), (rna_bam, new_rna_bam)):
+        if os.path.isfile(bam):
+            shutil.move(bam, new_bam)
+    return msn, run_id, work_dir, new_dna_bam, new_rna_bam
+
+def prepare_case(case, args, moi_report_params, stats, client=None):
+    '''Index both BAMs while we get the IR data and run the MOI report.  None of these depend on each other.'''
+    msn, run_id, work_dir, new_dna_bam, new_rna_bam = case
+    cache = ReviewCache(work_dir)
 
     # Generate an IR command and retrieve data.
     ir_arg_list = {
@@ -236,17 +602,35 @@ def main():
         'token'       : args.token
     }
 
-    sys.stdout.write('Getting data from IR for analysis ID {}...'.format(run_id))
-    sys.stdout.flush()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        jobs = [
+            executor.submit(index_bam, new_dna_bam, 'dna', stats, cache),
+            executor.submit(index_bam, new_rna_bam, 'rna', stats, cache),
+            executor.submit(ir_pipeline, run_id, ir_arg_list, msn, moi_report_params, work_dir, stats, client,
+                args.retry_budget, cache, args.moi_client),
+        ]
+        try:
+            for job in as_completed(jobs):
+                job.result()
+        except BaseException:
+            for job in jobs:
+                job.cancel()
+            raise
+    return work_dir
+
+def main():
+    args = get_args()
+    ocp_profile.start('variant_review', args)
+
+    # Check that helper programs installed and can be executed
+    verify_env(in_process=bool(args.ip), moi_server=bool(args.moi_server))
+    args.moi_client = moi_server.connect(args.moi_server) if args.moi_server else None
 
-    get_ir_data(gen_retr_cmd(ir_arg_list))
+    # Set up all of the working dirs up front, since we might have to ask about overwriting old data.
+    sys.stdout.write("Validating DNA and RNA BAM files...\n")
+    with ocp_profile.stage('setup_cases'):
+        cases = [setup_case(*case, force=args.force) for case in args.cases]
 
-    # Get the VCF file for processing.
-    files = os.listdir('vcfs')
-    if files:
-        if fnmatch.fnmatch(files[0], '*.vcf'):
-            vcf = files[0]
-    
     # Generate a MOI report and store it.
     moi_report_params = {
         '--cu'    : args.cu,
@@ -256,11 +640,42 @@ def main():
         '--freq'  : args.freq
     }
 
-    gen_moi_report(args.msn,'vcfs/' + vcf,moi_report_params)
-    sys.stdout.write('\nReport generation complete.  Results can be found in {}.\n'.format(os.getcwd()))
+    stats = StageStats()
+    client = IrClient(args.ip, args.token, pool_size=args.num_procs) if args.ip else None
+    start = time.time()
+
+    with ocp_profile.stage('prepare_cases'):
+        if len(cases) == 1:
+            work_dir = prepare_case(cases[0], args, moi_report_params, stats, client)
+            sys.stdout.write('\nReport generation complete ({:.1f} seconds).  Results can be found in {}.\n'.format(
+                time.time() - start, os.path.abspath(work_dir)))
+        else:
+            failed = []
+            with ThreadPoolExecutor(max_workers=args.num_procs) as executor:
+                jobs = dict((executor.submit(prepare_case, case, args, moi_report_params, stats, client), case[0])
+                    for case in cases)
+                for count, job in enumerate(as_completed(jobs), 1):
+                    try:
+                        work_dir = job.result()
+                        sys.stdout.write('[{}/{}] Report generation complete for {}.  Results can be found in {}.\n'.format(
+                            count, len(cases), jobs[job], os.path.abspath(work_dir)))
+                    except (SystemExit, Exception) as err:
+                        sys.stderr.write('[{}/{}] ERROR: Could not prepare {} for review! {}\n'.format(count, len(cases),
+                            jobs[job], err if str(err) not in ('', '1') else ''))
+                        failed.append(jobs[job])
+            sys.stdout.write('\nPrepared {} of {} cases in {:.1f} seconds.\n'.format(len(cases) - len(failed), len(cases),
+                time.time() - start))
+            if failed:
+                sys.stderr.write('Failed cases: {}\n'.format(', '.join(failed)))
+
+    if client:
+        client.close()
+    stats.report(time.time() - start)
+    if len(cases) > 1 and failed:
+        sys.exit(1)
 
 if __name__ == '__main__':
-    try: 
+    try:
         main()
     except (KeyboardInterrupt,SystemExit):
         sys.exit(1)